@@ -385,8 +385,9 @@ class BrowserFrame(wx.Frame):
         if os.path.isfile(runName):
             self.fname.SetValue(runName)
             
-            # Here we open and process the run file
-            runObj = plottools.get_run(runName)
+            # Here we open and process the run file.  TDMS runs are
+            # opened lazily so channels are only read when plotted
+            runObj = plottools.get_run(runName, lazy=True)
 
             self.runObj = runObj
 
@@ -440,10 +441,18 @@ class BrowserFrame(wx.Frame):
         self.statusbar.SetStatusText('Tree rebuilt')
 
     def OnDataClick(self, evt):
+        # The grid shows every channel so read in the rest of a lazy run
+        if self.runObj.filetype == 'AM-tdms':
+            self.runObj.readAll()
         frame = DataFrame(self.runObj)
         frame.Show()
         
     def OnDataEUClick(self, evt):
+        if self.runObj.filetype == 'AM-tdms':
+            self.runObj.readAll()
+        # The grid also shows the special gauge outputs
+        if self.runObj.filetype in ['AM-obc', 'AM-tdms']:
+            self.runObj.materializeSpecials()
         frame = DataFrame(self.runObj, EU=True)
         frame.Show()
 
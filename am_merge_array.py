@@ -45,10 +45,38 @@ import utm
 import plottools as plottools
 import pandas as pd
 import numpy as np
-from filetypes import STDFile
+from filetypes import STDFile, SpecialOutputs
 import datatools as dt
 import re
 
+# Merge channel codes for the computed special gauges.  Each gauge has 6 codes
+# (Fx, Fy, Fz, Mx, My, Mz) starting at the code given here
+GaugeCodes = {807: 'Rotor', 813: 'Stator', 830: 'SOF1', 840: 'SOF2',
+              850: 'Kistler', 860: '6DOF1', 870: '6DOF2', 890: '6DOF3',
+              900: '6DOF4', 910: '6DOF5', 920: '6DOF6', 970: 'Kistler3',
+              980: 'Kistler3_2'}
+
+
+def merge_channels(mrg_chans, mode_chan):
+    """ Returns the list of run channels needed to merge the channels
+        in mrg_chans.  This is passed as the channels= projection when
+        reading the run so only these are read from the data file.
+    """
+    # Always need the mode, approach speed, run kind and chan 0 for the length
+    channels = [0, 336, 343, mode_chan]
+    for chan in mrg_chans:
+        if not chan.isdigit():
+            channels.append(chan)
+        elif int(chan) < 800:
+            channels.append(int(chan))
+        elif int(chan) == 825:
+            channels.append('Prop_RPM_signed')
+        else:
+            for code, gauge in GaugeCodes.items():
+                if int(chan) >= code and int(chan) < code + 6:
+                    channels.append(gauge+'_'+SpecialOutputs[int(chan) - code])
+    return channels
+
 
 def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):  
 
@@ -155,8 +183,15 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     #----------------------------------------
     logfile.write('\nProcessing run: run-'+str(runnumber))
     logfile.write('\n------------------------------------------\n')
-    
-    runObj = plottools.get_run(fullname)
+
+    try:
+        mode_chan = int(mrg_input['MODE'])
+    except:
+        # For CB12 mode chan name 
+        mode_chan = 'script_mode'
+
+    # Only read the channels used by the merge
+    runObj = plottools.get_run(fullname, channels=merge_channels(mrg_chans, mode_chan))
 
 
     #--------------------------------------
@@ -182,12 +217,6 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     c_sqrtlambda = pow(c_lambda, .5)
     c_FSdt = c_dt * c_sqrtlambda
     c_length = mrg_input['LENGTH']
-    
-    try:
-        mode_chan = int(mrg_input['MODE'])
-    except:
-        # For CB12 mode chan name 
-        mode_chan = 'script_mode'
 
     u_chan = int(mrg_input['U_CHAN'])
     v_chan = int(mrg_input['V_CHAN'])
@@ -283,7 +312,7 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
             
             if mrg_chans[i] < 800:              # Normal Channel
                 EUdata = runObj.getEUData(mrg_chans[i]).values
-                EUdata -= runObj.avgEUzeros[mrg_chans[i]]*mrg_zero[i]
+                EUdata -= runObj.avgEUzeros[runObj.chan_names[mrg_chans[i]]]*mrg_zero[i]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                         
                 if mrg_scale[i] >= 3:
@@ -308,10 +337,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     
             elif mrg_chans[i] == 804:           #Filtered ADCP u (ft/s) from ADCP (ft/s)
                 EUdata = runObj.u_adcp.copy()
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 70:
-                        EUdata[t] = Uprev
-                    Uprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 70, Uprev)
+                if len(EUdata):
+                    Uprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata -= ((q_FS/57.296)*ADCPLoc[2])
                 # We need this later on for alpha/beta calcs so store it
@@ -319,10 +347,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
                 
             elif mrg_chans[i] == 805:           #Filtered ADCP v (ft/s) from ADCP (ft/s)
                 EUdata = runObj.v_adcp.copy()
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 15:
-                        EUdata[t] = Vprev
-                    Vprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 15, Vprev)
+                if len(EUdata):
+                    Vprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata += (((p_FS/57.296)*ADCPLoc[2])-((r_FS/57.296)*ADCPLoc[0]))
                 # We need this later on for alpha/beta calcs so store it
@@ -330,10 +357,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
                 
             elif mrg_chans[i] == 806:           #Filtered ADCP w (ft/s) from ADCP (ft/s)
                 EUdata = runObj.w_adcp.copy()
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 15:
-                        EUdata[t] = Wprev
-                    Wprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 15, Wprev)
+                if len(EUdata):
+                    Wprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata += (((q_FS/57.296)*ADCPLoc[0])-((p_FS/57.296)*ADCPLoc[1]))
                 # We need this later on for alpha/beta calcs so store it
@@ -341,10 +367,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     
             elif mrg_chans[i] == 884:           #Filtered ADCP u (ft/s) from ADCP (kts)
                 EUdata = runObj.u_adcp.copy() * 1.6878
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 70:
-                        EUdata[t] = Uprev
-                    Uprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 70, Uprev)
+                if len(EUdata):
+                    Uprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata -= ((q_FS/57.296)*ADCPLoc[2])
                 # We need this later on for alpha/beta calcs so store it
@@ -352,10 +377,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
                 
             elif mrg_chans[i] == 885:           #Filtered ADCP v (ft/s) from ADCP (kts)
                 EUdata = runObj.v_adcp.copy() * 1.6878
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 15:
-                        EUdata[t] = Vprev
-                    Vprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 15, Vprev)
+                if len(EUdata):
+                    Vprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata += (((p_FS/57.296)*ADCPLoc[2])-((r_FS/57.296)*ADCPLoc[0]))
                 # We need this later on for alpha/beta calcs so store it
@@ -363,10 +387,9 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
                 
             elif mrg_chans[i] == 886:           #Filtered ADCP w (ft/s) from ADCP (kts)
                 EUdata = runObj.w_adcp.copy() * 1.6878
-                for t in range(len(EUdata)):
-                    if abs(EUdata[t]) > 15:
-                        EUdata[t] = Wprev
-                    Wprev = EUdata[t]
+                EUdata = dt.limitFilter(EUdata, 15, Wprev)
+                if len(EUdata):
+                    Wprev = EUdata[-1]
                 EUdata *= pow(c_lambda, mrg_scale[i])
                 EUdata += (((q_FS/57.296)*ADCPLoc[0])-((p_FS/57.296)*ADCPLoc[1]))
                 # We need this later on for alpha/beta calcs so store it
@@ -1013,16 +1036,14 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     qrad = np.radians(rundata.q)
     rrad = np.radians(rundata.r)
     
-    pradf = dt.butter_lowpass_filter(prad, .01/rundata.dt, 1/rundata.dt, 2)
-    qradf = dt.butter_lowpass_filter(qrad, .01/rundata.dt, 1/rundata.dt, 2)
-    rradf = dt.butter_lowpass_filter(rrad, .01/rundata.dt, 1/rundata.dt, 2)
+    pradf, qradf, rradf = dt.butter_lowpass_filter(np.column_stack([prad, qrad, rrad]),
+                                                   .01/rundata.dt, 1/rundata.dt, 2).T
     
 
     # Filter angles so derivatives are smooth - bit resolution noise makes original
     # signal steppy.
-    thetaradf = dt.butter_lowpass_filter(thetarad, .01/rundata.dt, 1/rundata.dt, 2)
-    phiradf = dt.butter_lowpass_filter(phirad, .01/rundata.dt, 1/rundata.dt, 2)
-    psiradf = dt.butter_lowpass_filter(psirad, .01/rundata.dt, 1/rundata.dt, 2)
+    thetaradf, phiradf, psiradf = dt.butter_lowpass_filter(np.column_stack([thetarad, phirad, psirad]),
+                                                           .01/rundata.dt, 1/rundata.dt, 2).T
 
     # Now we get thetadot, psidot, phidot by differentiating
     # add a point to the end to keep array size the same
@@ -1066,14 +1087,13 @@ def MergeRun(fullname, runnumber, std_dir, merge_file='MERGE.INP'):
     # We need to get the velocities from adcp,
     # These are raw adcp velocities so first do a spike filter to remove
     # adcp dropouts
-    u_adcp = dt.spikeFilter(rundata.u_adcp_raw, 10)
-    v_adcp = dt.spikeFilter(rundata.v_adcp_raw, 10)
-    w_adcp = dt.spikeFilter(rundata.w_adcp_raw, 10)
+    u_adcp, v_adcp, w_adcp = dt.spikeFilter(np.column_stack([rundata.u_adcp_raw,
+                                                             rundata.v_adcp_raw,
+                                                             rundata.w_adcp_raw]), 10).T
 
     # Now filter to smooth bit noise steps
-    u_adcpf = dt.butter_lowpass_filter(u_adcp, .01/rundata.dt, 1/rundata.dt, 2)
-    v_adcpf = dt.butter_lowpass_filter(v_adcp, .01/rundata.dt, 1/rundata.dt, 2)
-    w_adcpf = dt.butter_lowpass_filter(w_adcp, .01/rundata.dt, 1/rundata.dt, 2)
+    u_adcpf, v_adcpf, w_adcpf = dt.butter_lowpass_filter(np.column_stack([u_adcp, v_adcp, w_adcp]),
+                                                         .01/rundata.dt, 1/rundata.dt, 2).T
 
     # There might be a misalignment of the adcp in Pitch
     # Do this to try and correct for this before proceeding
@@ -0,0 +1,380 @@
+# bench_dynos.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    bench_dynos.py - Times the special gauge computations on a synthetic
+    run and checks them against the original per record versions.
+
+    Usage:
+        python bench_dynos.py [nrecs [nchans [nlegacy]]]
+
+    A cal file with a prop (Rotor), 6dof (Stator), kistler and kistler3
+    gauge is written to a scratch directory and parsed with
+    CalFile.ParseGauge, so the gauges get the same cal dictionaries as
+    from a real cal file.  The synthetic run has nrecs records (default
+    200000) of nchans channels (default 400) with a zeros section at the
+    start and the prop turning after it.
+
+    For each gauge the compute() throughput (samples/s) and peak memory
+    (tracemalloc) are reported, as is the full computeSpecials path
+    (GaugeEngine) whole and in blocks on the thread pool.  The original
+    per record versions are run on the first nlegacy records (default
+    5000) and the largest difference is reported.  Last, a NaN is put
+    into one Stator input, in the zeros section and in the run, to check
+    that the other gauges' zeros and outputs do not change.
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import dynos_array as dynos
+from calfile_new import CalFile
+from filetypes import OBCFile, SpecialOutputs
+from runphase import RunPhases
+
+# The gauges of the synthetic cal: name, cal section, ParseGauge type, class
+Gauges = [('Rotor', 'ROTOR', 'prop', dynos.Rot_Dyno6),
+          ('Stator', 'STATOR', '6dof', dynos.Dyno6),
+          ('Kistler', 'KISTLER', 'kistler', dynos.Kistler6),
+          ('Kistler3', 'KISTLER3', 'kistler3', dynos.Kistler3)]
+
+# The gauge input channels of each ParseGauge type
+GaugeInputs = {'prop': ['Fx', 'Fy', 'Fz', 'Mx', 'My', 'Mz'],
+               '6dof': ['Fx', 'Fy', 'Fz', 'Mx', 'My', 'Mz'],
+               'kistler': ['%s%d' % (f, i) for i in range(1, 5) for f in ['Fx', 'Fy', 'Fz']],
+               'kistler3': ['%s%d' % (f, i) for i in range(1, 4) for f in ['Fx', 'Fy', 'Fz']]}
+
+# Nav and mode channels of the synthetic run (OBC names)
+NavNames = ['ln200_roll', 'ln200_pitch', 'ln200_heading', 'prop_rpm', 'prop_position', 'mode325']
+
+
+def matrix_rows(name, matrix):
+    """ The cal file lines of a 6 x 6 matrix """
+    return ['%s_row%d = %s' % (name, i+1, ' '.join('%.9g' % x for x in row))
+            for i, row in enumerate(matrix)]
+
+
+def synthetic_cal(dirname, chan_names, seed=0):
+    """ Writes a cal file with the Gauges to dirname and returns the
+        ParseGauge dictionary of each gauge, {name: calfile dict}.
+        The gauge inputs are the first channels of chan_names.
+    """
+    rng = np.random.default_rng(seed)
+    lines = ['[DEFAULT]', 'cal_file_version = 201502032', 'cal_file_date = 01 Jan 2024',
+             'obc_channels = %d' % len(chan_names), 'SOF1 = False', 'SOF2 = False',
+             'rotor = True', 'stator = True', 'kistler = True', 'kistler3 = True',
+             'deck = False', 'num_6DOF_dynos = 0', '']
+    chan = 0
+    for name, section, kind, cls in Gauges:
+        lines.append('[%s]' % section)
+        for item in GaugeInputs[kind]:
+            lines.append('%s = %s' % (item, chan_names[chan]))
+            chan += 1
+        if kind.startswith('kistler'):
+            lines.extend(['xdist = 3.0', 'ydist = 2.0', 'gagex = 57.79', 'gagey = 0.0',
+                          'gagez = -10.23'])
+        else:
+            lines.append('arm = 0.16')
+        if kind == 'prop':
+            lines.append('position = 9710')
+        lines.extend(['weight = %.3f' % rng.uniform(-6.0, 6.0),
+                      'armx = %.3f' % rng.uniform(-5.0, 5.0),
+                      'army = %.3f' % rng.uniform(-2.0, 2.0),
+                      'armz = %.3f' % rng.uniform(-5.0, 5.0)])
+        lines.extend(matrix_rows('int', np.eye(6) + rng.normal(scale=1e-3, size=(6, 6))))
+        lines.extend(matrix_rows('orient', np.eye(6)[rng.permutation(6)]))
+        lines.append('')
+
+    calfile = os.path.join(dirname, 'bench.cal')
+    with open(calfile, 'w') as f:
+        f.write('\n'.join(lines))
+    cal = CalFile('bench.cal', dirname)
+    return dict((name, cal.ParseGauge(section, type=kind)) for name, section, kind, cls in Gauges)
+
+
+def synthetic_run(nrecs=200000, nchans=400, seed=0):
+    """ Returns the EU frame of a synthetic run.  The first records are
+        the zeros section, then the prop spins up.
+    """
+    rng = np.random.default_rng(seed)
+    names = ['chan%03d' % i for i in range(nchans - len(NavNames))] + NavNames
+    data = np.asfortranarray(rng.normal(size=(nrecs, nchans)))
+    frame = pd.DataFrame(data, columns=names, copy=False)
+
+    t = np.arange(nrecs) * 0.01
+    nzeros = min(1000, nrecs // 10)
+    frame['ln200_roll'] = 2.0 * np.sin(0.3 * t)
+    frame['ln200_pitch'] = 5.0 * np.sin(0.1 * t)
+    frame['ln200_heading'] = np.mod(20.0 * t, 360.0)
+    rpm = np.where(np.arange(nrecs) < nzeros, 0.0, 600.0)
+    frame['prop_rpm'] = rpm
+    counts = np.cumsum(rpm / 60.0 * 0.01 * 20000.0)
+    frame['prop_position'] = np.mod(counts + 9710.0, 20000.0) - 1000.0
+    frame['mode325'] = np.where(np.arange(nrecs) < nzeros, RunPhases.ZEROS, RunPhases.EXECUTE)
+    return frame
+
+
+def body_angles(frame):
+    """ The bodyAngles list passed to the gauge compute methods """
+    return [np.radians(frame['ln200_roll'].values), np.radians(frame['ln200_pitch'].values),
+            np.radians(frame['ln200_heading'].values),
+            'ln200_roll', 'ln200_pitch', 'ln200_heading', 'prop_rpm']
+
+
+def legacy_transform(u, v, w, phi, theta, psi):
+    """ The original per record datatools.doTransform (toInertial) """
+    unew = []
+    vnew = []
+    wnew = []
+    for n in range(len(u)):
+        a1 = np.cos(psi[n]) * np.cos(theta[n])
+        a2 = (np.cos(psi[n])*np.sin(phi[n]*np.sin(theta[n])) - (np.sin(psi[n])*np.cos(phi[n])))
+        a3 = (np.cos(phi[n])*np.cos(psi[n])*np.sin(theta[n])) + (np.sin(phi[n])*np.sin(psi[n]))
+        b1 = np.sin(psi[n]) * np.cos(theta[n])
+        b2 = (np.sin(phi[n])*np.sin(psi[n])*np.sin(theta[n])) + (np.cos(psi[n])*np.cos(phi[n]))
+        b3 = (np.sin(psi[n])*np.sin(theta[n])*np.cos(phi[n])) - (np.sin(phi[n])* np.cos(psi[n]))
+        c1 = -np.sin(theta[n])
+        c2 = np.cos(theta[n]) * np.sin(phi[n])
+        c3 = np.cos(theta[n]) * np.cos(phi[n])
+        unew.append(a1*u[n] + a2*v[n] + a3*w[n])
+        vnew.append(b1*u[n] + b2*v[n] + b3*w[n])
+        wnew.append(c1*u[n] + c2*v[n] + c3*w[n])
+    return [np.array(unew), np.array(vnew), np.array(wnew)]
+
+
+def legacy_compute(kind, gauge, rawdata, bodyAngles, cb_id=10, doZeros=1.0, zeros=None):
+    """ The original compute of each gauge type (per record matrix
+        products, pandas rolling means).  Returns the (N x 6) outputs and
+        with doZeros=0.0 the zeros, otherwise zeros are taken out.
+    """
+    r = np.array([rawdata[getattr(gauge, attr)] for attr in gauge.Inputs], float).transpose()
+    if kind == 'kistler':
+        rawForces = np.array([r[:,0] + r[:,3] + r[:,6] + r[:,9],
+                              r[:,1] + r[:,4] + r[:,7] + r[:,10],
+                              r[:,2] + r[:,5] + r[:,8] + r[:,11],
+                              gauge.ydist*(-r[:,2] + r[:,5] - r[:,8] + r[:,11]),
+                              gauge.xdist*(-r[:,2] - r[:,5] + r[:,8] + r[:,11]),
+                              (gauge.ydist*(r[:,0] - r[:,3] + r[:,6] - r[:,10]) +
+                               gauge.xdist*(r[:,1] + r[:,4] - r[:,7] - r[:,10]))], float).transpose()
+    elif kind == 'kistler3':
+        rawForces = np.array([r[:,0] + r[:,3] + r[:,6],
+                              r[:,1] + r[:,4] + r[:,7],
+                              r[:,2] + r[:,5] + r[:,8],
+                              gauge.ydist*(r[:,2] + r[:,5] - r[:,8]),
+                              gauge.xdist*(r[:,2] - r[:,5]),
+                              (gauge.ydist*(-r[:,0] - r[:,3] + r[:,6]) +
+                               gauge.xdist*(-r[:,1] + r[:,4]))], float).transpose()
+    else:
+        rawForces = r
+
+    intForces = np.apply_along_axis(np.dot, 1, rawForces, gauge.Int_Mat)
+    compForces = np.apply_along_axis(np.dot, 1, intForces, gauge.Orient_Mat)
+
+    if kind == 'prop':
+        phi = np.radians(rawdata[bodyAngles[3]].values)
+        theta = np.radians(rawdata[bodyAngles[4]].values)
+        psi = np.radians(rawdata[bodyAngles[5]].values)
+        prop_pos = rawdata['prop_position'].copy(deep=True)
+        if cb_id < 12:
+            prop_pos = prop_pos.map(lambda x: x+20000 if (x < 0) else x)
+            prop_pos = prop_pos.map(lambda x: x-20000 if (x > 20000) else x)
+            rot_angle = (prop_pos * .01800)
+        else:
+            rot_angle = prop_pos
+        sinR = np.sin(np.radians(rot_angle)).values
+        cosR = np.cos(np.radians(rot_angle)).values
+
+        body = compForces.copy()
+        if doZeros == 1:
+            frame = pd.DataFrame(compForces)
+            stopped = (rawdata[bodyAngles[6]] == 0).values
+            for j in [1, 2, 4, 5]:
+                mean = frame[j].rolling(window=100).mean().mask(stopped, 0)
+                body[:, j] = compForces[:, j] - mean.values
+        forces = body.copy()
+        forces[:, 1] = cosR * body[:, 1] - sinR * body[:, 2]
+        forces[:, 2] = sinR * body[:, 1] + cosR * body[:, 2]
+        forces[:, 4] = cosR * body[:, 4] - sinR * body[:, 5]
+        forces[:, 5] = sinR * body[:, 4] + cosR * body[:, 5]
+    else:
+        phi, theta, psi = bodyAngles[0], bodyAngles[1], bodyAngles[2]
+        forces = compForces
+
+    n = len(forces)
+    Wx, Wy, Wz = legacy_transform(np.zeros(n), np.zeros(n), np.ones(n)*gauge.weight,
+                                  phi, theta, psi)
+    out = np.array([forces[:,0] - Wx,
+                    forces[:,1] - Wy,
+                    forces[:,2] - Wz,
+                    forces[:,3] - (Wz*gauge.army - Wy*gauge.armz),
+                    forces[:,4] - (-Wz*gauge.armx - Wx*gauge.armz),
+                    forces[:,5] - (Wy*gauge.armx - Wx*gauge.army)]).transpose()
+    if doZeros == 1.0:
+        return out - zeros, zeros
+    return out, out.mean(axis=0)
+
+
+def outputs(gauge):
+    """ The (N x 6) outputs of a gauge after compute() """
+    return np.column_stack([getattr(gauge, x) for x in SpecialOutputs])
+
+
+def max_diff(a, b):
+    """ Largest difference relative to the size of b, NaN where both are """
+    both = np.isnan(a) & np.isnan(b)
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        return np.inf
+    return np.max(np.abs(np.where(both, 0.0, a - b))) / max(np.nanmax(np.abs(b)), 1.0)
+
+
+def best_of(func, repeat):
+    """ Best wall time of repeat calls to func """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(func):
+    """ Peak memory (MB) allocated while func runs """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def synthetic_obc(frame, cals, scratch):
+    """ Builds an OBCFile for the synthetic run, set up as a load leaves
+        it just before computeSpecials
+    """
+    run = object.__new__(OBCFile)
+    run.channels = None
+    run.pending = []
+    run.bmsFilled = False
+    run.filetype = 'AM-obc'
+    run.dirname = scratch
+    run.filename = 'run-0.obc'
+    run.basename = 'run-0'
+    run.dataEU = frame
+    run.chan_names = list(frame.columns)
+    run.nchans = len(run.chan_names)
+    run.phases = RunPhases(frame['mode325'].values)
+    run.phi = frame['ln200_roll'].values
+    run.theta = frame['ln200_pitch'].values
+    run.psi = frame['ln200_heading'].values
+    run.phichan, run.thetachan, run.psichan = 'ln200_roll', 'ln200_pitch', 'ln200_heading'
+    run.rpmchan = 'prop_rpm'
+    run.sp_gauges = dict((name, cls(cals[name])) for name, section, kind, cls in Gauges)
+    return run
+
+
+def nan_check(frame, cals, angles, phases, chunk):
+    """ Computes all the gauges with a GaugeEngine (in blocks of chunk
+        records, 0 for whole) on the clean run and with a NaN in one
+        Stator input.  Returns the largest difference of the other gauges'
+        outputs and whether all their zeros stayed finite.
+    """
+    def compute(data):
+        engine = dynos.GaugeEngine([(name, cls(cals[name])) for name, section, kind, cls in Gauges])
+        engine.compute(phases.select(data, RunPhases.ZEROS), angles, doZeros=0.0)
+        return engine, engine.compute(data, angles, doZeros=1.0, chunk=chunk)
+
+    clean, cleanOut = compute(frame)
+    chan = dynos.gauge_channels(clean.gauges[clean.names.index('Stator')], frame)[0]
+    column = frame[chan].values.copy()
+    column[[phases.first(RunPhases.ZEROS) + 10, len(column) // 2]] = np.nan
+    bad = frame.copy(deep=False)
+    bad[chan] = column
+    dirty, dirtyOut = compute(bad)
+
+    others = [i for i, name in enumerate(clean.names) if name != 'Stator']
+    cols = [6*i + j for i in others for j in range(6)]
+    finite = all(np.isfinite(getattr(dirty.gauges[i], x+'_z'))
+                 for i in others for x in SpecialOutputs)
+    return max_diff(dirtyOut[:, cols], cleanOut[:, cols]), finite
+
+
+if __name__ == "__main__":
+
+    nrecs = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    nchans = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    nlegacy = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+
+    # No stored zeros, every run is computed from scratch
+    os.environ['AM_ZEROS'] = '0'
+    scratch = tempfile.mkdtemp(prefix='bench_dynos_')
+    try:
+        frame = synthetic_run(nrecs, nchans)
+        cals = synthetic_cal(scratch, list(frame.columns))
+        angles = body_angles(frame)
+        phases = RunPhases(frame['mode325'].values)
+        zeros = phases.select(frame, RunPhases.ZEROS)
+        print("Run: %d channels, %d records" % (nchans, nrecs))
+
+        print("%-10s %12s %14s %10s %14s %12s" % ('gauge', 'time (s)', 'samples/s',
+                                               'peak MB', 'legacy smp/s', 'max diff'))
+        for name, section, kind, cls in Gauges:
+            gauge = cls(cals[name])
+            gauge.compute(zeros, angles, doZeros=0.0)
+            run = lambda: gauge.compute(frame, angles, doZeros=1.0)
+            elapsed = best_of(run, 3)
+            memory = peak_memory(run)
+            current = outputs(gauge)[:nlegacy]
+
+            # The original version, zeros pass and run on the first records
+            part = frame.iloc[:nlegacy]
+            start = time.perf_counter()
+            legacy, legacyZeros = legacy_compute(kind, gauge, zeros, angles, doZeros=0.0)
+            legacy, legacyZeros = legacy_compute(kind, gauge, part, angles, zeros=legacyZeros)
+            legacyRate = (len(zeros) + len(part)) / (time.perf_counter() - start)
+            print("%-10s %12.4f %14.0f %10.1f %14.0f %12.2e" %
+                  (name, elapsed, nrecs / elapsed, memory, legacyRate, max_diff(current, legacy)))
+
+        # The full computeSpecials path, whole and in blocks on the thread pool
+        print()
+        print("%-24s %12s %14s %10s %12s" % ('computeSpecials', 'time (s)', 'samples/s',
+                                             'peak MB', 'max diff'))
+        results = {}
+        for label, chunk in [('whole', 0), ('blocks of %d' % dynos.GaugeEngine.ChunkSize,
+                                            dynos.GaugeEngine.ChunkSize),
+                             ('blocks of %d' % (nrecs // 16 + 1), nrecs // 16 + 1)]:
+            def computeSpecials():
+                run = synthetic_obc(frame, cals, scratch)
+                dynos.GaugeEngine.ChunkSize = chunk
+                run.computeSpecials()
+                run.materializeSpecials()
+                return run
+            saved = dynos.GaugeEngine.ChunkSize
+            try:
+                elapsed = best_of(computeSpecials, 3)
+                memory = peak_memory(computeSpecials)
+                run = computeSpecials()
+            finally:
+                dynos.GaugeEngine.ChunkSize = saved
+            results[label] = run.dataEU[run.specialNames].values
+            print("%-24s %12.4f %14.0f %10.1f %12.2e" %
+                  (label, elapsed, nrecs / elapsed, memory,
+                   max_diff(results[label], results['whole'])))
+
+        # A NaN in one gauge's inputs must stay in that gauge
+        print()
+        print("%-24s %12s %14s" % ('NaN in a Stator input', 'max diff', 'zeros finite'))
+        for label, chunk in [('whole', 0), ('blocks of %d' % (nrecs // 16 + 1), nrecs // 16 + 1)]:
+            diff, finite = nan_check(frame, cals, angles, phases, chunk)
+            print("%-24s %12.2e %14s" % (label, diff, finite))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
@@ -0,0 +1,111 @@
+# bench_runstats.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    bench_runstats.py - Times STDFile.run_stats against the original
+    per-cell version and checks that both give the same values.
+
+    Usage:
+        python bench_runstats.py [run.std]
+
+    With no run file a synthetic 120 channel, 20000 record run is used.
+"""
+
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from filetypes import STDFile
+
+
+def legacy_run_stats(run):
+    """ The original run_stats, returns (execrec, stdbyrec, init, appr) """
+    try:
+        status = list(run.data[run.chan_names[25]])
+        execrec = status.index(5)
+        stdbyrec = status.index(2)
+    except:
+        execrec = 0
+        stdbyrec = 0
+
+    init_values = []
+    for channel in range(run.nchans):
+        if run.chan_names[channel] not in run.data.columns:
+            init_values.append(np.nan)
+            continue
+        chandata = run.data[run.chan_names[channel]]
+        chan_avg = 0.0
+        count = 0
+        for x in range(execrec-10, execrec):
+            chan_avg += chandata.iloc[x]
+            count += 1
+        init_values.append(chan_avg/count)
+
+    appr_values = []
+    for channel in range(run.nchans):
+        if run.chan_names[channel] not in run.data.columns:
+            appr_values.append(np.nan)
+            continue
+        chandata = run.data[run.chan_names[channel]]
+        chan_avg = 0.0
+        count = 0
+        for x in range(stdbyrec, execrec):
+            chan_avg += chandata.iloc[x]
+            count += 1
+        try:
+            appr_values.append(chan_avg/count)
+        except:
+            appr_values.append(0.0)
+
+    return execrec, stdbyrec, init_values, appr_values
+
+
+def synthetic_run(nchans=120, nrecs=20000):
+    """ Builds an STDFile with random data and a standby/execute status """
+    run = object.__new__(STDFile)
+    run.nchans = nchans
+    run.chan_names = ["'chan%d'" % i for i in range(nchans)]
+    data = np.random.default_rng(0).normal(size=(nrecs, nchans))
+    data[:, 25] = 0.0
+    data[nrecs//4:, 25] = 2.0
+    data[nrecs//2:, 25] = 5.0
+    run.data = pd.DataFrame(data, columns=run.chan_names)
+    run.time = np.arange(nrecs) * 0.1
+    return run
+
+
+def best_of(func, repeat):
+    """ Best wall time of repeat calls to func """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+if __name__ == "__main__":
+
+    if len(sys.argv) > 1:
+        run = STDFile(sys.argv[1], 'known')
+    else:
+        run = synthetic_run()
+    print("Run: %d channels, %d records" % (run.nchans, len(run.data)))
+
+    legacy = legacy_run_stats(run)
+    run.run_stats()
+    same = (legacy[0] == run.execrec and legacy[1] == run.stdbyrec and
+            np.array_equal(legacy[2], run.init_values, equal_nan=True) and
+            np.array_equal(legacy[3], run.appr_values, equal_nan=True))
+    print("Outputs identical: %s" % same)
+
+    old = best_of(lambda: legacy_run_stats(run), 1)
+    new = best_of(run.run_stats, 5)
+    print("original  : %10.4f s" % old)
+    print("vectorized: %10.4f s" % new)
+    print("speedup   : %10.1f x" % (old / new))
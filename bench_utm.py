@@ -0,0 +1,110 @@
+# bench_utm.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    bench_utm.py - Times the array UTM conversions (utm.from_latlon_array,
+    utm.to_latlon_array) against a loop over the scalar ones and checks
+    that both give the same values.
+
+    Usage:
+        python bench_utm.py [nfixes]
+
+    The track is a synthetic random walk of nfixes GPS fixes (default
+    100000), plus a set of fixes spread over the globe for the zones.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+import utm
+
+
+def synthetic_track(nfixes=100000):
+    """ A wandering track off the US east coast, (latitude, longitude) """
+    rng = np.random.default_rng(0)
+    latitude = 38.98 + np.cumsum(rng.normal(scale=1e-5, size=nfixes))
+    longitude = -76.48 + np.cumsum(rng.normal(scale=1e-5, size=nfixes))
+    return latitude, longitude
+
+
+def global_fixes(nfixes=20000):
+    """ Fixes all over the valid range, including the Norway and Svalbard
+        zones and the band edges
+    """
+    rng = np.random.default_rng(1)
+    latitude = rng.uniform(-80.0, 84.0, nfixes)
+    longitude = rng.uniform(-180.0, 180.0, nfixes)
+    edges = np.array([-80.0, -8.0, 0.0, 56.0, 64.0, 72.0, 84.0, 60.0, 75.0, 78.0])
+    lons = np.array([-180.0, 0.0, 3.0, 9.0, 12.0, 21.0, 33.0, 42.0, 180.0, 5.0])
+    return np.append(latitude, edges), np.append(longitude, lons)
+
+
+def scalar_from_latlon(latitude, longitude):
+    """ utm.from_latlon one fix at a time """
+    fixes = [utm.from_latlon(lat, lon) for lat, lon in zip(latitude.tolist(), longitude.tolist())]
+    easting, northing, zone_number, zone_letter = zip(*fixes)
+    return np.array(easting), np.array(northing), np.array(zone_number), list(zone_letter)
+
+
+def scalar_to_latlon(easting, northing, zone_number, zone_letter):
+    """ utm.to_latlon one fix at a time """
+    fixes = [utm.to_latlon(e, n, z, l) for e, n, z, l in
+             zip(easting.tolist(), northing.tolist(), zone_number.tolist(), zone_letter)]
+    latitude, longitude = zip(*fixes)
+    return np.array(latitude), np.array(longitude)
+
+
+def best_of(func, repeat):
+    """ Best wall time of repeat calls to func """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def compare(name, scalar, array):
+    """ Prints the max difference of the scalar and array results """
+    diffs = [np.max(np.abs(np.asarray(a, dtype=float) - np.asarray(b, dtype=float)))
+             for a, b in zip(scalar, array)]
+    print("%-12s max diff: %s" % (name, ', '.join('%.3g' % d for d in diffs)))
+
+
+if __name__ == "__main__":
+
+    nfixes = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    # Zones and letters everywhere.  The round trip leaves out 84 deg N
+    # (no letter) and 180 deg E (zone 61), to_latlon rejects both
+    latitude, longitude = global_fixes()
+    scalar = scalar_from_latlon(latitude, longitude)
+    array = utm.from_latlon_array(latitude, longitude)
+    print("Global fixes: zones identical %s, letters identical %s" %
+          (np.array_equal(scalar[2], array[2]), list(scalar[3]) == list(array[3])))
+    compare('from_latlon', scalar[:2], array[:2])
+    inband = (array[3] != None) & (array[2] <= 60)
+    back = utm.to_latlon_array(array[0][inband], array[1][inband], array[2][inband],
+                               array[3][inband].astype(str))
+    compare('to_latlon', scalar_to_latlon(array[0][inband], array[1][inband],
+                                          array[2][inband], list(array[3][inband])), back)
+    compare('round trip', [latitude[inband], longitude[inband]], back)
+
+    latitude, longitude = synthetic_track(nfixes)
+    easting, northing, zone_number, zone_letter = utm.from_latlon_array(latitude, longitude)
+    print("\nTrack: %d fixes" % nfixes)
+    old = best_of(lambda: scalar_from_latlon(latitude, longitude), 1)
+    new = best_of(lambda: utm.from_latlon_array(latitude, longitude), 5)
+    print("from_latlon scalar loop: %10.4f s" % old)
+    print("from_latlon array      : %10.4f s  (%.1f x)" % (new, old / new))
+
+    letters = list(zone_letter)
+    old = best_of(lambda: scalar_to_latlon(easting, northing, zone_number, letters), 1)
+    new = best_of(lambda: utm.to_latlon_array(easting, northing, zone_number[0], letters[0]), 5)
+    print("to_latlon scalar loop  : %10.4f s" % old)
+    print("to_latlon array        : %10.4f s  (%.1f x)" % (new, old / new))
@@ -9,6 +9,7 @@
 """
 
 import glob, sys, cfgparse
+import zerostore
 from optparse import OptionParser
 
 
@@ -39,6 +40,9 @@ def CalPatcher(patches, filelist):
             f.set_option(entry.strip(), value.strip(), keys=section.strip())
         
         f.write(calfile)
+
+        # The stored gauge zeros of the run(s) using this cal are stale now
+        zerostore.invalidate(calfile)
     
 
 if __name__ == "__main__":
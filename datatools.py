@@ -8,8 +8,10 @@
 # To use import with: from datatools import *
 #
 #
+from functools import lru_cache
+
 import numpy as np
-from scipy.signal import butter, lfilter, lfilter_zi
+from scipy.signal import butter, sosfilt, sosfilt_zi
 
 
 def butter_lowpass(cutoff, fs, order=5):
@@ -18,136 +20,351 @@ def butter_lowpass(cutoff, fs, order=5):
     b, a = butter(order, normal_cutoff, btype='low', analog=False)
     return b, a
 
-def butter_lowpass_filter(data, cutoff, fs, order=5):
-    b, a = butter_lowpass(cutoff, fs, order=order)
-    # Use the initial points to initialize filter
-    zi = lfilter_zi(b,a)
-    y, _ =lfilter(b,a,data, zi=zi*data[0])
-    return y
+@lru_cache(maxsize=32)
+def butter_lowpass_sos(cutoff, fs, order=5):
+    """ Returns the (sos, zi) of a lowpass Butterworth filter in second
+        order sections, zi is the steady state for a unit input.  The
+        designs are cached by (cutoff, fs, order) and shared, so don't
+        modify them.
+    """
+    nyq = .5 * fs
+    sos = butter(order, cutoff / nyq, btype='low', analog=False, output='sos')
+    return sos, sosfilt_zi(sos)
+
+def butter_lowpass_filter(data, cutoff, fs, order=5, axis=0):
+    """ Lowpass filters data, a signal or a 2D block of channels with time
+        along axis, all the channels in one pass.  Each channel starts from
+        the steady state of its first point.
+    """
+    return LowpassFilter(cutoff, fs, order, axis).filter(data)
+
+
+class LowpassFilter:
+    """ butter_lowpass_filter a chunk at a time, for runs too long to
+        filter in one go.  The filter state is carried from one chunk to
+        the next, so the chunks put together are the same (to the bit) as
+        filtering the whole signal at once.
+
+        Public Methods are:
+            filter : Filters the next chunk
+            reset  : Starts over, the next chunk is the start of a signal
+    """
+
+    def __init__(self, cutoff, fs, order=5, axis=0):
+        self.sos, self.zi0 = butter_lowpass_sos(float(cutoff), float(fs), int(order))
+        self.axis = axis
+        self.zi = None
+
+    def reset(self):
+        self.zi = None
+
+    def filter(self, chunk):
+        """ Returns the filtered chunk (a signal or block of channels) """
+        data = np.asarray(chunk, dtype=float)
+        if data.shape[self.axis] == 0:
+            return data.copy()
+        if self.zi is None:
+            # Use the initial points to initialize filter
+            shape = [1] * data.ndim
+            shape[self.axis] = 2
+            first = np.expand_dims(np.take(data, 0, axis=self.axis), self.axis)
+            self.zi = self.zi0.reshape([len(self.sos)] + shape) * first[np.newaxis]
+        y, self.zi = sosfilt(self.sos, data, axis=self.axis, zi=self.zi)
+        return y
+
 
 
+def lastIndex(mask):
+    """ Returns for each record (axis 0) of mask the index of the last
+        record at or before it where mask is True, -1 if there is none
+    """
+    mask = np.asarray(mask)
+    index = np.arange(len(mask)).reshape((-1,) + (1,) * (mask.ndim - 1))
+    return np.maximum.accumulate(np.where(mask, index, -1), axis=0)
 
 def spikeFilter(rawdata, limit):
-    """ Parse an array and filter out spikes with delta > limit
+    """ Parse an array and filter out spikes with delta > limit.  A value
+        more than limit from the last good value is replaced by the last
+        good value.  rawdata can also be a 2D block of channels with time
+        along axis 0, each channel is filtered on its own.
     """
-    lastvalue = rawdata[0]
-    filterdata = []
-    for n in range (len(rawdata)):
-        if np.abs(rawdata[n] - lastvalue) > limit:
-            filterdata.append(lastvalue)
-        else:
-            filterdata.append(rawdata[n])
-            lastvalue = rawdata[n]
+    filterdata = np.array(rawdata)
+    if filterdata.ndim > 1:
+        for column in filterdata.reshape(len(filterdata), -1).T:
+            holdSpikes(column, limit)
+    else:
+        holdSpikes(filterdata, limit)
+    return filterdata
+
+def holdSpikes(data, limit):
+    """ The spikeFilter of one channel, in place.  While the values step
+        by no more than limit they are all good, so only the spikes are
+        walked: at a step over the limit the last good value is held
+        until the first value back within limit of it.
+    """
+    nrecs = len(data)
+    # The values more than limit from the value before
+    jumps = np.flatnonzero(np.abs(np.diff(data)) > limit) + 1
+    i = 0
+    while i < len(jumps):
+        start = jumps[i]
+        held = data[start-1]
 
-    return np.array(filterdata)
+        # Search for the end of the spike in growing windows (a na
+        # value is good, as it always has been)
+        stop = nrecs
+        first, width = start + 1, 64
+        while first < nrecs:
+            last = min(first + width, nrecs)
+            good = np.flatnonzero(~(np.abs(data[first:last] - held) > limit))
+            if len(good):
+                stop = first + good[0]
+                break
+            first, width = last, width * 2
+
+        data[start:stop] = held
+        i = np.searchsorted(jumps, stop, side='right')
+
+def limitFilter(rawdata, limit, initial=0.0):
+    """ Replaces the values with a magnitude over limit (e.g. ADCP
+        dropouts) by the last good value, initial before the first good
+        one.  rawdata can also be a 2D block of channels with time along
+        axis 0, initial is then one value or one per channel.
+    """
+    data = np.asarray(rawdata)
+    last = lastIndex(~(np.abs(data) > limit))
+    held = np.take_along_axis(data, np.maximum(last, 0), axis=0)
+    return np.where(last >= 0, held, initial)
+
+class SpikeFilter:
+    """ spikeFilter a chunk at a time, the last good value is carried from
+        one chunk to the next.  Chunks are along axis 0.
+
+        Public Methods are:
+            filter : Filters the next chunk
+            reset  : Starts over, the next chunk is the start of a signal
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.held = None
+
+    def reset(self):
+        self.held = None
+
+    def filter(self, chunk):
+        """ Returns the filtered chunk (a signal or block of channels) """
+        data = np.asarray(chunk)
+        if len(data) == 0:
+            return np.array(data)
+        if self.held is None:
+            filterdata = spikeFilter(data, self.limit)
+        else:
+            # Lead with the last good value, the first value is always good
+            filterdata = spikeFilter(np.concatenate([[self.held], data]), self.limit)[1:]
+        # The output is always the last good value
+        self.held = np.array(filterdata[-1])
+        return filterdata
 
 def yawFilter(rawdata):
-    """ Takes out 360 deg yaw spikes when heading flips
+    """ Takes out 360 deg yaw spikes when heading flips.  The values after
+        a flip (a step of over 180 deg) have that step taken off, up to the
+        next flip.  rawdata can also be a 2D block of channels with time
+        along axis 0.
+    """
+    data = np.asarray(rawdata)
+    filterdata = np.array(data, dtype=float)
+    if len(data) > 1:
+        delta = np.diff(data, axis=0)
+        last = lastIndex(np.abs(delta) > 180)
+        step = np.where(last >= 0, np.take_along_axis(delta, np.maximum(last, 0), axis=0), 0.0)
+        filterdata[1:] = data[1:] - step
+    return filterdata
+
+class YawFilter:
+    """ yawFilter a chunk at a time, the last heading and the step of the
+        last flip are carried from one chunk to the next.  Chunks are
+        along axis 0.
+
+        Public Methods are:
+            filter : Filters the next chunk
+            reset  : Starts over, the next chunk is the start of a signal
     """
-    step = 0.0
-    filterdata = []
-    for n in range(len(rawdata)):
-        if n == 0:
-            filterdata.append(rawdata[n])
+
+    def __init__(self):
+        self.last = None
+        self.step = 0.0
+
+    def reset(self):
+        self.last = None
+        self.step = 0.0
+
+    def filter(self, chunk):
+        """ Returns the filtered chunk (a signal or block of channels) """
+        data = np.asarray(chunk)
+        filterdata = np.array(data, dtype=float)
+        if len(data) == 0:
+            return filterdata
+        if self.last is None:
+            # The first value of the signal is left as it is
+            self.last = np.array(data[0])
+            data, out = data[1:], filterdata[1:]
         else:
-            delta = rawdata[n] - rawdata[n-1]
-            if abs(delta) > 180:
-                step = delta
-            filterdata.append(rawdata[n] - step)
+            out = filterdata
+        if len(data):
+            delta = np.diff(np.concatenate([[self.last], data]), axis=0)
+            last = lastIndex(np.abs(delta) > 180)
+            step = np.where(last >= 0, np.take_along_axis(delta, np.maximum(last, 0), axis=0), self.step)
+            out[:] = data - step
+            self.last = np.array(data[-1])
+            self.step = step[-1]
+        return filterdata
 
-    return np.array(filterdata)
+def eulerRates(phi, theta, p, q, r):
+    """ Returns the (phidot, thetadot, psidot) of one set of angles
+        (radians) and body rates.  This uses the numpy trig, not math, as
+        the libm tan can be an ulp off it.
+    """
+    cosphi, sinphi = np.cos(phi), np.sin(phi)
+    rq = r*cosphi + q*sinphi
+    return p + np.tan(theta)*rq, q*cosphi - r*sinphi, rq/np.cos(theta)
+
+def eulerAngles(phi0, theta0, psi0, p, q, r, dt, method='euler'):
+    """ Integrates the Euler angles from the body rates p, q, r.  Each
+        step needs the angles of the last, so this stays a loop, but only
+        over the angles and with the rates as plain lists.  Returns the
+        phi, theta, psi arrays, one longer than p.  method is 'euler'
+        (explicit Euler) or 'heun' (trapezoidal, the rates at both ends
+        of each step, the last rates are held), anything else is a
+        ValueError.
+    """
+    if method not in ['euler', 'heun']:
+        raise ValueError("unknown integration method %r (use 'euler' or 'heun')" % (method,))
+    p = np.asarray(p, dtype=float).tolist()
+    q = np.asarray(q, dtype=float).tolist()
+    r = np.asarray(r, dtype=float).tolist()
+    n = len(p)
+    phi = np.empty(n+1)
+    theta = np.empty(n+1)
+    psi = np.empty(n+1)
+    ph, th, ps = float(phi0), float(theta0), float(psi0)
+    phi[0], theta[0], psi[0] = ph, th, ps
 
-def compTrajectory(x0, y0, z0, theta0, phi0, psi0, u, v, w, p, q, r, dt):
+    for k in range(n):
+        phidot, thetadot, psidot = eulerRates(ph, th, p[k], q[k], r[k])
+        if method == 'heun':
+            k1 = min(k+1, n-1)
+            phidot1, thetadot1, psidot1 = eulerRates(ph + phidot*dt, th + thetadot*dt,
+                                                     p[k1], q[k1], r[k1])
+            phidot = 0.5 * (phidot + phidot1)
+            thetadot = 0.5 * (thetadot + thetadot1)
+            psidot = 0.5 * (psidot + psidot1)
+        ph = ph + phidot*dt
+        th = th + thetadot*dt
+        ps = ps + psidot*dt
+        phi[k+1], theta[k+1], psi[k+1] = ph, th, ps
+
+    return phi, theta, psi
+
+def compTrajectory(x0, y0, z0, theta0, phi0, psi0, u, v, w, p, q, r, dt, method='euler'):
     """ This routine computes the model trajectory, it assumes
     that p,q,r are valid as well as u,v,w. It then starts
     from an initial state defines by x0,y0,z0 and theta0, phi0, psi0
     to compute the trajectory
+
+    The angles come from eulerAngles, the positions are then one
+    doTransform of the velocities and a running sum.  method 'euler' is
+    the explicit Euler scheme this has always used, 'heun' the second
+    order trapezoidal one (any other method is a ValueError).  Returns
+    [xpos, ypos, zpos, phi, theta, psi], each one longer than u.
     """
+    n = len(u)
+    u = np.asarray(u, dtype=float)[:n]
+    v = np.asarray(v, dtype=float)[:n]
+    w = np.asarray(w, dtype=float)[:n]
+    phi, theta, psi = eulerAngles(phi0, theta0, psi0, np.asarray(p)[:n],
+                                  np.asarray(q)[:n], np.asarray(r)[:n], dt, method)
 
-    # We will process this point by point so setup some containers for
-    # the data
-    phidot = []
-    psidot = []
-    thetadot = []
-    phi= []
-    psi = []
-    theta = []
-    xpos = []
-    ypos = []
-    zpos = []
-
-    # Initialize the starting point
-    phi.append(phi0)
-    psi.append(psi0)
-    theta.append(theta0)
-    xpos.append(x0)
-    ypos.append(y0)
-    zpos.append(z0)
-
-    # Now loop for each point
-    for n in range(len(u)):
-        thetadot.append(q[n]*np.cos(phi[n]) - r[n]*np.sin(phi[n]))
-        phidot.append(p[n] + np.tan(theta[n])*(r[n]*np.cos(phi[n])+q[n]*np.sin(phi[n])))
-        psidot.append((r[n]*np.cos(phi[n])+q[n]*np.sin(phi[n]))/np.cos(theta[n]))
-
-        phi.append(phi[n] + phidot[n]*dt)
-        theta.append(theta[n] + thetadot[n]*dt)
-        psi.append(psi[n] + psidot[n]* dt)
-
-        # Generate direction cosines
-        a1 = np.cos(psi[n]) * np.cos(theta[n])
-        a2 = (np.cos(psi[n])*np.sin(phi[n]*np.sin(theta[n])) - (np.sin(psi[n])*np.cos(phi[n])))
-        a3 = (np.cos(phi[n])*np.cos(psi[n])*np.sin(theta[n])) + (np.sin(phi[n])*np.sin(psi[n]))
-        b1 = np.sin(psi[n]) * np.cos(theta[n])
-        b2 = (np.sin(phi[n])*np.sin(psi[n])*np.sin(theta[n])) + (np.cos(psi[n])*np.cos(phi[n]))
-        b3 = (np.sin(psi[n])*np.sin(theta[n])*np.cos(phi[n])) - (np.sin(phi[n])* np.cos(psi[n]))
-        c1 = -np.sin(theta[n])
-        c2 = np.cos(theta[n]) * np.sin(phi[n])
-        c3 = np.cos(theta[n]) * np.cos(phi[n])
-
-        dx = a1*u[n] + a2*v[n] + a3*w[n]
-        dy = b1*u[n] + b2*v[n] + b3*w[n]
-        dz = c1*u[n] + c2*v[n] + c3*w[n]
-
-        xpos.append(xpos[n] + dx*dt)
-        ypos.append(ypos[n] + dy*dt)
-        zpos.append(zpos[n] + dz*dt)
+    if method == 'heun' and n:
+        # The velocities at both ends of each step, the last ones held
+        dx, dy, dz = doTransform(np.append(u, u[-1]), np.append(v, v[-1]),
+                                 np.append(w, w[-1]), phi, theta, psi)
+        dx = 0.5 * (dx[:-1] + dx[1:])
+        dy = 0.5 * (dy[:-1] + dy[1:])
+        dz = 0.5 * (dz[:-1] + dz[1:])
+    else:
+        dx, dy, dz = doTransform(u, v, w, phi, theta, psi)
+
+    # The sum runs in order, so this is the same as stepping the positions
+    xpos = np.cumsum(np.concatenate([[x0], dx*dt]))
+    ypos = np.cumsum(np.concatenate([[y0], dy*dt]))
+    zpos = np.cumsum(np.concatenate([[z0], dz*dt]))
 
     return [xpos, ypos, zpos, phi, theta, psi]
 
 
+def directionCosines(phi, theta, psi):
+    """ Returns the direction cosines [a1, a2, a3, b1, b2, b3, c1, c2, c3]
+        for arrays of angles (radians)
+    """
+    sinphi, cosphi = np.sin(phi), np.cos(phi)
+    sintheta, costheta = np.sin(theta), np.cos(theta)
+    sinpsi, cospsi = np.sin(psi), np.cos(psi)
+
+    a1 = cospsi * costheta
+    # a2 has always used sin(phi*sin(theta)), kept so results don't change
+    a2 = (cospsi*np.sin(phi*sintheta) - (sinpsi*cosphi))
+    a3 = (cosphi*cospsi*sintheta) + (sinphi*sinpsi)
+    b1 = sinpsi * costheta
+    b2 = (sinphi*sinpsi*sintheta) + (cospsi*cosphi)
+    b3 = (sinpsi*sintheta*cosphi) - (sinphi* cospsi)
+    c1 = -sintheta
+    c2 = costheta * sinphi
+    c3 = costheta * cosphi
+
+    return [a1, a2, a3, b1, b2, b3, c1, c2, c3]
+
+
 def doTransform(u, v, w, phi, theta, psi, direction='toInertial'):
     """ Do coordinate transformation using direction cosines
+
+        u, v, w and the angles are arrays, only the first len(u) angles
+        are used
     """
+    n = len(u)
+    u = np.asarray(u)[:n]
+    v = np.asarray(v)[:n]
+    w = np.asarray(w)[:n]
 
-    unew = []
-    vnew = []
-    wnew = []
-
-    for n in range(len(u)):
-        a1 = np.cos(psi[n]) * np.cos(theta[n])
-        a2 = (np.cos(psi[n])*np.sin(phi[n]*np.sin(theta[n])) - (np.sin(psi[n])*np.cos(phi[n])))
-        a3 = (np.cos(phi[n])*np.cos(psi[n])*np.sin(theta[n])) + (np.sin(phi[n])*np.sin(psi[n]))
-        b1 = np.sin(psi[n]) * np.cos(theta[n])
-        b2 = (np.sin(phi[n])*np.sin(psi[n])*np.sin(theta[n])) + (np.cos(psi[n])*np.cos(phi[n]))
-        b3 = (np.sin(psi[n])*np.sin(theta[n])*np.cos(phi[n])) - (np.sin(phi[n])* np.cos(psi[n]))
-        c1 = -np.sin(theta[n])
-        c2 = np.cos(theta[n]) * np.sin(phi[n])
-        c3 = np.cos(theta[n]) * np.cos(phi[n])
-
-        if direction == 'toInertial':
-            unew.append(a1*u[n] + a2*v[n] + a3*w[n])
-            vnew.append(b1*u[n] + b2*v[n] + b3*w[n])
-            wnew.append(c1*u[n] + c2*v[n] + c3*w[n])
-        elif direction == 'toBody':
-            unew.append(a1*u[n] + b1*v[n] + c1*w[n])
-            vnew.append(a2*u[n] + b2*v[n] + c2*w[n])
-            wnew.append(a3*u[n] + b3*v[n] + c3*w[n])
-        else:
-            unew.append(u[n])
-            vnew.append(v[n])
-            wnew.append(w[n])
+    if direction == 'toInertial':
+        a1, a2, a3, b1, b2, b3, c1, c2, c3 = directionCosines(np.asarray(phi)[:n],
+                                                              np.asarray(theta)[:n],
+                                                              np.asarray(psi)[:n])
+        return [a1*u + a2*v + a3*w, b1*u + b2*v + b3*w, c1*u + c2*v + c3*w]
+    elif direction == 'toBody':
+        a1, a2, a3, b1, b2, b3, c1, c2, c3 = directionCosines(np.asarray(phi)[:n],
+                                                              np.asarray(theta)[:n],
+                                                              np.asarray(psi)[:n])
+        return [a1*u + b1*v + c1*w, a2*u + b2*v + c2*w, a3*u + b3*v + c3*w]
+    else:
+        return [np.array(u), np.array(v), np.array(w)]
+
+
+def gravityVector(weight, phi, theta, psi, n=None):
+    """ The weight vector, doTransform(0, 0, weight, phi, theta, psi) for
+        the first n angles (all by default), without the zero terms
+    """
+    phi = np.asarray(phi)[:n]
+    theta = np.asarray(theta)[:n]
+    psi = np.asarray(psi)[:n]
+    sinphi, cosphi = np.sin(phi), np.cos(phi)
+    sintheta, costheta = np.sin(theta), np.cos(theta)
+    sinpsi, cospsi = np.sin(psi), np.cos(psi)
+
+    a3 = (cosphi*cospsi*sintheta) + (sinphi*sinpsi)
+    b3 = (sinpsi*sintheta*cosphi) - (sinphi* cospsi)
+    c3 = costheta * cosphi
 
-    return [np.array(unew), np.array(vnew), np.array(wnew)]
+    return [a3*weight, b3*weight, c3*weight]
 
 
@@ -9,53 +9,217 @@
 
     CLASSES:
     RingBuffer - Implements a ring buffer for prop dyno data
+    ChunkedGauge - Chunk by chunk computing for the gauge classes
     Kistler6 - Class for 4-guage Kistler gauges
     Kistler3 - Class for 3-guage kistler
     Dyno6 - 6 DOF dyno - stationary
     Rot_Dyno6 - Rotating 6 DOF dyno
     Deck - Combined Kistler deck gauge - Not used anymore
+    GaugeEngine - Computes a set of gauges together
+
+    FUNCTIONS:
+    cal_signature - Hash of a gauge cal dictionary
+    resolve_channels - Converts gauge channel numbers to channel names
+    gauge_channels - Returns the names of the gauge input channels
+    gauge_inputs - Returns the block of gauge input channels
+    running_mean - Trailing mean of the columns of a block
+    prop_angle - Converts the prop position channel to a shaft angle
 """
 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import pandas as pd
 import datatools as dt
 
 class RingBuffer(object):
-    """ class that implements a not-yet-full buffer
+    """ A fixed size ring buffer of values (or rows of width values) kept
+    in a numpy array.  A running sum makes the average O(1), it is summed
+    again from the buffer once per lap so rounding can't build up.
     Used for a running average of the prop data"""
-    def __init__(self, size_max):
+    def __init__(self, size_max, width=None):
         self.max = size_max
-        self.data = []
-    def _full_append(self, x):
-        """ Append an element overwriting the oldest one"""
-        self.data[self.cur] = x
-        self.cur = (self.cur+1) % self.max
-    def _full_tolist(self):
-        """ Return list of elements in correct order"""
-        return self.data[self.cur:] + self.data[:self.cur]
-    def _full_average(self):
-        """ Return the average of the buffer elements"""
-        return sum(self.data) / self.max
-    def append(self,x):
-        """ append an element to the end of the buffer """
-        self.data.append(x)
-        if len(self.data) == self.max:
-            self.cur = 0
-            self.append = self._full_append
-            self.tolist = self._full_tolist
-            self.average =  self._full_average
+        shape = (size_max,) if width is None else (size_max, width)
+        self.data = np.zeros(shape, dtype=float)
+        self.total = np.zeros(shape[1:], dtype=float)
+        self.count = 0
+        self.cur = 0
+        self.lap = 0
+    def append(self, x):
+        """ append an element to the end of the buffer, overwriting
+        the oldest one once the buffer is full """
+        self.extend(np.asarray(x, dtype=float)[np.newaxis])
+    def extend(self, block):
+        """ append the elements (rows) of block, oldest first """
+        block = np.asarray(block, dtype=float)[-self.max:]
+        slots = (self.cur + np.arange(len(block))) % self.max
+        self.total = self.total - self.data[slots[slots < self.count]].sum(axis=0)
+        self.data[slots] = block
+        self.total = self.total + block.sum(axis=0)
+        self.count = min(self.count + len(block), self.max)
+        self.cur = (self.cur + len(block)) % self.max
+        self.lap += len(block)
+        if self.lap >= self.max:
+            self.total = self.data[:self.count].sum(axis=0)
+            self.lap = 0
+    def toarray(self):
+        """ Return an array of the elements from oldest to newest"""
+        if self.count < self.max:
+            return self.data[:self.count].copy()
+        return np.concatenate([self.data[self.cur:], self.data[:self.cur]])
     def tolist(self):
         """ Return a list of elements from oldest to newest"""
-        return self.data
+        return list(self.toarray())
     def average(self):
         """ Return average of the buffer elements """
-        return sum(self.data) / len(self.data)
+        return self.total / self.count
+    def clear(self):
+        """ Empty the buffer """
+        self.data[...] = 0.0
+        self.total = np.zeros_like(self.total)
+        self.count = 0
+        self.cur = 0
+        self.lap = 0
+
+
+def cal_signature(calfile):
+    """ Returns a hash of a gauge cal dictionary that changes whenever
+        any of the cal values do (used to key stored gauge zeros)
+    """
+    sig = hashlib.sha1()
+    for name in sorted(calfile):
+        value = calfile[name]
+        sig.update(('%s=' % name).encode())
+        if isinstance(value, np.ndarray):
+            sig.update(('%s%s' % (value.dtype, value.shape)).encode())
+            sig.update(np.ascontiguousarray(value).tobytes())
+        else:
+            sig.update(repr(value).encode())
+        sig.update(b'\n')
+    return sig.hexdigest()
+
+
+def resolve_channels(gauge, chan_names):
+    """ Special channels can be given as numbers or names in the cal file.
+        This converts any channel numbers in the gauge channel assignments
+        (the *_chan attributes) into names from chan_names, so that compute()
+        works on frames holding only some of the run channels.
+
+        Returns the list of data channel names the gauge reads
+    """
+    names = []
+    for attr in sorted(vars(gauge)):
+        chan = getattr(gauge, attr)
+        if attr.endswith('_chan') and isinstance(chan, str):
+            if chan.isdigit():
+                chan = chan_names[int(chan)]
+                setattr(gauge, attr, chan)
+            names.append(chan)
+    return names
+
+
+def gauge_channels(gauge, rawdata):
+    """ Returns the names of the gauge input channels in rawdata, in the
+        order of gauge.Inputs.  Channels not yet resolved to names by
+        resolve_channels are column numbers in rawdata (assume that if
+        the first one is a num all are nums).
+    """
+    chans = [getattr(gauge, attr) for attr in gauge.Inputs]
+    if chans[0].isdigit():
+        chans = [rawdata.columns[int(chan)] for chan in chans]
+    return chans
+
+
+def gauge_inputs(gauge, rawdata):
+    """ Returns the (N x k) array of the gauge input channels, in the
+        order of gauge.Inputs.
+    """
+    chans = gauge_channels(gauge, rawdata)
+    return np.array([rawdata[chan] for chan in chans], float).transpose()
+
+
+def running_mean(data, window):
+    """ Returns the trailing mean over window records of each column of
+        data (N x k), the same as DataFrame.rolling(window).mean(): NaN
+        for the first window-1 records and where the window holds a NaN.
+        All the columns are done in one cumulative sum pass, taken about
+        the column means so the sums stay small on long runs.
+    """
+    data = np.asarray(data, dtype=float)
+    mean = np.full(data.shape, np.nan)
+    if len(data) < window:
+        return mean
+
+    bad = np.isnan(data)
+    count = np.maximum(len(data) - bad.sum(axis=0), 1)
+    ref = np.where(bad, 0.0, data).sum(axis=0) / count
+    start = np.zeros((1,) + data.shape[1:])
+    sums = np.concatenate([start, np.cumsum(np.where(bad, 0.0, data - ref), axis=0)])
+    nbad = np.concatenate([start, np.cumsum(bad, axis=0)])
+
+    mean[window-1:] = ref + (sums[window:] - sums[:-window]) / window
+    mean[window-1:][(nbad[window:] - nbad[:-window]) > 0] = np.nan
+    return mean
+
+
+def prop_angle(prop_pos, cb_id=10):
+    """ Returns the shaft angle (deg) of the prop position channel values.
+        The older centerbodies (cb_id < 12) record encoder counts, 20000
+        to a revolution, the newer ones record the angle itself.
+    """
+    prop_pos = np.asarray(prop_pos)
+    if cb_id < 12:
+        # Wrap the position counts into 0-20000
+        prop_pos = np.where(prop_pos < 0, prop_pos + 20000, prop_pos)
+        prop_pos = np.where(prop_pos > 20000, prop_pos - 20000, prop_pos)
+        return (prop_pos * .01800)
+    return prop_pos
 
 
 #  Dyno Classes - The following classes are set up to handle the 
 #  various types of dynos
 
-class Kistler6:
+class ChunkedGauge:
+    """ The incremental side of the gauge classes.  computeChunk() takes
+    a run a piece at a time (in order) so it can be processed in bounded
+    memory or as the data comes in.  The state carried between chunks is
+    the zeros (averaged over all the zero chunks) and, for the rotating
+    dyno, the history of the running means.
+
+    CLASS METHODS:
+
+    computeChunk() - Computes the body forces for the next chunk of a run
+
+    resetChunks() - Clears the carried state to start a new run
+    """
+
+    def computeChunk(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
+        """ Same as compute() but for the next chunk of records of a run,
+        the body angles (phi, theta, psi) are those of the chunk.  With
+        doZeros=0.0 the zeros are the average over all the zero chunks
+        seen since resetChunks()
+        """
+        self.compute(rawdata, bodyAngles, cb_id=cb_id, doZeros=doZeros)
+        if doZeros != 1.0:
+            self.addZeroChunk(len(rawdata))
+
+    def addZeroChunk(self, count):
+        """ Folds the zeros compute() just took from a chunk of count
+        records into the zeros of all the zero chunks
+        """
+        names = ['CFx_z', 'CFy_z', 'CFz_z', 'CMx_z', 'CMy_z', 'CMz_z']
+        chunk = np.array([getattr(self, name) for name in names], float)
+        self.zeroSum = getattr(self, 'zeroSum', 0.0) + chunk*count
+        self.zeroCount = getattr(self, 'zeroCount', 0) + count
+        for name, value in zip(names, self.zeroSum / self.zeroCount):
+            setattr(self, name, value)
+
+    def resetChunks(self):
+        """ Clears the state carried between chunks """
+        self.zeroSum = 0.0
+        self.zeroCount = 0
+
+
+class Kistler6(ChunkedGauge):
     """ A class to handle the cals for a Kistler Sail gauge.
         The Kistler is made up of 4 three-DOF gauges that are
         assembled into one 6DOF gauge.  Processing the dyno data requires
@@ -74,14 +238,22 @@ class Kistler6:
 
     compute() - Computes the body forces for at a time step
 
+    computeChunk() - Computes the body forces for the next chunk of a run
+
     addZero() - Adds a point to the accumulated zeros array
 
     compZero() - Computes the average zero value for each channel
     """
+
+    # The channel attributes of the gauge inputs, in kernel row order
+    Inputs = ['Fx1_chan', 'Fy1_chan', 'Fz1_chan', 'Fx2_chan', 'Fy2_chan', 'Fz2_chan',
+              'Fx3_chan', 'Fy3_chan', 'Fz3_chan', 'Fx4_chan', 'Fy4_chan', 'Fz4_chan']
+
     def __init__(self, calfile):
         """ The constructor needs the calfile dictionary
             for the dyno
         """
+        self.calsig = cal_signature(calfile)
 
         # First we get the channel assignments - There are 12 channels, 3 per gauge
 
@@ -126,10 +298,34 @@ class Kistler6:
 
         self.Int_Mat = calfile['Int_Mat']
         self.Orient_Mat = calfile['Orient_Mat']
+        try:
+            self.fuse()
+        except:
+            # Incomplete cal, compute will fail as it always has
+            self.Kernel = None
 
         # Finally we set the channel zeros to zero
         self.zeros = np.array(([0.0, 0.0, 0.0, 0.0, 0.0, 0.0]), float)
 
+    def fuse(self):
+        """ Precomposes the combination of the 4 gauges, the Interaction
+            Matrix and the Orientation Matrix into the single (12 x 6)
+            kernel applied by compute.  The combination is
+                Fx = Fx1 + Fx2 + Fx3 + Fx4  (Fy, Fz the same)
+                Mx = ydist*(-Fz1 + Fz2 - Fz3 + Fz4)
+                My = xdist*(-Fz1 - Fz2 + Fz3 + Fz4)
+                Mz = ydist*(Fx1 - Fx2 + Fx3 - Fy4) + xdist*(Fy1 + Fy2 - Fy3 - Fy4)
+        """
+        comb = np.zeros((12, 6), dtype=float)
+        comb[[0, 3, 6, 9], 0] = 1.0
+        comb[[1, 4, 7, 10], 1] = 1.0
+        comb[[2, 5, 8, 11], 2] = 1.0
+        comb[[2, 5, 8, 11], 3] = self.ydist * np.array([-1.0, 1.0, -1.0, 1.0])
+        comb[[2, 5, 8, 11], 4] = self.xdist * np.array([-1.0, -1.0, 1.0, 1.0])
+        comb[[0, 3, 6, 10], 5] += self.ydist * np.array([1.0, -1.0, 1.0, -1.0])
+        comb[[1, 4, 7, 10], 5] += self.xdist * np.array([1.0, 1.0, -1.0, -1.0])
+        self.Kernel = np.dot(np.dot(comb, self.Int_Mat), self.Orient_Mat)
+
     def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
         """ Compute the corrected forces for the current timestep by combining the
         forces from each of the individual gauges and then applying
@@ -144,69 +340,16 @@ class Kistler6:
         # Need to check for which we have so we can get values properly
         # Assume that if first one is a num all are nums
         
-        if self.Fx1_chan.isdigit():
-            # Channels are given as channel number so need to use that to look up channel
-            relForces = np.array([rawdata[rawdata.columns[int(self.Fx1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fx2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fx3_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy3_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz3_chan)]],
-                               rawdata[rawdata.columns[int(self.Fx4_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy4_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz4_chan)]]], float).transpose()
-        else:
-            # Channels are given by name so use the name
-            relForces = np.array([rawdata[self.Fx1_chan],
-                               rawdata[self.Fy1_chan],
-                               rawdata[self.Fz1_chan],
-                               rawdata[self.Fx2_chan],
-                               rawdata[self.Fy2_chan],
-                               rawdata[self.Fz2_chan],
-                               rawdata[self.Fx3_chan],
-                               rawdata[self.Fy3_chan],
-                               rawdata[self.Fz3_chan],
-                               rawdata[self.Fx4_chan],
-                               rawdata[self.Fy4_chan],
-                               rawdata[self.Fz4_chan]], float).transpose()
-            
+        relForces = gauge_inputs(self, rawdata)
 
-        # Now combine these individual gauge forces into total gauge forces
-        combFx = relForces[:,0] + relForces[:,3] + relForces[:,6] + relForces[:,9]
-        combFy = relForces[:,1] + relForces[:,4] + relForces[:,7] + relForces[:,10]
-        combFz = relForces[:,2] + relForces[:,5] + relForces[:,8] + relForces[:,11]
-        combMx = self.ydist*(-relForces[:,2] + relForces[:,5] -relForces[:,8] + relForces[:,11])
-        combMy = self.xdist*(-relForces[:,2] - relForces[:,5] + relForces[:,8] + relForces[:,11])
-        combMz = (self.ydist*(relForces[:,0] - relForces[:,3] + relForces[:,6] - relForces[:,10]) +
-                  self.xdist*(relForces[:,1] + relForces[:,4] - relForces[:,7] -relForces[:,10]))
-
-        rawForces = np.array([combFx,
-                           combFy,
-                           combFz,
-                           combMx,
-                           combMy,
-                           combMz], float).transpose()
-
-        # Apply the Interaction Matrix
-        def intMatrix ( a, b):
-            return np.dot( a,b)
-        intForces = np.apply_along_axis(intMatrix, 1, rawForces, self.Int_Mat)
-
-        # Apply the Orientation Matrix
-        def orientMatrix ( a, b):
-            return np.dot( a,b)
-        compForces = np.apply_along_axis(orientMatrix, 1, intForces, self.Orient_Mat)
+        # Combine the individual gauge forces into total gauge forces and
+        # apply the interaction and orientation matrices, all in one
+        if self.Kernel is None:
+            self.fuse()
+        compForces = np.dot(relForces, self.Kernel)
 
         # Now compute the self weight vector in body coords
-        Wx, Wy, Wz = dt.doTransform(np.zeros(len(combFx), dtype=float),
-                                    np.zeros(len(combFx), dtype=float),
-                                    np.ones(len(combFx), dtype=float)*self.weight,
-                                    phi,
-                                    theta,
-                                    psi) 
+        Wx, Wy, Wz = dt.gravityVector(self.weight, phi, theta, psi, len(relForces))
     
         # And then take out the self weight using the body angles
         self.CFx = compForces[:,0] - Wx 
@@ -232,7 +375,7 @@ class Kistler6:
             self.CMz_z = self.CMz.mean()
             
 
-class Kistler3:
+class Kistler3(ChunkedGauge):
     """ A class to handle the cals for a 3-gauge Kistler.
         The Kistler is made up of 3 three-DOF gauges that are
         assembled into one 6DOF gauge.  Processing the dyno data requires
@@ -251,14 +394,22 @@ class Kistler3:
 
     compute() - Computes the body forces for at a time step
 
+    computeChunk() - Computes the body forces for the next chunk of a run
+
     addZero() - Adds a point to the accumulated zeros array
 
     compZero() - Computes the average zero value for each channel
     """
+
+    # The channel attributes of the gauge inputs, in kernel row order
+    Inputs = ['Fx1_chan', 'Fy1_chan', 'Fz1_chan', 'Fx2_chan', 'Fy2_chan', 'Fz2_chan',
+              'Fx3_chan', 'Fy3_chan', 'Fz3_chan']
+
     def __init__(self, calfile):
         """ The constructor needs the calfile dictionary
             for the dyno
         """
+        self.calsig = cal_signature(calfile)
 
         # First we get the channel assignments - There are 12 channels, 3 per gauge
 
@@ -300,10 +451,34 @@ class Kistler3:
 
         self.Int_Mat = calfile['Int_Mat']
         self.Orient_Mat = calfile['Orient_Mat']
+        try:
+            self.fuse()
+        except:
+            # Incomplete cal, compute will fail as it always has
+            self.Kernel = None
 
         # Finally we set the channel zeros to zero
         self.zeros = np.array(([0.0, 0.0, 0.0, 0.0, 0.0, 0.0]), float)
 
+    def fuse(self):
+        """ Precomposes the combination of the 3 gauges, the Interaction
+            Matrix and the Orientation Matrix into the single (9 x 6)
+            kernel applied by compute.  The combination is
+                Fx = Fx1 + Fx2 + Fx3  (Fy, Fz the same)
+                Mx = ydist*(Fz1 + Fz2 - Fz3)
+                My = xdist*(Fz1 - Fz2)
+                Mz = ydist*(-Fx1 - Fx2 + Fx3) + xdist*(-Fy1 + Fy2)
+        """
+        comb = np.zeros((9, 6), dtype=float)
+        comb[[0, 3, 6], 0] = 1.0
+        comb[[1, 4, 7], 1] = 1.0
+        comb[[2, 5, 8], 2] = 1.0
+        comb[[2, 5, 8], 3] = self.ydist * np.array([1.0, 1.0, -1.0])
+        comb[[2, 5], 4] = self.xdist * np.array([1.0, -1.0])
+        comb[[0, 3, 6], 5] = self.ydist * np.array([-1.0, -1.0, 1.0])
+        comb[[1, 4], 5] = self.xdist * np.array([-1.0, 1.0])
+        self.Kernel = np.dot(np.dot(comb, self.Int_Mat), self.Orient_Mat)
+
     def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
         """ Compute the corrected forces for the current timestep by combining the
         forces from each of the individual gauges and then applying
@@ -318,63 +493,16 @@ class Kistler3:
         # Need to check for which we have so we can get values properly
         # Assume that if first one is a num all are nums
         
-        if self.Fx1_chan.isdigit():
-            # Channels are given as channel number so need to use that to look up channel
-            relForces = np.array([rawdata[rawdata.columns[int(self.Fx1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz1_chan)]],
-                               rawdata[rawdata.columns[int(self.Fx2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz2_chan)]],
-                               rawdata[rawdata.columns[int(self.Fx3_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy3_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz3_chan)]]], float).transpose()
-        else:
-            # Channels are given by name so use the name
-            relForces = np.array([rawdata[self.Fx1_chan],
-                               rawdata[self.Fy1_chan],
-                               rawdata[self.Fz1_chan],
-                               rawdata[self.Fx2_chan],
-                               rawdata[self.Fy2_chan],
-                               rawdata[self.Fz2_chan],
-                               rawdata[self.Fx3_chan],
-                               rawdata[self.Fy3_chan],
-                               rawdata[self.Fz3_chan]], float).transpose()
-
-        # Now combine these individual gauge forces into total gauge forces
-        combFx = relForces[:,0] + relForces[:,3] + relForces[:,6]
-        combFy = relForces[:,1] + relForces[:,4] + relForces[:,7]
-        combFz = relForces[:,2] + relForces[:,5] + relForces[:,8]
-        combMx = self.ydist*(relForces[:,2] + relForces[:,5] - relForces[:,8])
-        combMy = self.xdist*(relForces[:,2] - relForces[:,5] )
-        combMz = (self.ydist*(-relForces[:,0] - relForces[:,3] + relForces[:,6]) +
-                  self.xdist*(-relForces[:,1] + relForces[:,4]))
-
-        rawForces = np.array([combFx,
-                           combFy,
-                           combFz,
-                           combMx,
-                           combMy,
-                           combMz], float).transpose()
-
+        relForces = gauge_inputs(self, rawdata)
 
-        # Apply the Interaction Matrix
-        def intMatrix ( a, b):
-            return np.dot( a,b)
-        intForces = np.apply_along_axis(intMatrix, 1, rawForces, self.Int_Mat)
-
-        # Apply the Orientation Matrix
-        def orientMatrix ( a, b):
-            return np.dot( a,b)
-        compForces = np.apply_along_axis(orientMatrix, 1, intForces, self.Orient_Mat)
+        # Combine the individual gauge forces into total gauge forces and
+        # apply the interaction and orientation matrices, all in one
+        if self.Kernel is None:
+            self.fuse()
+        compForces = np.dot(relForces, self.Kernel)
 
         # Now compute the self weight vector in body coords
-        Wx, Wy, Wz = dt.doTransform(np.zeros(len(combFx), dtype=float),
-                                    np.zeros(len(combFx), dtype=float),
-                                    np.ones(len(combFx), dtype=float)*self.weight,
-                                    phi,
-                                    theta,
-                                    psi) 
+        Wx, Wy, Wz = dt.gravityVector(self.weight, phi, theta, psi, len(relForces))
  
 
         
@@ -405,7 +533,7 @@ class Kistler3:
             self.CMz_z = self.CMz.mean()
    
 
-class Dyno6:
+class Dyno6(ChunkedGauge):
     """ A class to handle the cals for a standard non-rotating 6DOF dyno.
         This is used for the stator but not for the prop which is special 
     because it rotates
@@ -421,8 +549,14 @@ class Dyno6:
 
     compute() - Computes the body forces for at a time step
 
+    computeChunk() - Computes the body forces for the next chunk of a run
+
 
     """
+
+    # The channel attributes of the gauge inputs, in kernel row order
+    Inputs = ['Fx_chan', 'Fy_chan', 'Fz_chan', 'Mx_chan', 'My_chan', 'Mz_chan']
+
     def __init__(self, calfile):
         """ The constructor needs the calfile dictionary
             for the dyno
@@ -430,6 +564,7 @@ class Dyno6:
             This routine populates the various variables needed for the class
             from the calfile
         """
+        self.calsig = cal_signature(calfile)
 
         # First we get the channel assignments
 
@@ -470,10 +605,21 @@ class Dyno6:
         # Now for the interaction Matrix and Orient Matrix
         self.Int_Mat = calfile['Int_Mat']
         self.Orient_Mat = calfile['Orient_Mat']
+        try:
+            self.fuse()
+        except:
+            # Incomplete cal, compute will fail as it always has
+            self.Kernel = None
 
         # Finally we set the channel zeros to zero
         self.zeros = np.array(([0.0, 0.0, 0.0, 0.0, 0.0, 0.0]), float)
 
+    def fuse(self):
+        """ Precomposes the Interaction and Orientation matrices into
+            the single (6 x 6) kernel applied by compute
+        """
+        self.Kernel = np.dot(self.Int_Mat, self.Orient_Mat)
+
     def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
         """ 
         Compute the corrected forces for the current timestep using
@@ -493,38 +639,15 @@ class Dyno6:
         # Need to check for which we have so we can get values properly
         # Assume that if first one is a num all are nums
         
-        if self.Fx_chan.isdigit():
-            rawForces = np.array([rawdata[rawdata.columns[int(self.Fx_chan)]],
-                               rawdata[rawdata.columns[int(self.Fy_chan)]],
-                               rawdata[rawdata.columns[int(self.Fz_chan)]],
-                               rawdata[rawdata.columns[int(self.Mx_chan)]],
-                               rawdata[rawdata.columns[int(self.My_chan)]],
-                               rawdata[rawdata.columns[int(self.Mz_chan)]]], float).transpose()
-        else: 
-            rawForces = np.array([rawdata[self.Fx_chan],
-                               rawdata[self.Fy_chan],
-                               rawdata[self.Fz_chan],
-                               rawdata[self.Mx_chan],
-                               rawdata[self.My_chan],
-                               rawdata[self.Mz_chan]], float).transpose()
+        rawForces = gauge_inputs(self, rawdata)
   
-        # Apply the Interaction Matrix
-        def intMatrix ( a, b):
-            return np.dot( a,b)
-        intForces = np.apply_along_axis(intMatrix, 1, rawForces, self.Int_Mat)
-
-        # Apply the Orientation Matrix
-        def orientMatrix ( a, b):
-            return np.dot( a,b)
-        compForces = np.apply_along_axis(orientMatrix, 1, intForces, self.Orient_Mat)
+        # Apply the Interaction and Orientation Matrices (fused)
+        if self.Kernel is None:
+            self.fuse()
+        compForces = np.dot(rawForces, self.Kernel)
 
         # Now compute the self weight vector in body coords
-        Wx, Wy, Wz = dt.doTransform(np.zeros(len(rawForces), dtype=float),
-                                    np.zeros(len(rawForces), dtype=float),
-                                    np.ones(len(rawForces), dtype=float)*self.weight,
-                                    phi,
-                                    theta,
-                                    psi) 
+        Wx, Wy, Wz = dt.gravityVector(self.weight, phi, theta, psi, len(rawForces))
     
         # And then take out the self weight using the body angles
         self.CFx = compForces[:,0] - Wx 
@@ -549,7 +672,7 @@ class Dyno6:
             self.CMy_z = self.CMy.mean()
             self.CMz_z = self.CMz.mean()
      
-class Rot_Dyno6:
+class Rot_Dyno6(ChunkedGauge):
     """ This class is a special case of a 6DOF dyno that rotates.  It
         is used for the propeller dyno.  Unlike the normal 6DOF dyno, we
     need to go from the rotating prop coordinate system into the body
@@ -566,15 +689,22 @@ class Rot_Dyno6:
 
     compute() - Computes the body forces for at a time step
 
+    computeChunk() - Computes the body forces for the next chunk of a run
+
     addZero() - Adds a point to the accumulated zeros array
 
     compZero() - Computes the average zero value for each channel
 
     """
+
+    # The channel attributes of the gauge inputs, in kernel row order
+    Inputs = ['Fx_chan', 'Fy_chan', 'Fz_chan', 'Mx_chan', 'My_chan', 'Mz_chan']
+
     def __init__(self,  calfile):
         """ The constructor needs the calfile dictionary
             for the dyno
         """
+        self.calsig = cal_signature(calfile)
 
         # First we get the channel assignments
 
@@ -619,15 +749,19 @@ class Rot_Dyno6:
         # Now for the interaction Matrix and Orient Matrix
         self.Int_Mat = calfile['Int_Mat']
         self.Orient_Mat = calfile['Orient_Mat']
+        try:
+            self.fuse()
+        except:
+            # Incomplete cal, compute will fail as it always has
+            self.Kernel = None
 
         # initialize the rotation sensor
         self.lastpos = 0
         self.rotating = 0
 
-        # For the prop running averages we need to create some ring buffers
-        self.runavg = []
-        for i in range(4):
-            self.runavg.append(RingBuffer(100))
+        # For the prop running averages (Fy, Fz, My, Mz) when the run is
+        # computed in chunks we keep the last records in a ring buffer
+        self.runavg = RingBuffer(100, 4)
             
         # Finally we set the channel zeros to zero
         self.zeros = np.array(([0.0, 0.0, 0.0, 0.0, 0.0, 0.0]), float)
@@ -638,12 +772,37 @@ class Rot_Dyno6:
         self.CMy_z = 0.0
         self.CMz_z = 0.0        
 
-    def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
+    def fuse(self):
+        """ Precomposes the Interaction and Orientation matrices into
+            the single (6 x 6) kernel applied by compute
+        """
+        self.Kernel = np.dot(self.Int_Mat, self.Orient_Mat)
+
+    def computeChunk(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0):
+        """ Same as compute() but for the next chunk of records of a run.
+        The running means carry on from the previous chunks.
+        """
+        if doZeros == 1:
+            self.compute(rawdata, bodyAngles, cb_id=cb_id, doZeros=doZeros,
+                         history=self.runavg)
+        else:
+            self.compute(rawdata, bodyAngles, cb_id=cb_id, doZeros=doZeros)
+            self.addZeroChunk(len(rawdata))
+
+    def resetChunks(self):
+        """ Clears the state carried between chunks """
+        ChunkedGauge.resetChunks(self)
+        self.runavg.clear()
+
+    def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0, history=None):
         """ Compute the corrected forces for the current timestep using
         the interaction and orientation matricies
 
         Also do the rotation to model coords and subtract the prop
         weight
+
+        history - a RingBuffer of the records before rawdata for the
+        running means, updated with rawdata (used by computeChunk)
         """
         # The bodyAngles are in radians
         # phi = bodyAngles[0]
@@ -656,16 +815,11 @@ class Rot_Dyno6:
              
         # Prop position depends on which centerbody it is
         try:
-            prop_pos = rawdata['prop_position'].copy(deep=True)
+            prop_pos = rawdata['prop_position'].to_numpy()
         except:
-            prop_pos = rawdata['Prop_Position'].copy(deep=True)
+            prop_pos = rawdata['Prop_Position'].to_numpy()
         
-        if cb_id < 12:
-            prop_pos = prop_pos.map(lambda x: x+20000 if (x < 0) else x)
-            prop_pos = prop_pos.map(lambda x: x-20000 if (x > 20000) else x)
-            rot_angle = (prop_pos * .01800) 
-        else:
-            rot_angle = prop_pos
+        rot_angle = prop_angle(prop_pos, cb_id)
             
         sinR = np.sin(np.radians(rot_angle))
         cosR = np.cos(np.radians(rot_angle))
@@ -674,85 +828,45 @@ class Rot_Dyno6:
         # Need to check for which we have so we can get values properly
         # Assume that if first one is a num all are nums
   
-        if self.Fx_chan.isdigit():
-            rawForces = np.array([rawdata[rawdata.columns[int(self.Fx_chan)]],
-                            rawdata[rawdata.columns[int(self.Fy_chan)]],
-                            rawdata[rawdata.columns[int(self.Fz_chan)]],
-                            rawdata[rawdata.columns[int(self.Mx_chan)]],
-                            rawdata[rawdata.columns[int(self.My_chan)]],
-                            rawdata[rawdata.columns[int(self.Mz_chan)]]], float).transpose()
-        else: 
-            rawForces = np.array([rawdata[self.Fx_chan],
-                            rawdata[self.Fy_chan],
-                            rawdata[self.Fz_chan],
-                            rawdata[self.Mx_chan],
-                            rawdata[self.My_chan],
-                            rawdata[self.Mz_chan]], float).transpose()
-           
-        # Apply the Interaction Matrix
-        def intMatrix ( a, b):
-            return np.dot( a,b)
-        intForces = np.apply_along_axis(intMatrix, 1, rawForces, self.Int_Mat)
+        rawForces = gauge_inputs(self, rawdata)
+  
+        # Apply the Interaction and Orientation Matrices (fused)
+        if self.Kernel is None:
+            self.fuse()
+        compForces = np.dot(rawForces, self.Kernel)
 
-        # Apply the Orientation Matrix
-        def orientMatrix ( a, b):
-            return np.dot( a,b)
-        compForces = np.apply_along_axis(orientMatrix, 1, intForces, self.Orient_Mat)
+        # The y,z forces and moments (Fy, Fz, My, Mz) rotate with the prop
+        rotating = compForces[:, [1, 2, 4, 5]]
 
         # In order to account for a DC shift in the dyno once the prop starts rotating
         # we want to subtract off the oscillation mean for the y,z forces and moments
-        # To do this we need the compForces as a pandas dataframe
-
-        compForcesFrame = pd.DataFrame(compForces,
-                                    columns=['compFx','compFy','compFz','compMx','compMy','compMz'])
-
+        # (a running mean over 100 records, only while the prop is turning)
         if doZeros == 1:
-            rawbodyFx = compForces[:,0]
-
-            meanFy = compForcesFrame.compFy.rolling(window=100).mean()
-            meanFy = meanFy.mask(rawdata[bodyAngles[6]]== 0, 0)
-            rawbodyFy = compForcesFrame.compFy.to_numpy() - meanFy
-            rawbodyFy = rawbodyFy.values
-            
-            meanFz = compForcesFrame.compFz.rolling(window=100).mean()
-            meanFz = meanFz.mask(rawdata[bodyAngles[6]]== 0, 0)
-            rawbodyFz = compForcesFrame.compFz.to_numpy() - meanFz
-            rawbodyFz = rawbodyFz.values
-            
-            rawbodyMx = compForces[:,3]
-            
-            meanMy = compForcesFrame.compMy.rolling(window=100).mean()
-            meanMy = meanMy.mask(rawdata[bodyAngles[6]]== 0, 0)
-            rawbodyMy = compForcesFrame.compMy.to_numpy() - meanMy
-            rawbodyMy = rawbodyMy.values
-            
-            meanMz = compForcesFrame.compMz.rolling(window=100).mean()
-            meanMz = meanMz.mask(rawdata[bodyAngles[6]]== 0, 0)
-            rawbodyMz = compForcesFrame.compMz.to_numpy() - meanMz
-            rawbodyMz = rawbodyMz.values
-        else:
-            rawbodyFx = compForces[:,0]
-            rawbodyFy = compForces[:,1]
-            rawbodyFz = compForces[:,2]
-            rawbodyMx = compForces[:,3]
-            rawbodyMy = compForces[:,4]
-            rawbodyMz = compForces[:,5]
+            if history is None:
+                mean = running_mean(rotating, 100)
+            else:
+                past = history.toarray()[-99:]
+                mean = running_mean(np.concatenate([past, rotating]), 100)[len(past):]
+                history.extend(rotating)
+            mean[rawdata[bodyAngles[6]].to_numpy() == 0] = 0.0
+            rotating -= mean
 
         # Now we need to rotate to the body coordinates
-        bodyFx = rawbodyFx
-        bodyFy = cosR * rawbodyFy - sinR * rawbodyFz
-        bodyFz = sinR * rawbodyFy + cosR * rawbodyFz
-        bodyMx = rawbodyMx
-        bodyMy = cosR * rawbodyMy - sinR * rawbodyMz
-        bodyMz = sinR * rawbodyMy + cosR * rawbodyMz
+        sinR = sinR[:, np.newaxis]
+        cosR = cosR[:, np.newaxis]
+        rotated = np.empty_like(rotating)
+        rotated[:, 0::2] = cosR * rotating[:, 0::2] - sinR * rotating[:, 1::2]
+        rotated[:, 1::2] = sinR * rotating[:, 0::2] + cosR * rotating[:, 1::2]
+
+        bodyFx = compForces[:,0]
+        bodyFy = rotated[:,0]
+        bodyFz = rotated[:,1]
+        bodyMx = compForces[:,3]
+        bodyMy = rotated[:,2]
+        bodyMz = rotated[:,3]
 
         # Now compute the self weight vector in body coords
-        Wx, Wy, Wz = dt.doTransform(np.zeros(len(bodyFx), dtype=float),
-                                    np.zeros(len(bodyFx), dtype=float),
-                                    np.ones(len(bodyFx), dtype=float)*self.weight,
-                                    phi,
-                                    theta,
-                                    psi) 
+        Wx, Wy, Wz = dt.gravityVector(self.weight, phi, theta, psi, len(bodyFx))
 
       
         # And then take out the self weight using the body angles
@@ -1017,3 +1131,193 @@ class Deck:
 
         self.zeros = self.zeros / count
 
+
+class GaugeEngine:
+    """ Computes a set of special gauges together.
+
+    The fixed gauges (Dyno6, Kistler6 and Kistler3) are evaluated as one
+    stack: all their input channels are gathered into one contiguous
+    block and each gauge's columns of it are multiplied by its own kernel
+    (not one block diagonal product, a NaN in one gauge's inputs would
+    then spread to all of them), giving an (N x gauges x 6) array that
+    the self weights and zeros are taken out of in place.  The gravity vector in body coords is the same for
+    every gauge so it is computed once and scaled by each gauge weight.
+    Other gauges (Rot_Dyno6) still use their own compute.
+
+    The outputs of all the gauges land in one (N x 6*gauges) block, in
+    gauge order, that can be added to a frame in one insert.  Each gauge
+    keeps its CFx...CMz (and zeros) attributes as before.
+
+    Runs longer than ChunkSize records are computed in blocks of
+    ChunkSize records on a pool of Threads threads (numpy lets go of the
+    GIL for the products), each block written straight into its rows of
+    the output.  The temporaries then only ever hold one block per
+    thread.  The stacked gauges split the blocks between the threads,
+    the others (the rotating dyno has running means carried from block
+    to block) go through theirs in order on one thread.
+
+    CLASS METHODS:
+
+    __init__ - Takes the list of (name, gauge) to compute
+
+    columns() - Returns the output channel names of the block
+
+    compute() - Computes all the gauges, returns the output block
+
+    computeStack() - Computes the stacked gauges for a block of inputs
+    """
+
+    Outputs = ['CFx', 'CFy', 'CFz', 'CMx', 'CMy', 'CMz']
+
+    # Records per block for long runs (0 for no blocks) and the number
+    # of threads computing them (None for the number of CPUs)
+    ChunkSize = 1 << 16
+    Threads = None
+
+    def __init__(self, gauges):
+        self.names = [name for name, gauge in gauges]
+        self.gauges = [gauge for name, gauge in gauges]
+        self.stacked = [i for i, gauge in enumerate(self.gauges)
+                        if isinstance(gauge, (Kistler6, Kistler3, Dyno6))]
+        self.Kernels = None
+        self.gravity = None
+
+    def columns(self):
+        """ Returns the output channel names, gauge_CFx etc., in block order """
+        return [name+'_'+x for name in self.names for x in self.Outputs]
+
+    def fuse(self):
+        """ Collects the kernels of the stacked gauges and the columns of
+            the input block each one applies to
+        """
+        stack = [self.gauges[i] for i in self.stacked]
+        for gauge in stack:
+            if gauge.Kernel is None:
+                gauge.fuse()
+        self.Kernels = []
+        row = 0
+        for gauge in stack:
+            k = len(gauge.Inputs)
+            self.Kernels.append((slice(row, row+k), gauge.Kernel))
+            row += k
+        self.weights = np.array([gauge.weight for gauge in stack], dtype=float)
+        self.arms = np.array([[gauge.armx, gauge.army, gauge.armz] for gauge in stack],
+                             dtype=float)
+
+    def compute(self, rawdata, bodyAngles, cb_id=10, doZeros=1.0, out=None, chunk=None):
+        """ Computes the gauges for the records in rawdata, the arguments
+            are those of the gauge compute methods.  The outputs are written
+            to out (or a new array) which is returned.
+
+            The gravity vector is computed from the body angles on the first
+            call and reused after, the same as each gauge used the first
+            len(rawdata) angles for its zeros.
+
+            chunk overrides ChunkSize.  The zeros pass (doZeros=0.0) is
+            always done in one piece, it is short and the zeros are means
+            over all of it.
+        """
+        nrecs = len(rawdata)
+        if out is None:
+            out = np.empty((nrecs, 6*len(self.gauges)), dtype=float)
+        if chunk is None:
+            chunk = self.ChunkSize
+
+        if self.stacked and self.Kernels is None:
+            self.fuse()
+        chans = []
+        for i in self.stacked:
+            chans.extend(gauge_channels(self.gauges[i], rawdata))
+        others = [i for i in range(len(self.gauges)) if i not in self.stacked]
+
+        if doZeros == 1.0 and chunk and nrecs > chunk:
+            self.computeChunked(rawdata, bodyAngles, cb_id, chans, others, out, chunk)
+        else:
+            if self.stacked:
+                if self.gravity is None:
+                    phi, theta, psi = bodyAngles[0], bodyAngles[1], bodyAngles[2]
+                    self.gravity = np.array(dt.gravityVector(1.0, phi, theta, psi), float).transpose()
+
+                # One block of every input channel and one product for all gauges
+                inputs = np.array([rawdata[chan] for chan in chans], float).transpose()
+                self.computeStack(inputs, self.gravity[:nrecs], doZeros, out)
+
+            for i in others:
+                gauge = self.gauges[i]
+                gauge.compute(rawdata, bodyAngles, cb_id=cb_id, doZeros=doZeros)
+                for j, x in enumerate(self.Outputs):
+                    out[:, 6*i+j] = getattr(gauge, x)
+
+        for i, gauge in enumerate(self.gauges):
+            # The gauge outputs are views of the block
+            for j, x in enumerate(self.Outputs):
+                setattr(gauge, x, out[:, 6*i+j])
+
+        return out
+
+    def computeStack(self, inputs, gravity, doZeros, out):
+        """ Computes the stacked gauges for a block of records.  inputs
+            holds their input channels (n x k), gravity the unit gravity
+            vector of each record (n x 3), and the outputs are written to
+            the n rows of out.  With doZeros=0.0 the zeros are set to the
+            means of the block.
+        """
+        nrecs = len(inputs)
+        forces = np.empty((nrecs, len(self.stacked), 6), dtype=float)
+        for s, (columns, kernel) in enumerate(self.Kernels):
+            forces[:, s, :] = np.dot(inputs[:, columns], kernel)
+
+        # Take out the self weights (N x gauges x 3)
+        W = gravity[:, np.newaxis, :] * self.weights[:, np.newaxis]
+        Wx, Wy, Wz = W[:, :, 0], W[:, :, 1], W[:, :, 2]
+        armx, army, armz = self.arms[:, 0], self.arms[:, 1], self.arms[:, 2]
+        forces[:, :, 0] -= Wx
+        forces[:, :, 1] -= Wy
+        forces[:, :, 2] -= Wz
+        forces[:, :, 3] -= (Wz*army - Wy*armz)
+        forces[:, :, 4] -= (-Wz*armx - Wx*armz)
+        forces[:, :, 5] -= (Wy*armx - Wx*army)
+
+        for s, i in enumerate(self.stacked):
+            gauge = self.gauges[i]
+            for j, x in enumerate(self.Outputs):
+                if doZeros == 1.0:              #Subtract zeros
+                    out[:, 6*i+j] = forces[:, s, j] - getattr(gauge, x+'_z')
+                else:                           #Compute Zeros
+                    out[:, 6*i+j] = forces[:, s, j]
+                    setattr(gauge, x+'_z', out[:, 6*i+j].mean())
+
+    def computeChunked(self, rawdata, bodyAngles, cb_id, chans, others, out, chunk):
+        """ The run pass of compute() in blocks of chunk records on a
+            thread pool.  chans are the input channels of the stacked
+            gauges and others the gauges computed on their own.
+        """
+        nrecs = len(rawdata)
+        starts = range(0, nrecs, chunk)
+
+        # Whole channel arrays (views of the frame blocks), not copies
+        columns = [np.asarray(rawdata[chan], dtype=float) for chan in chans]
+        phi, theta, psi = bodyAngles[0], bodyAngles[1], bodyAngles[2]
+
+        def stackChunk(start):
+            rows = slice(start, min(start + chunk, nrecs))
+            inputs = np.column_stack([column[rows] for column in columns])
+            gravity = np.array(dt.gravityVector(1.0, phi[rows], theta[rows], psi[rows]),
+                                float).transpose()
+            self.computeStack(inputs, gravity, 1.0, out[rows])
+
+        def otherChunks(i):
+            gauge = self.gauges[i]
+            gauge.resetChunks()
+            for start in starts:
+                rows = slice(start, min(start + chunk, nrecs))
+                gauge.computeChunk(rawdata.iloc[rows], bodyAngles, cb_id=cb_id, doZeros=1.0)
+                for j, x in enumerate(self.Outputs):
+                    out[rows, 6*i+j] = getattr(gauge, x)
+
+        with ThreadPoolExecutor(max_workers=self.Threads) as pool:
+            jobs = [pool.submit(otherChunks, i) for i in others]
+            if self.stacked:
+                jobs.extend(pool.submit(stackChunk, start) for start in starts)
+            for job in jobs:
+                job.result()
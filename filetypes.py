@@ -19,19 +19,195 @@
 # Imports - Standard Libraries
 import numpy as np
 import pandas as pd
-import warnings
+from collections import OrderedDict
 from nptdms import TdmsFile  #package for importing tdms file data into python using numpy arrays
 import os.path, time
-from scipy.interpolate import interp1d
-import struct
+import tempfile, shutil, weakref
+import re
 
 # Imports - Local Packages
 from search_file import search_file_walk
 from calfile_new import CalFile
 from tdms_calfile import TdmsCalFile
 import dynos_array as dynos
+import runcache
+import zerostore
+from runphase import RunPhases
+from tdms_scale import LinearScale, TableScale, compile_scale, apply_scales
+
+# Channels added to dataEU for each special gauge
+SpecialOutputs = ['CFx', 'CFy', 'CFz', 'CMx', 'CMy', 'CMz']
+
+def select_channels(run, channels, chan_names, depends, extra_names=[]):
+    """ Works out the data channels to read for a channels= projection.
+
+        channels is a list of channel names or numbers.  Numbers are
+        positions in the full channel list, i.e. chan_names followed by
+        the special gauge outputs and then extra_names.
+        depends are the channels the run processing (run_stats,
+        mapNavInfo) always needs.  The inputs of any special gauge whose
+        outputs are requested are added as well.
+
+        Sets run.wanted (requested names) and run.sp_needed (gauges to
+        compute) and returns the channel names to read in file order.
+    """
+    gauges = [g for g in getattr(run, 'sp_gauges', {}) if g != 'Deck']
+    allnames = list(chan_names) + [g+'_'+x for g in gauges for x in SpecialOutputs] + list(extra_names)
+
+    run.wanted = set()
+    for chan in channels:
+        if type(chan) != str:
+            if chan >= 0 and chan < len(allnames):
+                run.wanted.add(allnames[chan])
+        else:
+            run.wanted.add(chan)
+
+    needed = run.wanted | set(depends)
+    run.sp_needed = []
+    for gauge in gauges:
+        if any(gauge+'_'+x in run.wanted for x in SpecialOutputs):
+            run.sp_needed.append(gauge)
+            needed.update(dynos.resolve_channels(run.sp_gauges[gauge], chan_names))
+
+    return [name for name in chan_names if name in needed]
 
-warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+def special_gauge(channel):
+    """ Returns the special gauge a gauge output channel belongs to, e.g.
+        'Rotor' for 'Rotor_CFx', or None for any other channel
+    """
+    if type(channel) == str:
+        gauge, sep, output = channel.rpartition('_')
+        if sep and output in SpecialOutputs:
+            return gauge
+    return None
+
+def eu_positions(run):
+    """ Returns the dataEU column of each channel in chan_names of a full
+        (not projected) load, None for the outputs of the gauges still
+        pending.  dataEU is in chan_names order with the pending outputs
+        left out.  The BMS names are not unique so a channel number has to
+        be turned into a column position, not a name.
+    """
+    positions = []
+    column = 0
+    for k in range(len(run.chan_names)):
+        j = k - run.specialStart
+        if 0 <= j < len(run.specialNames) and special_gauge(run.specialNames[j]) in run.pending:
+            positions.append(None)
+        else:
+            positions.append(column)
+            column += 1
+    return positions
+
+def gauge_outputs(run, gauges, cb_id, depends, source, bodyAngles):
+    """ Computes the listed special gauges of run on the records of
+        source, returns their outputs as a frame (see compute_specials)
+    """
+    # The zeros section (mode=0x0F13) the gauge zeros are taken from
+    zeros = run.phases.select(source, RunPhases.ZEROS)
+
+    engine = dynos.GaugeEngine([(gauge, run.sp_gauges[gauge]) for gauge in gauges])
+    for gauge in engine.names:
+        print('Computing %s' % gauge)
+
+    # Before computing the data, need to compute the zeros
+    # This is done by passing in a subset of the data (the zeros section mode=0x0F13)
+    # and having this data processed and averaged.  The zeros only change
+    # with the run and the cals so they are kept in the run directory
+    store = zerostore.get_store(run.dirname)
+    if store is not None:
+        runkey = zerostore.run_key(os.path.join(run.dirname, run.filename), depends)
+    zeroed = list(zip(engine.names, engine.gauges))
+    if store is None or not store.restore(run.filename, runkey, zeroed):
+        engine.compute(zeros, bodyAngles, cb_id = cb_id, doZeros = 0.0)
+        if store is not None:
+            store.save(run.filename, runkey, zeroed)
+
+    # Then compute the run and add all the outputs to the EU dataframe at once
+    block = None
+    if getattr(run, 'memmap_dir', None) is not None:
+        block = run.newBlock('specials_' + engine.names[0], len(engine.columns()))
+    block = engine.compute(source, bodyAngles, cb_id = cb_id, doZeros = 1.0, out = block)
+    return pd.DataFrame(block, columns=engine.columns(), index=source.index, copy=False)
+
+def compute_specials(run, gauges, cb_id, depends):
+    """ Computes pending special gauges of run (an OBCFile or TDMSFile)
+        and adds their outputs to dataEU.
+
+        gauges is a list of gauge names (None for all the pending ones),
+        cb_id the cg/cb id the gauges use for the weights and depends the
+        side files the gauge zeros depend on (see zerostore).  The gauges
+        are computed on the records the run had when they were registered,
+        rows added since (the BMS padding) are zero.
+
+        A TDMS run has always loaded without the gauges that could not be
+        computed (e.g. a missing input channel).  Their outputs are left
+        NaN, so the channel numbers don't change, and the error is printed.
+    """
+    if gauges is None:
+        gauges = run.pending
+    gauges = [gauge for gauge in run.pending if gauge in gauges]
+    if not gauges:
+        return
+
+    # Pitch Roll Yaw
+    bodyAngles = [np.radians(run.phi), np.radians(run.theta), np.radians(run.psi),
+                  run.phichan, run.thetachan, run.psichan,
+                  run.rpmchan]
+
+    source = run.dataEU
+    if len(source) > run.specialLength:
+        source = source.iloc[:run.specialLength]
+
+    try:
+        outputs = gauge_outputs(run, gauges, cb_id, depends, source, bodyAngles)
+    except:
+        if run.filetype != 'AM-tdms':
+            raise
+        # Find the bad gauges by computing them one at a time
+        parts = []
+        for gauge in gauges:
+            try:
+                parts.append(gauge_outputs(run, [gauge], cb_id, depends, source, bodyAngles))
+            except Exception as error:
+                print('Could not compute %s: %s' % (gauge, error))
+                block = np.full((len(source), len(SpecialOutputs)), np.nan)
+                for j, x in enumerate(SpecialOutputs):
+                    setattr(run.sp_gauges[gauge], x, block[:, j])
+                parts.append(pd.DataFrame(block, columns=[gauge+'_'+x for x in SpecialOutputs],
+                                          index=source.index, copy=False))
+        outputs = pd.concat(parts, axis=1)
+
+    if len(run.dataEU) > len(source):
+        outputs = outputs.reindex(run.dataEU.index, fill_value=0)
+    if getattr(run, 'bmsFilled', False):
+        # readBMS has already zeroed the na values of the other columns
+        outputs = outputs.fillna(0)
+    run.pending = [gauge for gauge in run.pending if gauge not in gauges]
+
+    if run.channels is None and not getattr(run, 'lazy', False):
+        # Put the outputs in at their chan_names position (eu_positions),
+        # between slices of dataEU so the other columns are not copied
+        positions = eu_positions(run)
+        pieces = []
+        used = inserted = 0
+        for j, name in enumerate(run.specialNames):
+            if name in outputs.columns:
+                column = positions[run.specialStart + j] - inserted
+                if column > used:
+                    pieces.append(run.dataEU.iloc[:, used:column])
+                    used = column
+                pieces.append(outputs[[name]])
+                inserted += 1
+        pieces.append(run.dataEU.iloc[:, used:])
+        run.dataEU = pd.concat(pieces, axis=1)
+    else:
+        # Projected and lazy loads find their columns by name
+        run.dataEU = pd.concat([run.dataEU, outputs], axis=1)
+
+    # A cached run gets its entry rewritten with all the gauges in
+    if not run.pending:
+        runcache.update_run(run)
 
 class STDFile:
     """ Run file class for manipulation of standard merge data:
@@ -39,6 +215,10 @@ class STDFile:
         the run into memory and provides methods for accessing and
         getting info on the run.
 
+        Passing channels= (a list of channel names or numbers) only reads
+        those channels plus the ones the run stats need (DELIMTXT only).
+        Channel numbers and chan_names still refer to the full channel list.
+
         Public Methods are:
             __init__    : Intializes object, finds run and loads data
             info        : Prints the run information
@@ -58,13 +238,20 @@ class STDFile:
                 'VPM62':[17.0, 172.27, 89.25, 19.58],
                 'VPM':[17.0, 180.0, 100.0, 19.58]}
 
-    def __init__(self, run_number='0', search_path='.'):
+    # Channel numbers used by run_stats, compZnosesail and turnstats
+    StatChannels = [7, 8, 20, 21, 22, 25, 26]
+    NavChannels = ["'pitch'", "'roll'", "'yaw'", "'heading'", "'p'", "'q'", "'r'",
+                   "'u_ft/s'", "'v_ft/s'", "'w_ft/s'",
+                   "'raw_u_ft/s'", "'raw_v_ft/s'", "'raw_w_ft/s'", "'zsensor'"]
+
+    def __init__(self, run_number='0', search_path='.', channels=None):
         """ Initializes the run, finds and reads in the data. and
         sets up various variables
         The search_path defaults to the local directory. 
         
         If the run is not found it returns an empty structure
         """
+        self.channels = channels
 
         # Check if we know the path already
         if search_path == 'known':
@@ -95,7 +282,7 @@ class STDFile:
             self.time = []
             self.dt = 0
             self.len = 0.0
-        else:      
+        elif not runcache.load_run(self, fullname):
             dirname, filename = os.path.split(fullname)
 
             # First open the file and read the header info
@@ -143,13 +330,22 @@ class STDFile:
 
                 f.close()
 
+                # Only read the channels we need for a projection
+                usechans = None
+                if channels is not None:
+                    usechans = select_channels(self, channels, channames,
+                                               [channames[i] for i in STDFile.StatChannels
+                                                if i < len(channames)] + STDFile.NavChannels)
+
                 # Now use pandas to get the data and channel names
-                self.data = pd.read_table(fullname, sep='\s+', skiprows=5, names=channames)
-                self.chan_names = self.data.columns
+                self.data = pd.read_table(fullname, sep='\s+', skiprows=5, names=channames,
+                                          usecols=usechans)
+                self.chan_names = pd.Index(channames)
 
                 # Time is found in column 26 - subtract initial point to zero
-                self.data.iloc[:,26] -= self.data.iloc[0,26]
-                self.time = self.data.iloc[:,26]
+                timechan = self.chan_names[26]
+                self.data[timechan] -= self.data[timechan].iloc[0]
+                self.time = self.data[timechan]
 
                 
                 # get the geometry info from the table based on boat length
@@ -186,38 +382,29 @@ class STDFile:
                 self.nchans = int(line1.split()[0])
                 self.dt = float(line1.split()[1])
 
-                # Chan names are 6 per line
-                self.chan_names = []
-                for cnt in range(self.nchans/6):
+                # Chan names are 6 per line in fixed width fields, any left
+                # over are on one more line with a slightly different layout
+                chan_names = []
+                for cnt in range(self.nchans // 6):
                     line1 = f.readline()
-                    for x in range(6):
-                        if x == 0:
-                            name = line1[3:13]
-                        else:
-                            name = line1[3+(13*x):13+(13*x)]
-                        self.chan_names.append(name)
-                if (cnt+1)*6 != self.nchans:
+                    chan_names.extend(line1[3+(13*x):13+(13*x)] for x in range(6))
+                if self.nchans % 6:
                     line1 = f.readline()
-                    for x in range(self.nchans - ((cnt+1) * 6)):
-                        if x == 0:
-                            name = line1[5:13]
-                        else:
-                            name = line1[5+(12*x):13+(12*x)]
-                        self.chan_names.append(name)
-
-                # get the rest of the file in one big gulp
-                alldata = f.read().split()
-                datalist = []
-                rowdata = []
-                colcnt = 0
-                for value in alldata:
-                    rowdata.append(float(value))
-                    colcnt += 1
-                    if colcnt >= self.nchans:
-                        datalist.append(rowdata)
-                        rowdata = []
-                        colcnt = 0
-                self.data = np.array(datalist, dtype=float)
+                    chan_names.extend(line1[5+(12*x):13+(12*x)] for x in range(self.nchans % 6))
+                self.chan_names = pd.Index(chan_names)
+
+                # The rest of the file is whitespace separated values, nchans
+                # per record across as many lines as it takes.  Parse it in
+                # one call and drop any partial record at the end.
+                values = np.fromstring(f.read(), dtype=float, sep=' ')
+                f.close()
+                nrecs = len(values) // self.nchans
+                self.data = pd.DataFrame(values[:nrecs*self.nchans].reshape(nrecs, self.nchans),
+                                         columns=self.chan_names, copy=False)
+
+                # Block files are always read in full
+                self.channels = None
+
                 # There is no time channel, so make one
                 self.time = np.arange(0, len(self.data), dtype=float)
                 self.time = self.time * self.dt
@@ -227,7 +414,9 @@ class STDFile:
             self.gains = np.ones((self.nchans), dtype = float)
             self.zeros = np.zeros((self.nchans), dtype = float)
             
-            self.dataEU = (self.data - self.zeros) * self.gains
+            # A projected load has fewer columns, but it is all ones and zeros
+            ncols = self.data.shape[1]
+            self.dataEU = (self.data - self.zeros[:ncols]) * self.gains[:ncols]
 
             # Compute the run stats
             self.run_stats()
@@ -235,6 +424,10 @@ class STDFile:
             # Map navigation info
             self.mapNavInfo()
 
+            # Save for the next time the run is opened
+            if channels is None:
+                runcache.store_run(self)
+
     def info(self):
         """ Prints information on the run"""
 
@@ -264,10 +457,12 @@ class STDFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
-            else:
+            elif self.channels is None:
                 return self.dataEU.iloc[:,channel]
-        else:
-            return self.dataEU.loc[:,channel]
+            else:
+                # Projected load - numbers refer to the full channel list
+                channel = self.chan_names[channel]
+        return self.dataEU.loc[:,channel]
 
     def getRAWData(self, channel):
         """ Returns an array containing the request channel of data
@@ -279,10 +474,11 @@ class STDFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
-            else:
+            elif self.channels is None:
                 return self.data.iloc[:,channel]
-        else: 
-            return self.data.loc[:,channel]
+            else:
+                channel = self.chan_names[channel]
+        return self.data.loc[:,channel]
 
     def run_stats(self):
         """ Calculate important run stats like time of execute"""
@@ -291,10 +487,10 @@ class STDFile:
 
         try:
             # Find where the status goes to 5, this is execute time
-            status = list(self.data.iloc[:,25])
-            self.execrec = status.index(5)
+            status = self.data[self.chan_names[25]].values
+            self.execrec = int(np.flatnonzero(status == 5)[0])
             self.exectime = self.time[self.execrec]
-            self.stdbyrec = status.index(2)
+            self.stdbyrec = int(np.flatnonzero(status == 2)[0])
             self.stdbytime = self.time[self.stdbyrec]
 
             # Compute the normalized time, i.e. time from execute
@@ -307,31 +503,32 @@ class STDFile:
             self.stdbytime = 0
 
         # Now compute the value of each channel for 10 steps before
-        # execute and store this in case we want to match up initial values
-
-        self.init_values = []
-        for channel in range(self.nchans):
-            chan_avg = 0.0
-            count = 0
-            for x in range(self.execrec-10, self.execrec):
-                chan_avg += self.data.iloc[x,channel]
-                count += 1
-            self.init_values.append(chan_avg/count)
+        # execute and store this in case we want to match up initial values.
+        # The records are taken by position so an execute in the first 10
+        # records wraps round to the end of the run, as it always has.
+        # The means are column reductions, cumsum adds the records in
+        # order so the values are the same as summing them one at a time.
+        init = self.data.iloc[np.arange(self.execrec-10, self.execrec)].to_numpy(dtype=float)
+        init = pd.Series(np.cumsum(init, axis=0)[-1] / len(init), index=self.data.columns)
 
         # Now compute the approach value of each channel btwn stdby and 
-        # execute and store this
+        # execute and store this, 0.0 if there is no approach
+        appr = self.data.iloc[self.stdbyrec:self.execrec].to_numpy(dtype=float)
+        if len(appr):
+            appr = pd.Series(np.cumsum(appr, axis=0)[-1] / len(appr), index=self.data.columns)
+        else:
+            appr = pd.Series(0.0, index=self.data.columns)
 
+        # Channels not read in a projected load are set to nan
+        self.init_values = []
         self.appr_values = []
-        for channel in range(self.nchans):
-            chan_avg = 0.0
-            count = 0
-            for x in range(self.stdbyrec, self.execrec):
-                chan_avg += self.data.iloc[x,channel]
-                count += 1
-            try:
-                self.appr_values.append(chan_avg/count)
-            except:
-                self.appr_values.append(0.0)
+        for name in self.chan_names[:self.nchans]:
+            if name in init.index:
+                self.init_values.append(init[name])
+                self.appr_values.append(appr[name])
+            else:
+                self.init_values.append(np.nan)
+                self.appr_values.append(np.nan)
 
     def mapNavInfo(self):
         """ Maps the navigation information to standard
@@ -410,11 +607,11 @@ class STDFile:
                                                  zsail * np.cos(np.radians(self.appr_values[8]))*
                                                  np.cos(np.radians(self.appr_values[7])))
 
-        sinTH = np.sin(np.radians(data[data.columns[8]]))
-        cosTH = np.cos(np.radians(data[data.columns[8]]))
-        cosPH = np.cos(np.radians(data[data.columns[7]]))
-        self.Znose = data[data.columns[22]] + (-xnose * sinTH)
-        self.Zsail = data[data.columns[22]] + (-xsail * sinTH + zsail * cosTH * cosPH)
+        sinTH = np.sin(np.radians(data[self.chan_names[8]]))
+        cosTH = np.cos(np.radians(data[self.chan_names[8]]))
+        cosPH = np.cos(np.radians(data[self.chan_names[7]]))
+        self.Znose = data[self.chan_names[22]] + (-xnose * sinTH)
+        self.Zsail = data[self.chan_names[22]] + (-xsail * sinTH + zsail * cosTH * cosPH)
 
 
     def turnstats(self):
@@ -506,6 +703,45 @@ class STDFile:
 
 
 
+# bmsNameMap.txt contents by (path, mtime) so it is only read once
+_bmsNameCache = {}
+
+def readBMSNames():
+    """ Reads the BMS channel names and scale factors from bmsNameMap.txt
+        Returns lists of the names and gains
+    """
+    filename = os.path.abspath('bmsNameMap.txt')
+    key = (filename, os.stat(filename).st_mtime_ns)
+    if key not in _bmsNameCache:
+        bmsNames = []
+        bmsGains = []
+        with open(filename, mode='r') as file:
+            NameMap = file.read().splitlines()
+        for line in NameMap:
+            name, gain = line.split(',')
+            bmsNames.append(name)
+            bmsGains.append(float(gain))
+        _bmsNameCache.clear()
+        _bmsNameCache[key] = (bmsNames, bmsGains)
+    bmsNames, bmsGains = _bmsNameCache[key]
+    return list(bmsNames), list(bmsGains)
+
+def bmsDtype(*formats):
+    """ Converts struct formats into a numpy structured dtype with one
+        field per value, so a packet can be decoded with frombuffer
+    """
+    fields = []
+    for fmt in formats:
+        order, fmt = fmt[0], fmt[1:]
+        for count, code in re.findall(r'(\d*)([a-zA-Z])', fmt):
+            for n in range(int(count or 1)):
+                fields.append(('f%d' % len(fields), order + code))
+    return np.dtype(fields)
+
+# BMS Pkt format - 208 bytes It has both big and little endian numbers
+BMSPacket = bmsDtype('<71B2h8B2h8Bh3Bh5B2h3B2h', '>36h6B6h')
+
+
 class OBCFile:
     """ Run file class for manipulation of AM OBC data:
         Initializing an instance of the class reads
@@ -517,12 +753,32 @@ class OBCFile:
             info        : Prints the run information
             getEUData   : Returns a column of data converted to EU
             getRawData  : Returns a column of raw data
+            materializeSpecials : Computes the special gauges not yet computed
+
+        Passing channels= (a list of channel names or numbers) only reads
+        those channels plus the mode, nav and special gauge channels that
+        are needed to process them.  Only the special gauges whose outputs
+        are requested are computed.  Channel numbers and chan_names still
+        refer to the full channel list.
+
+        The special gauge outputs are listed in chan_names as soon as the
+        run is loaded but a gauge is only computed (materializeSpecials)
+        the first time getEUData asks for one of its outputs.
     """
 
-    def __init__(self, run_number='0', search_path='.'):
+    # Channels used by run_stats/mapNavInfo/computeSpecials by name
+    NavChannels = ['ln200_pitch', 'ln200_roll', 'ln200_heading',
+                   'ln200_x_ang_rate', 'ln200_y_ang_rate', 'ln200_z_ang_rate',
+                   'adcp_x_vel_btm', 'adcp_y_vel_btm', 'adcp_z_vel_btm',
+                   'obs_depth2', 'prop_rpm', 'prop_position', 'mode325']
+
+    def __init__(self, run_number='0', search_path='.', channels=None):
         """ Initialize the run, find and read in the data.
             The search_path defults to only the local directory.
         """
+        self.channels = channels
+        self.pending = []
+        self.bmsFilled = False
         
         # Check if we know the path already
         if search_path == 'known':
@@ -554,7 +810,12 @@ class OBCFile:
             dirname, filename = os.path.split(fullname)
             runfile = os.path.join(dirname, 'run-'+run_number+'.run')
             calfilename = os.path.join(dirname, 'run-'+run_number+'.cal')
-            
+            bmsfilename = os.path.join(dirname, 'run-'+run_number+'.bms')
+
+            # Use the cached copy of the run if the inputs are unchanged
+            if runcache.load_run(self, fullname, [calfilename, runfile, bmsfilename,
+                                            'bmsNameMap.txt']):
+                return
 
             self.filename = filename
             self.dirname = dirname
@@ -635,10 +896,30 @@ class OBCFile:
             if cal.has6DOF == "TRUE":
                 for i in range(1,cal.num_6DOF+1):
                     self.sp_gauges['6DOF%d' %i] = dynos.Dyno6(cal.sixDOF[i-1])
-                   
+
+            # Look up any gauge channels given by number once, here
+            for gauge in self.sp_gauges:
+                dynos.resolve_channels(self.sp_gauges[gauge], chan_names)
+
+            # Only read the channels we need for a projection
+            usechans = None
+            if channels is not None:
+                # BMS channels come after the special gauge outputs
+                bmsNames = []
+                if os.path.isfile(bmsfilename):
+                    try:
+                        bmsNames = readBMSNames()[0]
+                    except:
+                        pass
+                usechans = select_channels(self, channels, chan_names,
+                                           OBCFile.NavChannels + [chan_names[325]],
+                                           bmsNames)
+                gainss = gainss[usechans]
+                zeross = zeross[usechans]
 
             # Finally read in raw data and convert to EU
-            data = pd.read_table(obcfile, sep='\s+', header=None, names=chan_names)
+            data = pd.read_table(obcfile, sep='\s+', header=None, names=chan_names,
+                                 usecols=usechans)
             self.data = data
             
             self.dataEU = (self.data - zeross) * gainss
@@ -727,8 +1008,10 @@ class OBCFile:
             
             # Read the BMS packet
             self.readBMS()
-            
-            
+
+            # Save for the next time the run is opened
+            if channels is None:
+                runcache.store_run(self)
 
     def info(self):
         """ Prints information on the run"""
@@ -756,10 +1039,19 @@ class OBCFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
+            elif self.channels is None:
+                if not self.pending:
+                    return self.dataEU.iloc[:,channel].copy(deep=True)
+                # Gauges not yet computed are left out of dataEU
+                if special_gauge(self.chan_names[channel]) in self.pending:
+                    self.materializeSpecials([special_gauge(self.chan_names[channel])])
+                return self.dataEU.iloc[:,eu_positions(self)[channel]].copy(deep=True)
             else:
-                return self.dataEU.iloc[:,channel].copy(deep=True)
-        else:
-            return self.dataEU.loc[:,channel].copy(deep=True)
+                # Projected load - numbers refer to the full channel list
+                channel = self.chan_names[channel]
+        if special_gauge(channel) in self.pending:
+            self.materializeSpecials([special_gauge(channel)])
+        return self.dataEU.loc[:,channel].copy(deep=True)
 
     def getRAWData(self, channel):
         """ Returns an series containing the request channel of data
@@ -769,10 +1061,11 @@ class OBCFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
-            else:
+            elif self.channels is None:
                 return self.data.iloc[:,channel]
-        else: 
-            return self.data.loc[:,channel]
+            else:
+                channel = self.chan_names[channel]
+        return self.data.loc[:,channel]
 
     def run_stats(self):
         """ Calculate important run stats.
@@ -782,15 +1075,17 @@ class OBCFile:
                 normalized time (from exe)
                 
                 Also the values during zeros and the approach values
+
+            The mode channel segments are kept in self.phases (RunPhases)
         """
 
 
-        # First we need to extract the mode channel
-        status = list(self.data.iloc[:,325])
+        # First we need to extract the mode channel and split it into phases
+        self.phases = RunPhases(self.data[self.chan_names[325]].values)
         try: 
-            self.stdbyrec = status.index(0x0F33)
+            self.stdbyrec = self.phases.first(RunPhases.STANDBY)
             self.stdbytime = self.time[self.stdbyrec]
-            self.execrec = status.index(0x0F43)
+            self.execrec = self.phases.first(RunPhases.EXECUTE)
             self.exectime = self.time[self.execrec]
         except:
             self.stdbyrec = 0
@@ -802,10 +1097,10 @@ class OBCFile:
 
         
         # Get the values during zeros
-        self.avgEUzeros = self.dataEU.query('mode325 == 0x0F13').mean()
-        self.avgRawzeros = self.data.query('mode325 == 0x0F13').mean()
+        self.avgEUzeros = self.phases.select(self.dataEU, RunPhases.ZEROS).mean()
+        self.avgRawzeros = self.phases.select(self.data, RunPhases.ZEROS).mean()
         # And approach
-        self.avgappr = self.dataEU.query('mode325 == 0x0F33').mean()
+        self.avgappr = self.phases.select(self.dataEU, RunPhases.STANDBY).mean()
         # Initial values - Legacy
         self.init_values = self.avgappr.values
         
@@ -848,74 +1143,33 @@ class OBCFile:
     
     def computeSpecials(self):
         """
-            This section does the computations for the special gauges
-            like the 6DOF Dynos.  The computed channels are added to the data
-            structure as additional columns
+            This section sets up the special gauges like the 6DOF Dynos.
+            Their output channels are added to chan_names straight away
+            but are only computed (materializeSpecials) and added to the
+            data structure the first time one of them is asked for
         """
-        # Pitch
-        theta = np.radians(self.theta)
-
-        #Roll
-        phi = np.radians(self.phi)
-
-        # Yaw
-        psi = np.radians(self.psi)
-
-        bodyAngles = [phi, theta, psi,
-                    self.phichan, self.thetachan, self.psichan,
-                    self.rpmchan]
-
-        try:
-            for gauge in self.sp_gauges.keys():
-                
-                print('Computing %s' % gauge)
-                # Compute the special gauges - The Deck is not used and has not been updates
-                if (gauge != 'Deck'):
-                    
-                    # Before computing the data, need to compute the zeros
-                    # This is done by passing in a subset of the data (usually the zeros section mode=0x0F13)
-                    # and having this data processed and averaged
-                    
-                    # But for the rotor we want the running zero during the approach (mode=0x0F33)
-                    # This can cause an error though if there was no standby (i.e. and aborted run)
-                    # so we wrap this in a try clause and default back to the zeros portion if necessary
-                    
-                    if (gauge == 'Rotor'):
-                        try:
-                            self.sp_gauges[gauge].compute(self.dataEU.query('mode325 == 0x0F13'),
-                                        bodyAngles, 
-                                        cb_id = 10,
-                                        doZeros = 0.0)
-                        except:
-                            self.sp_gauges[gauge].compute(self.dataEU.query('mode325 == 0x0F13'),
-                                        bodyAngles, 
-                                        cb_id = 10,
-                                        doZeros = 0.0)
+        # The Deck is not used and has not been updated.  A projected load
+        # only computes the gauges asked for, the outputs of the others are
+        # still listed so channel numbers don't change
+        gauges = [gauge for gauge in self.sp_gauges if gauge != 'Deck']
+        self.pending = [gauge for gauge in gauges
+                        if self.channels is None or gauge in self.sp_needed]
+        self.specialLength = len(self.dataEU)
+        self.specialStart = len(self.chan_names)
+        self.specialNames = [gauge+'_'+x for gauge in gauges for x in SpecialOutputs]
+
+        # Update the channel names and number
+        self.chan_names = self.chan_names + self.specialNames
+        self.nchans = len(self.chan_names)
+
+    def materializeSpecials(self, gauges=None):
+        """ Computes the pending special gauges, or only those listed in
+            gauges, and adds their outputs to dataEU
+        """
+        compute_specials(self, gauges, 10,
+                         [os.path.join(self.dirname, self.basename+'.cal'),
+                          os.path.join(self.dirname, self.basename+'.run')])
 
-                    else:
-                        self.sp_gauges[gauge].compute(self.dataEU.query('mode325 == 0x0F13'),
-                                    bodyAngles, 
-                                    cb_id = 10,
-                                    doZeros = 0.0)
-
-                    self.sp_gauges[gauge].compute(self.dataEU,
-                                bodyAngles, 
-                                cb_id = 10,
-                                doZeros = 1.0)
-
-                    # Then append to the EU dataframe
-                    self.dataEU[gauge+'_CFx'] = self.sp_gauges[gauge].CFx
-                    self.dataEU[gauge+'_CFy'] = self.sp_gauges[gauge].CFy
-                    self.dataEU[gauge+'_CFz'] = self.sp_gauges[gauge].CFz
-                    self.dataEU[gauge+'_CMx'] = self.sp_gauges[gauge].CMx
-                    self.dataEU[gauge+'_CMy'] = self.sp_gauges[gauge].CMy
-                    self.dataEU[gauge+'_CMz'] = self.sp_gauges[gauge].CMz
-                    # Update the channel names and number
-                    self.chan_names = self.dataEU.columns.values.tolist()
-                    self.nchans = len(self.chan_names)
-        except:
-            raise
-        
     def readBMS(self):
         """
             This routine reads the BMS packet (if present) and adds the
@@ -923,54 +1177,59 @@ class OBCFile:
         """
         # This could go bad and it is optional so wrap it all in a try
         try:
-            # BMS Pkt format - 208 bytes It has both big and little endian
-            # numbers so need to read it in parts
-            bmsFmtA = '<71B2h8B2h8Bh3Bh5B2h3B2h'
-            bmsFmtB = '>36h6B6h'
-            
             # Read in channel names and scale factors
-            
-            self.bmsNames = []
-            self.bmsGains = []
-            with open('bmsNameMap.txt', mode='r') as file:
-                NameMap = file.read().splitlines()
-            for line in NameMap:
-                name, gain = line.split(',')
-                self.bmsNames.append(name)
-                self.bmsGains.append(float(gain))
+            self.bmsNames, self.bmsGains = readBMSNames()
+            if len(self.bmsNames) != len(BMSPacket.names):
+                raise ValueError('bmsNameMap.txt does not match the BMS packet')
             
             bmsfilename = os.path.join(self.dirname, self.basename+'.bms')
             # First open and read in the bms file
             with open(bmsfilename, mode='rb') as file:
                 bmsFile = file.read()
             
-            # Now parse it
-            index = 0
-            bmsArray=[]
-            bmsRow=[]
-            for n in range(int(len(bmsFile)/208)):
-                rowA = struct.unpack_from(bmsFmtA, bmsFile, offset=index)
-                index += struct.calcsize(bmsFmtA)
-                for item in rowA:
-                    bmsRow.append(item)
-                
-                rowB = struct.unpack_from(bmsFmtB, bmsFile, offset=index)
-                index += struct.calcsize(bmsFmtB)
-                for item in rowB:
-                    bmsRow.append(item)
-                
-                # Now pad to 100 Hz
-                for n in range(99):
-                    bmsArray.append(bmsRow)
-                bmsRow=[]
-                
-            self.bmsData = pd.DataFrame(np.array(bmsArray), columns=self.bmsNames) * self.bmsGains
-            self.dataEU = pd.concat([self.dataEU, self.bmsData], axis=1)
-            # Clean up the na values caused by the concat
-            self.dataEU.fillna(0, inplace=True)
+            # Now parse it, all the packets in one go
+            packets = np.frombuffer(bmsFile, dtype=BMSPacket,
+                                    count=len(bmsFile) // BMSPacket.itemsize)
+            cols = range(len(self.bmsNames))
+            if self.channels is not None:
+                # Only attach the requested BMS channels for a projection
+                cols = [i for i in cols if self.bmsNames[i] in self.wanted]
+            bmsArray = np.empty((len(packets), len(cols)), dtype=float)
+            for j, i in enumerate(cols):
+                bmsArray[:, j] = packets['f%d' % i]
+            bmsArray *= np.array(self.bmsGains)[cols]
+
+            # Attaching the BMS data has always zeroed the na values already
+            # in dataEU (e.g. the start of the rotor running means) so keep
+            # doing that, but only for the columns that have any.  Gauges
+            # that read na values have to be computed before they are zeroed.
+            nacols = self.dataEU.columns[self.dataEU.isna().any().values]
+            if len(nacols) and self.pending:
+                reads = set([self.phichan, self.thetachan, self.psichan,
+                             self.rpmchan, 'prop_position'])
+                for gauge in self.pending:
+                    reads.update(dynos.gauge_channels(self.sp_gauges[gauge], self.dataEU))
+                if reads & set(nacols):
+                    self.materializeSpecials()
+            self.bmsFilled = True
+
+            # The EU and BMS columns go into one block, allocated once.  Now
+            # pad to 100 Hz by repeating each packet.  The shorter of the
+            # BMS and OBC data is filled out with zeros.
+            nrows = max(len(self.dataEU), 99*len(packets))
+            neu = self.dataEU.shape[1]
+            block = np.zeros((nrows, neu + len(cols)), dtype=float, order='F')
+            for j in range(neu):
+                column = block[:len(self.dataEU), j]
+                column[:] = self.dataEU.iloc[:, j].to_numpy()
+                column[np.isnan(column)] = 0.0
+            block[:99*len(packets), neu:] = np.repeat(bmsArray, 99, axis=0)
+            columns = self.dataEU.columns.append(pd.Index([self.bmsNames[i] for i in cols]))
+            self.dataEU = pd.DataFrame(block, columns=columns, copy=False)
+            self.bmsData = self.dataEU.iloc[:, neu:]
             
             # Update the channel names and number
-            self.chan_names = self.dataEU.columns.values.tolist()
+            self.chan_names = self.chan_names + self.bmsNames
             self.nchans = len(self.chan_names)
             
             # Recreate nTime because of BMS data mismatch
@@ -980,6 +1239,12 @@ class OBCFile:
         except:
             pass
             
+def nocal(prescaledVal):
+    '''
+    Function to return input float value or numpy array because no cal was defined
+    '''
+    return prescaledVal
+
 class TDMSFile:
     """ Run file class for manipulation of AM TDMS data:
         Initializing an instance of the class reads
@@ -1003,11 +1268,56 @@ class TDMSFile:
             info        : Prints the run information
             getEUData   : Returns a column of data converted to EU
             getRawData  : Returns a column of raw data
+            readChannel : Reads one channel on demand (lazy mode)
+            readAll     : Reads the rest of a lazy run
+            newBlock    : Allocates a data block (memory mapped in memmap mode)
+            materializeSpecials : Computes the special gauges not yet computed
+
+        Passing channels= (a list of channel names or numbers) opens the
+        file without reading it and then only reads those channels plus
+        the mode, nav and special gauge channels needed to process them.
+        Only the special gauges whose outputs are requested are computed.
+        Channel numbers and chan_names still refer to the full channel list.
+
+        The special gauge outputs are listed in chan_names as soon as the
+        run is loaded but a gauge is only computed (materializeSpecials)
+        the first time getEUData asks for one of its outputs.
+
+        Passing lazy=True also opens the file without reading it.  Only the
+        mode, nav and special gauge channels (plus any channels= given) are
+        read up front, every other channel is read from the file the first
+        time getEUData/getRAWData asks for it.  The last LRUChannels of these
+        are kept in memory.  readAll loads whatever has not been read yet.
+
+        Passing memmap_dir= (a directory, or True for the system temp
+        directory) is for runs too large for memory.  The file is streamed
+        in chunks of MemmapChunk samples into memory mapped blocks in a
+        scratch directory under memmap_dir, so data/dataEU and the special
+        gauge columns live on disk and are paged in as they are used.  The
+        scratch directory is removed when the run object is deleted.
     """      
-    def __init__(self, run_number='0', search_path='.'):
+
+    # Channels used by run_stats/mapNavInfo/computeSpecials by name
+    NavChannels = ['Phins Pitch', 'Phins Roll', 'Phins Heading',
+                   'Phins Rotation Rate XV1', 'Phins Rotation Rate XV2', 'Phins Rotation Rate XV3',
+                   'BTIR_Xvel', 'BTIR_Yvel', 'BTIR_Zvel', 'Depth2',
+                   'Prop_RPM', 'Prop_Position', 'prop_position', 'script_mode']
+
+    # Number of on demand channels kept in memory in lazy mode
+    LRUChannels = 16
+
+    # Number of samples read at a time in memmap mode
+    MemmapChunk = 1 << 20
+
+    def __init__(self, run_number='0', search_path='.', channels=None, lazy=False,
+                 memmap_dir=None):
         """ Initialize the run, find and read in the data.
             The search_path defults to only the local directory.
         """
+        self.channels = channels
+        self.lazy = lazy
+        self.memmap_dir = None
+        self.pending = []
         
         # Check if we know the path already
         if search_path == 'known':
@@ -1037,6 +1347,11 @@ class TDMSFile:
             
         else:      
             dirname, filename = os.path.split(fullname)
+
+            # Use the cached copy of the run if the inputs are unchanged
+            if runcache.load_run(self, fullname, [os.path.join(dirname, 'tdms_to_obc.cal'),
+                                            os.path.join(dirname, 'tdms_cal_updates.txt')]):
+                return
         
             self.filename = filename
             self.dirname = dirname
@@ -1047,9 +1362,19 @@ class TDMSFile:
             self.nchans = 0
             self.dt = 0.01
 
-            self.tdms_file_obj = TdmsFile.read(fullname)  #open the tdms file using nptdms package
+            if memmap_dir is not None:
+                # Scratch space for the data blocks, cleaned up with the run
+                self.memmap_dir = tempfile.mkdtemp(prefix='am_tdms_',
+                                                   dir=None if memmap_dir is True else memmap_dir)
+                weakref.finalize(self, shutil.rmtree, self.memmap_dir, ignore_errors=True)
+
+            if channels is None and not lazy and memmap_dir is None:
+                self.tdms_file_obj = TdmsFile.read(fullname)  #open the tdms file using nptdms package
+            else:
+                # Projection/lazy/memmap - just read the metadata, channels are read as needed
+                self.tdms_file_obj = TdmsFile.open(fullname)
             #Get the length of the data by looking at one of the channels
-            self.tdm_length = len(self.tdms_file_obj['DATA'][self.tdms_file_obj['DATA'].channels()[0].path.split("'")[3]][:])
+            self.tdm_length = len(self.tdms_file_obj['DATA'][self.tdms_file_obj['DATA'].channels()[0].path.split("'")[3]])
             
             # Get the channel mapping for the special gauges from the tdms_to_obc.cal file
             # 9/2021 - Woody has updated CB12 code to embed the 6DOF gauge info into the tdms file as 
@@ -1154,15 +1479,11 @@ class TDMSFile:
                 for i in range(self.nchans):
                     self.alt_names.append(str(self.tdms_file_obj['DATA'].channels()[i].path.split("'")[3]))
                 self.chan_names = sorted(self.alt_names, key=str.lower)
+                for gauge in self.sp_gauges:
+                    dynos.resolve_channels(self.sp_gauges[gauge], self.chan_names)
                 self.data_pkt_locs = []
                 self.eng_units = []
                 self.cal_dates = []
-                
-                def nocal(prescaledVal):
-                    '''
-                    Function to return input float value or numpy array because no cal was defined
-                    '''
-                    return prescaledVal
                             
                 # Then read the tdms file for the channel cals
                 # The new tdms library applies the scaling automatically so technically this is
@@ -1176,40 +1497,14 @@ class TDMSFile:
                         self.eng_units.append(chan_obj.properties['eng_units'])
                     except:
                         self.eng_units.append('NA')
-                    try:
-                        scaletype = str(chan_obj.properties['NI_Scale[0]_Scale_Type'])
-                        #Linear calibration scaling, dictionary will hold a lambda function to apply the linear cal to a given prescaled value
-                        if scaletype == 'Linear': 
-                    #       self.cals[channel] = (lambda x, m=chan_obj.properties['NI_Scale[0]_Linear_Slope'], b=chan_obj.properties['NI_Scale[0]_Linear_Y_Intercept'] : m*x+b)
-                    # The following sets the scaling to 1.0
-                            self.cals[channel] = (lambda x, m=1.0, b=0.0 : m*x+b)
-                        #Linear interpolation scaling between point in Table, dictionary will hold a scipy interpolation function 
-                        elif scaletype == 'Table':
-                            #import scaled values from the tdms file properties
-                            scaled = []
-                            i = 0
-                            while True:
-                                try:
-                                    scaled.append(chan_obj.properties['NI_Scale[0]_Table_Scaled_Values[' + str(i) + ']'])
-                                except:
-                                    break
-                                else:
-                                    i += 1
-                            #import pre-scaled values from the tmds file properties
-                            prescaled = []
-                            i = 0
-                            while True:
-                                try:
-                                    prescaled.append(chan_obj.properties['NI_Scale[0]_Table_Pre_Scaled_Values[' + str(i) + ']'])
-                                except:
-                                    break
-                                else:
-                                    i += 1
-                            self.cals[channel] = interp1d(prescaled, scaled, bounds_error=False)
-                        #No scaling is applied if no valid scaling type is found
-                        else: 
-                            self.cals[channel] = nocal
-                    except:
+                    # The NI_Scale properties are compiled by tdms_scale
+                    #   Linear - the scaling is set to 1.0 (nocal)
+                    #   Table  - a TableScale that interpolates in the table
+                    # No scaling is applied if no valid scaling type is found
+                    scale = compile_scale(chan_obj.properties)
+                    if isinstance(scale, TableScale):
+                        self.cals[channel] = scale
+                    else:
                         self.cals[channel] = nocal
                         
                 
@@ -1236,12 +1531,12 @@ class TDMSFile:
             for patch in patches:
                 try:
                     [section, gain, zero] = patch
-                    self.cals[section] = (lambda x, m=float(gain), b=float(zero) : m*x+b)
+                    self.cals[section] = LinearScale(float(gain), float(zero))
                 except:
                     # try with out the zero
                     try:
                         [section, gain] = patch
-                        self.cals[section] = (lambda x, m=float(gain), b=0.0 : m*x+b)
+                        self.cals[section] = LinearScale(float(gain))
                     except:
                     # Skip if error
                         print('Cal patch NOT applied')
@@ -1249,15 +1544,54 @@ class TDMSFile:
                     pass
 
                     
-            #read in all the data from the tmds file    
-            data = self.tdms_file_obj['DATA'][self.chan_names[0]][:]
-            dataEU = self.cals[self.chan_names[0]](self.tdms_file_obj['DATA'][self.chan_names[0]][:])
-            for i in range(1, self.nchans):
-                data = np.column_stack((data, self.tdms_file_obj['DATA'][self.chan_names[i]][:]))
-                dataEU = np.column_stack((dataEU, self.cals[self.chan_names[i]](self.tdms_file_obj['DATA'][self.chan_names[i]][:])))
+            # Only read the channels we need for a projection
+            if lazy:
+                # Everything needed for the processing, the rest on demand
+                self.lru = OrderedDict()
+                if channels is None:
+                    channels = [gauge+'_CFx' for gauge in self.sp_gauges]
+                usechans = select_channels(self, channels, self.chan_names,
+                                           TDMSFile.NavChannels)
+            elif channels is None:
+                usechans = self.chan_names
+            else:
+                usechans = select_channels(self, channels, self.chan_names,
+                                           TDMSFile.NavChannels)
+
+            # Read in the data from the tdms file.  Each channel is read once
+            # straight into preallocated raw and EU blocks.  These are Fortran
+            # ordered so each channel fills a contiguous column, which is also
+            # the layout pandas uses so the frames are built without a copy.
+            # If all the cals are identity the EU block is the raw block.
+            # In memmap mode the blocks are on disk and filled in chunks.
+            group = self.tdms_file_obj['DATA']
+            identity = all(self.cals[name] is nocal for name in usechans)
+            data = self.newBlock('data', len(usechans))
+            if identity:
+                dataEU = data
+            else:
+                dataEU = self.newBlock('dataEU', len(usechans))
+            # The cals are applied to the whole block (or chunk) at once
+            cals = [self.cals[name] for name in usechans]
+            if self.memmap_dir is None:
+                for i, name in enumerate(usechans):
+                    data[:, i] = group[name][:]
+                if not identity:
+                    apply_scales(cals, data, dataEU)
+            else:
+                for start in range(0, self.tdm_length, self.MemmapChunk):
+                    chunk = slice(start, start + self.MemmapChunk)
+                    for i, name in enumerate(usechans):
+                        data[chunk, i] = group[name].read_data(start, self.MemmapChunk)
+                    if not identity:
+                        apply_scales(cals, data[chunk], dataEU[chunk])
             
-            self.data = pd.DataFrame(data, columns=self.chan_names)
-            self.dataEU = pd.DataFrame(dataEU, columns=self.chan_names)
+            self.data = pd.DataFrame(data, columns=usechans, copy=False)
+            self.dataEU = pd.DataFrame(dataEU, columns=usechans, copy=False)
+
+            # A lazy run keeps the file open for the on demand reads
+            if not lazy:
+                self.tdms_file_obj.close()
             
            
          
@@ -1273,6 +1607,9 @@ class TDMSFile:
             except:
                 pass
 
+            # Save for the next time the run is opened
+            if channels is None and not lazy and self.memmap_dir is None:
+                runcache.store_run(self)
 
     def info(self):
         """ Prints information on the run"""
@@ -1300,10 +1637,21 @@ class TDMSFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
+            elif self.channels is None and not self.lazy:
+                if not self.pending:
+                    return self.dataEU.iloc[:,channel]
+                # Gauges not yet computed are left out of dataEU
+                if special_gauge(self.chan_names[channel]) in self.pending:
+                    self.materializeSpecials([special_gauge(self.chan_names[channel])])
+                return self.dataEU.iloc[:,eu_positions(self)[channel]]
             else:
-                return self.dataEU.iloc[:,channel]
-        else:
-            return self.dataEU.loc[:,channel]
+                # Projected/lazy load - numbers refer to the full channel list
+                channel = self.chan_names[channel]
+        if special_gauge(channel) in self.pending:
+            self.materializeSpecials([special_gauge(channel)])
+        if self.lazy and channel not in self.dataEU.columns:
+            return self.readChannel(channel)[1]
+        return self.dataEU.loc[:,channel]
 
         
     def getRAWData(self, channel):
@@ -1314,10 +1662,92 @@ class TDMSFile:
         if type(channel) != str:
             if channel < 0 or channel > self.nchans:
                 return None
-            else:
+            elif self.channels is None and not self.lazy:
                 return self.data.iloc[:,channel]
-        else: 
-            return self.data.loc[:,channel]
+            else:
+                channel = self.chan_names[channel]
+        if self.lazy and channel not in self.data.columns:
+            return self.readChannel(channel)[0]
+        return self.data.loc[:,channel]
+
+    def readChannel(self, channel):
+        """ Reads one channel from the file in lazy mode.
+            Returns the (raw, EU) data and keeps it in the LRU
+        """
+        if channel in self.lru:
+            self.lru.move_to_end(channel)
+            return self.lru[channel]
+
+        raw = np.asarray(self.tdms_file_obj['DATA'][channel][:], dtype=float)
+        eu = self.cals[channel](raw)
+        if eu is raw:
+            eu = raw.copy()
+        loaded = (pd.Series(raw, index=self.data.index, name=channel, copy=False),
+                  pd.Series(eu, index=self.dataEU.index, name=channel, copy=False))
+
+        self.lru[channel] = loaded
+        while len(self.lru) > self.LRUChannels:
+            self.lru.popitem(last=False)
+
+        # Keep the run stats complete for the channels read so far
+        if channel not in self.avgEUzeros.index:
+            try:
+                self.avgEUzeros[channel] = self.phases.select(loaded[1], RunPhases.ZEROS).mean()
+                self.avgRawzeros[channel] = self.phases.select(loaded[0], RunPhases.ZEROS).mean()
+                self.avgappr[channel] = self.phases.select(loaded[1], RunPhases.STANDBY).mean()
+                self.init_values = self.avgappr.values
+            except:
+                pass
+
+        return loaded
+
+    def readAll(self):
+        """ Reads all the channels not yet loaded in lazy mode so that
+            data and dataEU hold the full run.
+        """
+        if not self.lazy:
+            return
+        group = self.tdms_file_obj['DATA']
+        names = [name for name in self.chan_names if name in group]
+        # The gauge outputs computed so far go back in chan_names order
+        derived = sorted([name for name in self.dataEU.columns if name not in group],
+                         key=self.chan_names.index)
+
+        data = self.newBlock('data_all', len(names))
+        dataEU = self.newBlock('dataEU_all', len(names))
+        for i, name in enumerate(names):
+            if name in self.data.columns:
+                data[:, i] = self.data[name].values
+                dataEU[:, i] = self.dataEU[name].values
+            else:
+                raw, eu = self.readChannel(name)
+                data[:, i] = raw.values
+                dataEU[:, i] = eu.values
+
+        # Stats are for the file channels only, as in a full load
+        specials = self.dataEU[derived]
+        self.data = pd.DataFrame(data, columns=names, copy=False)
+        self.dataEU = pd.DataFrame(dataEU, columns=names, copy=False)
+        self.run_stats()
+        self.dataEU = pd.concat([self.dataEU, specials], axis=1)
+        self.mapNavInfo()
+
+        self.tdms_file_obj.close()
+        self.lru.clear()
+        self.lazy = False
+        self.channels = None
+
+    def newBlock(self, name, ncols):
+        """ Returns an empty Fortran ordered block of ncols channels.
+            In memmap mode the block is a memory mapped file in the
+            scratch directory.
+        """
+        if self.memmap_dir is None:
+            return np.empty((self.tdm_length, ncols), dtype=float, order='F')
+        return np.lib.format.open_memmap(os.path.join(self.memmap_dir, name + '.npy'),
+                                         mode='w+', dtype=float,
+                                         shape=(self.tdm_length, ncols),
+                                         fortran_order=True)
         
             
     #AM-tdms files post 2016/02/23 will have the script_mode channel, prior versions will not
@@ -1328,15 +1758,20 @@ class TDMSFile:
                 time of standby
                 time of execute
                 normalized time (from exe)
+
+            The mode channel segments are kept in self.phases (RunPhases)
         """
         try: 
-            # First we need to extract the mode channel
-            status = self.tdms_file_obj['DATA']['script_mode'][:]
-            self.stdbyrec = np.where(status == 0x0F33)[0][0]
+            # First we need to extract the mode channel and split it into phases
+            self.phases = RunPhases(self.data['script_mode'].values)
+            self.stdbyrec = self.phases.first(RunPhases.STANDBY)
             self.stdbytime = self.time[self.stdbyrec]
-            self.execrec = np.where(status == 0x0F43)[0][0]
+            self.execrec = self.phases.first(RunPhases.EXECUTE)
             self.exectime = self.time[self.execrec]
         except:
+            # No mode channel means no phases at all
+            if 'script_mode' not in self.data.columns:
+                self.phases = RunPhases([])
             # If there is no mode channel or no stby or exec flag, return all zeros
             self.stdbyrec = 0
             self.stdbytime = 0.0
@@ -1346,10 +1781,10 @@ class TDMSFile:
         self.ntime = self.time - self.exectime
  
         # Get the values during zeros
-        self.avgEUzeros = self.dataEU.query('script_mode == 0x0F13').mean()
-        self.avgRawzeros = self.data.query('script_mode == 0x0F13').mean()
+        self.avgEUzeros = self.phases.select(self.dataEU, RunPhases.ZEROS).mean()
+        self.avgRawzeros = self.phases.select(self.data, RunPhases.ZEROS).mean()
         # And approach
-        self.avgappr = self.dataEU.query('script_mode == 0x0F33').mean()
+        self.avgappr = self.phases.select(self.dataEU, RunPhases.STANDBY).mean()
         # Initial values - Legacy
         self.init_values = self.avgappr.values
 
@@ -1391,69 +1826,32 @@ class TDMSFile:
         
     def computeSpecials(self):
         """
-            This section does the computations for the special gauges
-            like the 6DOF Dynos.  The computed channels are added to the data
-            structure as additional columns
+            This section sets up the special gauges like the 6DOF Dynos.
+            Their output channels are added to chan_names straight away
+            but are only computed (materializeSpecials) and added to the
+            data structure the first time one of them is asked for
         """
-        # Pitch
-        theta = np.radians(self.theta)
-
-        #Roll
-        phi = np.radians(self.phi)
-
-        # Yaw
-        psi = np.radians(self.psi)
-
-        bodyAngles = [phi, theta, psi,
-                    self.phichan, self.thetachan, self.psichan,
-                    self.rpmchan]
-
-        
-        for gauge in self.sp_gauges.keys():
-            # Compute the special gauges - The Deck is not used and has not been updates
-            if (gauge != 'Deck'):
-                
-                # Before computing the data, need to compute the zeros
-                # This is done by passing in a subset of the data (usually the zeros section mode=0x0F13)
-                # and having this data processed and averaged
-                
-                # But for the rotor we want the running zero during the approach (mode=0x0F33)
-                # This can cause an error though if there was no standby (i.e. and aborted run)
-                # so we wrap this in a try clause and default back to the zeros portion if necessary
-                
-                if (gauge == 'Rotor'):
-                    try:
-                        self.sp_gauges[gauge].compute(self.dataEU.query('script_mode == 0x0F13'),
-                                      bodyAngles, 
-                                      cb_id = 12,
-                                      doZeros = 0.0)
-                    except:
-                        self.sp_gauges[gauge].compute(self.dataEU.query('script_mode == 0x0F13'),
-                                      bodyAngles, 
-                                      cb_id = 12,
-                                      doZeros = 0.0)
-
-                else:
-                    self.sp_gauges[gauge].compute(self.dataEU.query('script_mode == 0x0F13'),
-                                  bodyAngles, 
-                                  cb_id = 12,
-                                  doZeros = 0.0)
-
-                self.sp_gauges[gauge].compute(self.dataEU,
-                              bodyAngles, 
-                              cb_id = 12,
-                              doZeros = 1.0)
-
-                # Then append to the EU dataframe
-                self.dataEU[gauge+'_CFx'] = self.sp_gauges[gauge].CFx
-                self.dataEU[gauge+'_CFy'] = self.sp_gauges[gauge].CFy
-                self.dataEU[gauge+'_CFz'] = self.sp_gauges[gauge].CFz
-                self.dataEU[gauge+'_CMx'] = self.sp_gauges[gauge].CMx
-                self.dataEU[gauge+'_CMy'] = self.sp_gauges[gauge].CMy
-                self.dataEU[gauge+'_CMz'] = self.sp_gauges[gauge].CMz
-                # Update the channel names and number
-                self.chan_names = self.dataEU.columns.values.tolist()
-                self.nchans = len(self.chan_names)
+        # The Deck is not used and has not been updated.  A projected load
+        # only computes the gauges asked for, the outputs of the others are
+        # still listed so channel numbers don't change
+        gauges = [gauge for gauge in self.sp_gauges if gauge != 'Deck']
+        self.pending = [gauge for gauge in gauges
+                        if self.channels is None or gauge in self.sp_needed]
+        self.specialLength = len(self.dataEU)
+        self.specialStart = len(self.chan_names)
+        self.specialNames = [gauge+'_'+x for gauge in gauges for x in SpecialOutputs]
+
+        # Update the channel names and number
+        self.chan_names = self.chan_names + self.specialNames
+        self.nchans = len(self.chan_names)
+
+    def materializeSpecials(self, gauges=None):
+        """ Computes the pending special gauges, or only those listed in
+            gauges, and adds their outputs to dataEU
+        """
+        compute_specials(self, gauges, 12,
+                         [os.path.join(self.dirname, 'tdms_to_obc.cal'),
+                          os.path.join(self.dirname, 'tdms_cal_updates.txt')])
 
              
     def EU_file(self):
@@ -21,7 +21,7 @@ import wx.grid, wx.html
 # The actual plotting routines are found in plottools and the actual plot
 # page frame comes from multicanvas
 
-from plottools import get_runs_overplot, PlotPage
+from plottools import get_runs_overplot, plot_channels, PlotPage
 from multicanvas import MultiCanvasFrame
 from trackplot import TrackPlot
 
@@ -185,7 +185,8 @@ class OverPlotFrame(wx.Frame):
             runobjs,new_titles = get_runs_overplot(runlist,titles, 
                                                    obc_path = self.defaultPaths['obcOvrpltDir'],
                                                    std_path = self.defaultPaths['stdDir'],
-                                                   fst_path = self.defaultPaths['fstDir'] )
+                                                   fst_path = self.defaultPaths['fstDir'],
+                                                   channels = plot_channels(cfgfile))
             
             i = 0
             for title in titles:
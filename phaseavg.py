@@ -0,0 +1,181 @@
+# phaseavg.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    phaseavg.py - Phase averaged (per revolution) rotor loads
+
+    The rotating prop dyno (Rot_Dyno6, the Rotor gauge) outputs are binned
+    by shaft angle from the prop position channel and the mean and std of
+    each of the six components is taken per bin.  The binning is one
+    bincount pass over all the components, and a list of runs is done
+    in parallel, one run per worker process.
+
+    Usage:
+        python phaseavg.py [-g gauge] [-n nbins] [-b blades] [-w t0,t1[;t0,t1 ...]] run ...
+
+    writes <run>_phaseavg.csv in the current directory for each run.
+
+    FUNCTIONS:
+    shaft_angle        - Returns the shaft angle of each record of a run
+    window_mask        - Selects the records in a list of time windows
+    bin_average        - Per bin count, mean and std of a block of data
+    phase_average      - Phase averages the rotor outputs of a run
+    phase_average_runs - phase_average over a list of run files in parallel
+"""
+
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import dynos_array as dynos
+from filetypes import OBCFile, TDMSFile, SpecialOutputs
+
+
+def shaft_angle(run):
+    """ Returns the shaft angle (deg, 0-360) of each record of an OBC or
+        TDMS run from its prop position channel
+    """
+    try:
+        prop_pos = run.getEUData('prop_position').values
+    except:
+        prop_pos = run.getEUData('Prop_Position').values
+    cb_id = 12 if run.filetype == 'AM-tdms' else 10
+    return np.mod(dynos.prop_angle(prop_pos, cb_id), 360.0)
+
+
+def window_mask(times, windows):
+    """ Returns a mask of the records whose time is in any of the
+        (start, stop) windows, stop is not included
+    """
+    mask = np.zeros(len(times), dtype=bool)
+    for start, stop in windows:
+        mask |= (times >= start) & (times < stop)
+    return mask
+
+
+def bin_average(bins, data, nbins):
+    """ Returns the (count, mean, std) of the rows of data (N x k) in each
+        of nbins bins, bins is the bin of each row.  The std is the
+        population std (ddof=0), empty bins are NaN.
+    """
+    ncols = data.shape[1]
+    flat = (bins[:, np.newaxis] * ncols + np.arange(ncols)).ravel()
+    count = np.bincount(bins, minlength=nbins).astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(flat, weights=data.ravel(),
+                           minlength=nbins*ncols).reshape(nbins, ncols) / count[:, np.newaxis]
+        # Second pass about the bin means, sum of squares loses too much
+        dev = data - mean[bins]
+        std = np.sqrt(np.bincount(flat, weights=(dev*dev).ravel(),
+                                  minlength=nbins*ncols).reshape(nbins, ncols) / count[:, np.newaxis])
+    return count, mean, std
+
+
+def phase_average(run, gauge='Rotor', nbins=360, blades=1, windows=None):
+    """ Phase averages the outputs of a rotating gauge of run.
+
+        The shaft angle is folded onto one blade passage (360/blades deg)
+        and split into nbins bins.  windows is a list of (start, stop)
+        times in seconds from execute (run.ntime) to use, by default all
+        the records with the prop turning.  Records with a NaN output (the
+        start of the rotor running means) are left out.
+
+        Returns a DataFrame indexed by the bin centre angle with the
+        record count, the mean of each output (<gauge>_CFx ...) and its
+        std (<gauge>_CFx_std ...)
+    """
+    names = [gauge+'_'+x for x in SpecialOutputs]
+    data = np.column_stack([run.getEUData(name).values for name in names])
+
+    if windows is None:
+        use = run.getEUData(run.rpmchan).values != 0
+    else:
+        use = window_mask(np.asarray(run.ntime)[:len(data)], windows)
+    use &= ~np.isnan(data).any(axis=1)
+
+    span = 360.0 / blades
+    angle = np.mod(shaft_angle(run)[use], span)
+    bins = np.minimum((angle * (nbins / span)).astype(int), nbins - 1)
+    count, mean, std = bin_average(bins, data[use], nbins)
+
+    result = pd.DataFrame(np.column_stack([count, mean, std]),
+                          columns=['count'] + names + [name+'_std' for name in names],
+                          index=pd.Index((np.arange(nbins) + 0.5) * (span / nbins), name='angle'))
+    result['count'] = result['count'].astype(int)
+    return result
+
+
+def _load(fullname, gauge):
+    """ Opens an OBC or TDMS run file, reading only what the phase
+        average of gauge needs
+    """
+    head, tail = os.path.split(fullname)
+    root, ext = os.path.splitext(tail)
+    channels = [gauge+'_'+x for x in SpecialOutputs]
+    if ext.lower() == '.obc':
+        run = OBCFile(root[4:], search_path=head, channels=channels)
+    elif ext.lower() == '.tdms':
+        run = TDMSFile(root[4:], search_path=head, channels=channels)
+    else:
+        raise ValueError('%s is not an OBC or TDMS run' % fullname)
+    if not run.filename:
+        raise IOError('%s not found' % fullname)
+    return run
+
+
+def _phase_average_file(args):
+    """ Worker for phase_average_runs, returns the result or the error """
+    fullname, gauge, nbins, blades, windows = args
+    try:
+        return phase_average(_load(fullname, gauge), gauge, nbins, blades, windows)
+    except Exception as error:
+        return error
+
+
+def phase_average_runs(run_files, gauge='Rotor', nbins=360, blades=1, windows=None,
+                       workers=None):
+    """ Phase averages a list of OBC/TDMS run files, workers processes at
+        a time (default the number of CPUs).  Returns a dict of
+        {run file: DataFrame}, runs that fail to load or have no gauge
+        map to the exception instead.
+    """
+    jobs = [(name, gauge, nbins, blades, windows) for name in run_files]
+    if workers == 1 or len(jobs) < 2:
+        results = [_phase_average_file(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_phase_average_file, jobs))
+    return dict(zip(run_files, results))
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    options = {'-g': 'Rotor', '-n': '360', '-b': '1', '-w': None}
+    runs = []
+    while args:
+        arg = args.pop(0)
+        if arg in options and args:
+            options[arg] = args.pop(0)
+        else:
+            runs.append(arg)
+
+    windows = None
+    if options['-w']:
+        windows = [tuple(float(t) for t in w.split(',')) for w in options['-w'].split(';')]
+
+    results = phase_average_runs(runs, options['-g'], int(options['-n']),
+                                 int(options['-b']), windows)
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            print('%s: %s' % (name, result))
+            continue
+        outfile = os.path.splitext(os.path.basename(name))[0] + '_phaseavg.csv'
+        result.to_csv(outfile, float_format='%12.7e')
+        print('%s: %d records -> %s' % (name, result['count'].sum(), outfile))
@@ -21,6 +21,9 @@
                 FileType objects that hold the run data.  This is the primary
                 tool for reading in the data.  It is modified from get_runs to 
                 make overplot work.  
+    plot_channels() - Returns the list of channels used by a plot definition
+                file, for use as the channels= projection of the get_run(s)
+                functions
     xy_plt() -  Creates a single xy plot for a list of runs
     
     y_plt() -   Creates a single y vs time plot for a list of runs
@@ -41,12 +44,15 @@ import numpy as np
 
 
 
-def get_runs( run_list, obc_path='', std_path=''):
+def get_runs( run_list, obc_path='', std_path='', channels=None):
     """  Return a list of FileType objects for each run found
     
         Attempt to find each run in the run_list on either the
         specified paths, or the default.  If found, create a FileType object
         and return a list of objects found.  If no runs are found, return None
+
+        channels is an optional list of channel names/numbers, only these
+        (and what they depend on) are read
     """
     
     # Now parse the run_list
@@ -62,11 +68,11 @@ def get_runs( run_list, obc_path='', std_path=''):
     
     for runnum in run_list:
         if stdm.match(runnum.strip()):
-            runobj = STDFile(runnum, search_path=std_path)
+            runobj = STDFile(runnum, search_path=std_path, channels=channels)
         elif runnum[-3:] == 'obc':
-            runobj = OBCFile(runnum, search_path=obc_path)
+            runobj = OBCFile(runnum, search_path=obc_path, channels=channels)
         else:
-            runobj = TDMSFile(runnum, search_path=obc_path)
+            runobj = TDMSFile(runnum, search_path=obc_path, channels=channels)
     
         # If we found a run, add it to the list of run objects
         if runobj.filename:
@@ -74,34 +80,42 @@ def get_runs( run_list, obc_path='', std_path=''):
 
     return runs
 
-def get_run(run_list):
+def get_run(run_list, channels=None, lazy=False, memmap_dir=None):
     """  Return a FileType object for the run if found
     
         Special version of get_runs that retrives a run based
         on an absolute path
+
+        lazy=True opens TDMS runs without reading the data, channels
+        are then read as they are used.  memmap_dir= keeps the data of
+        large TDMS runs in memory mapped files under that directory
     """
     
     head, tail = os.path.split(run_list)
     root, ext = os.path.splitext(tail)
     
     if ext.lower() == '.std':
-        runobj = STDFile(run_list, search_path='known')
+        runobj = STDFile(run_list, search_path='known', channels=channels)
     elif ext.lower() == '.obc':
-        runobj = OBCFile(root[4:], search_path=head)
+        runobj = OBCFile(root[4:], search_path=head, channels=channels)
     elif ext.lower() == '.tdms':
-        runobj = TDMSFile(root[4:], search_path=head)
+        runobj = TDMSFile(root[4:], search_path=head, channels=channels, lazy=lazy,
+                          memmap_dir=memmap_dir)
     else:
         runobj = None
     
     return runobj
 
-def get_runs_overplot( run_list, title_list, obc_path='', std_path='', fst_path=''): #made a new 
+def get_runs_overplot( run_list, title_list, obc_path='', std_path='', fst_path='', channels=None): #made a new 
     """  Return a list of FileType objects for each run found
     
         Attempt to find each run in the run_list on either the
         specified paths, or the default.  If found, create a FileType object
         and return a list of objects found and a list of the index of each 
         object.  If no runs are found, return None
+
+        channels is an optional list of channel names/numbers, only these
+        (and what they depend on) are read
     """
       
     # Now parse the run_list
@@ -124,12 +138,12 @@ def get_runs_overplot( run_list, title_list, obc_path='', std_path='', fst_path=
             print(runnum)
             if runnum[0:3] != '790':
                 print("RCMdata")
-                runobj = STDFile(runnum, search_path=std_path)
+                runobj = STDFile(runnum, search_path=std_path, channels=channels)
             else:
                 print("Fullscale")
-                runobj = STDFile(runnum, search_path=fst_path)
+                runobj = STDFile(runnum, search_path=fst_path, channels=channels)
         else:
-            runobj = OBCFile(runnum, search_path=obc_path)
+            runobj = OBCFile(runnum, search_path=obc_path, channels=channels)
     
         # If we found a run, add it to the list of run objects
         if runobj.filename:
@@ -140,6 +154,21 @@ def get_runs_overplot( run_list, title_list, obc_path='', std_path='', fst_path=
     return runs, titles
 
 
+def plot_channels(plotdef):
+    """
+        Returns the list of channel numbers used by the plot definition
+        file plotdef, or None if it can't be read.  Channel 0 is included
+        since get_xy falls back to it.
+    """
+    try:
+        channels = set([0])
+        for line in open(plotdef):
+            if line.strip():
+                channels.update(int(chan) for chan in line.split()[0].split(','))
+    except:
+        return None
+    return sorted(channels)
+
 def get_xy(runobj, ychan=0, xchan=-1, EU=True):
     """
         Retrieve the x,y data from the runobj
@@ -0,0 +1,370 @@
+# runcache.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    runcache.py - Persistent binary cache for loaded runs
+
+    Parsing a run (text OBC, cal file, .run file, BMS packets and the special
+    gauge computations) can take 10-30 seconds.  Once a run has been loaded
+    by STDFile, OBCFile or TDMSFile the finished object is written to a cache
+    directory so that the next open is just a memory map of the data.
+
+    Each cached run is a directory holding:
+        meta.pkl        - all the scalar/small attributes of the run object
+        <frame>_<n>.npy - the data and dataEU frames, one Fortran ordered
+                          array per dtype so each column is contiguous
+
+    The cache key is built from the source file path, size and mtime, the
+    contents of the side files that feed the load (.cal, .run, .bms,
+    tdms_cal_updates.txt ...) and the source of the processing modules, so
+    any change to the inputs or the code gives a fresh load.
+
+    The special gauge outputs are computed on first access (see
+    filetypes.materializeSpecials), so a run is first stored with the
+    gauges still pending.  Once all of them are computed its entry is
+    rewritten (update_run) and later opens get the outputs from the cache.
+
+    The cache is limited in size, the least recently used runs are removed
+    when the limit is exceeded.
+
+    Environment:
+        AM_CACHE      - set to 0/off/no to disable the cache
+        AM_CACHE_DIR  - cache location (default ~/.am_cache)
+        AM_CACHE_SIZE - maximum cache size in MB (default 4096)
+
+    CLASSES:
+    RunCache - The cache itself
+
+    FUNCTIONS:
+    code_signature - Hash of the source of the processing modules
+    get_cache - Returns the shared cache instance (None if disabled)
+    load_run  - Restores a run object from the shared cache
+    store_run - Saves a run object restored/keyed by load_run
+    update_run - Rewrites the entry of a cached run
+"""
+
+import os
+import hashlib
+import pickle
+import shutil
+
+import numpy as np
+import pandas as pd
+
+# Bump this when the layout of the cached runs changes
+CACHE_VERSION = 1
+
+# Modules whose source changes the computed result of a load
+_CODE_FILES = ['filetypes.py', 'dynos_array.py', 'datatools.py',
+               'calfile_new.py', 'tdms_calfile.py', 'tdms_scale.py',
+               'runphase.py']
+
+# Attributes that are never stored in the cache
+_SKIP_ATTRS = ['data', 'dataEU', 'tdms_file_obj', 'bmsData', '_cachekey', '_cached']
+
+# Gauge outputs are stored as dataEU columns, not with the gauge
+_GAUGE_ATTRS = ['CFx', 'CFy', 'CFz', 'CMx', 'CMy', 'CMz']
+
+_default_cache = None
+_code_sig = None
+
+
+def code_signature():
+    """ Hash of the source of the processing modules """
+    global _code_sig
+    if _code_sig is None:
+        sig = hashlib.sha1()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for name in _CODE_FILES:
+            try:
+                with open(os.path.join(here, name), 'rb') as f:
+                    sig.update(f.read())
+            except:
+                sig.update(name.encode())
+        _code_sig = sig.hexdigest()
+    return _code_sig
+
+
+def _is_sample_vector(value, nrows):
+    """ True for full length per-sample arrays (views of dataEU) """
+    return (isinstance(value, (np.ndarray, pd.Series)) and value.ndim == 1
+            and len(value) == nrows)
+
+
+class RunCache:
+    """ A directory of cached runs with LRU eviction
+
+        Public Methods are:
+            key     : Builds the cache key for a run file and its inputs
+            load    : Restores a run object from the cache
+            store   : Writes a run object to the cache
+            evict   : Trims the cache back under the size limit
+            clear   : Removes all cached runs
+    """
+
+    def __init__(self, cache_dir=None, max_size=None):
+        """ cache_dir defaults to AM_CACHE_DIR or ~/.am_cache
+            max_size is in bytes and defaults to AM_CACHE_SIZE (MB) or 4 GB
+        """
+        if cache_dir is None:
+            cache_dir = os.environ.get('AM_CACHE_DIR',
+                                       os.path.join(os.path.expanduser('~'), '.am_cache'))
+        if max_size is None:
+            try:
+                max_size = int(float(os.environ['AM_CACHE_SIZE']) * 1024 * 1024)
+            except:
+                max_size = 4096 * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def key(self, run, fullname, depends=()):
+        """ Returns the key for the run file fullname loaded as the class
+            of run.  depends is a list of side files that feed the load,
+            missing files are allowed and just hash as missing.
+        """
+        sig = hashlib.sha1()
+        sig.update(('%d:%s:%s\n' % (CACHE_VERSION, type(run).__name__,
+                                    code_signature())).encode())
+        stat = os.stat(fullname)
+        sig.update(('%s:%d:%d\n' % (os.path.abspath(fullname), stat.st_size,
+                                    stat.st_mtime_ns)).encode())
+        for name in depends:
+            sig.update(('%s\n' % os.path.basename(name)).encode())
+            try:
+                with open(name, 'rb') as f:
+                    sig.update(hashlib.sha1(f.read()).digest())
+            except:
+                sig.update(b'missing')
+        return sig.hexdigest()
+
+    def load(self, key, run):
+        """ Restores the cached run into run.  Returns True on a hit.
+            The frames are memory mapped copy-on-write so changes made
+            by the caller never reach the cache.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        metaname = os.path.join(entry, 'meta.pkl')
+        try:
+            with open(metaname, 'rb') as f:
+                meta = pickle.load(f)
+            state = meta['state']
+            for frame in ['data', 'dataEU']:
+                if frame in meta['frames']:
+                    state[frame] = self._read_frame(entry, frame, meta['frames'][frame])
+        except:
+            return False
+
+        run.__dict__.update(state)
+
+        # Put the gauge outputs back on the gauges
+        for gauge, obj in getattr(run, 'sp_gauges', {}).items():
+            if gauge + '_CFx' in run.dataEU.columns:
+                for attr in _GAUGE_ATTRS:
+                    setattr(obj, attr, run.dataEU[gauge + '_' + attr].values)
+
+        # Mark as recently used
+        try:
+            os.utime(metaname, None)
+        except:
+            pass
+        return True
+
+    def store(self, key, run, replace=False):
+        """ Writes run to the cache.  An existing entry is kept unless
+            replace is set.  Failures are ignored, the cache is only an
+            accelerator.
+        """
+        entry = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry) and not replace:
+            return
+        tmpentry = '%s.tmp%d' % (entry, os.getpid())
+        oldentry = '%s.old%d' % (entry, os.getpid())
+        try:
+            os.makedirs(tmpentry)
+            nrows = len(run.dataEU)
+            state = {}
+            for name, value in run.__dict__.items():
+                if name in _SKIP_ATTRS:
+                    continue
+                if name not in ['time', 'ntime'] and _is_sample_vector(value, nrows):
+                    # Nav vectors etc. are rebuilt by mapNavInfo
+                    continue
+                if name == 'sp_gauges':
+                    value = self._strip_gauges(value)
+                try:
+                    pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                except:
+                    # e.g. lambda cals - these are simply not cached
+                    continue
+                state[name] = value
+
+            frames = {}
+            for frame in ['data', 'dataEU']:
+                if isinstance(getattr(run, frame, None), pd.DataFrame):
+                    frames[frame] = self._write_frame(tmpentry, frame, getattr(run, frame))
+
+            with open(os.path.join(tmpentry, 'meta.pkl'), 'wb') as f:
+                pickle.dump({'state': state, 'frames': frames}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            if os.path.isdir(entry):
+                # The old entry can't be renamed while it is mapped on some
+                # systems, it is then simply kept
+                os.rename(entry, oldentry)
+                try:
+                    os.rename(tmpentry, entry)
+                except:
+                    os.rename(oldentry, entry)
+                    raise
+                shutil.rmtree(oldentry, ignore_errors=True)
+            else:
+                os.rename(tmpentry, entry)
+        except:
+            shutil.rmtree(tmpentry, ignore_errors=True)
+            return
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """ Removes the least recently used runs until the cache fits
+            in max_size.  The run given by keep is never removed.
+        """
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except:
+            return
+        for name in names:
+            entry = os.path.join(self.cache_dir, name)
+            try:
+                used = os.path.getmtime(os.path.join(entry, 'meta.pkl'))
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            except:
+                continue
+            entries.append((used, size, name))
+            total += size
+
+        entries.sort()
+        for used, size, name in entries:
+            if total <= self.max_size:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """ Removes all the cached runs """
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def _strip_gauges(self, gauges):
+        """ Returns copies of the gauges without the computed outputs """
+        stripped = {}
+        for gauge, obj in gauges.items():
+            clone = object.__new__(type(obj))
+            clone.__dict__.update({k: v for k, v in obj.__dict__.items()
+                                   if k not in _GAUGE_ATTRS})
+            stripped[gauge] = clone
+        return stripped
+
+    def _write_frame(self, entry, frame, df):
+        """ Writes one frame as a Fortran ordered array per dtype.
+            Returns the layout info needed to rebuild it.
+        """
+        groups = []
+        others = []
+        dtypes = df.dtypes
+        for dtype in pd.unique(dtypes):
+            cols = [i for i in range(df.shape[1]) if dtypes.iloc[i] == dtype]
+            if isinstance(dtype, np.dtype) and dtype.kind in 'biuf':
+                filename = '%s_%d.npy' % (frame, len(groups))
+                block = np.asfortranarray(df.iloc[:, cols].to_numpy(dtype=dtype))
+                np.save(os.path.join(entry, filename), block)
+                groups.append((filename, cols))
+            else:
+                others.extend(cols)
+
+        layout = {'columns': df.columns,
+                  'groups': groups,
+                  'others': df.iloc[:, others] if others else None}
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            layout['index'] = df.index
+        return layout
+
+    def _read_frame(self, entry, frame, layout):
+        """ Rebuilds a frame written by _write_frame """
+        columns = layout['columns']
+        index = layout.get('index', None)
+        parts = []
+        order = []
+        for filename, cols in layout['groups']:
+            block = np.load(os.path.join(entry, filename), mmap_mode='c')
+            parts.append(pd.DataFrame(block, columns=columns[cols], copy=False))
+            order.extend(cols)
+        if layout['others'] is not None:
+            parts.append(layout['others'].reset_index(drop=True))
+            order.extend(i for i in range(len(columns)) if i not in order)
+
+        if len(parts) == 1:
+            df = parts[0]
+        elif parts:
+            # Back to the original column order (names may repeat)
+            df = pd.concat(parts, axis=1).iloc[:, np.argsort(order)]
+        else:
+            df = pd.DataFrame(columns=columns)
+        if index is not None:
+            df.index = index
+        return df
+
+
+def get_cache():
+    """ Returns the shared RunCache, or None if caching is disabled """
+    global _default_cache
+    if os.environ.get('AM_CACHE', '1').lower() in ['0', 'off', 'no', 'false']:
+        return None
+    if _default_cache is None:
+        _default_cache = RunCache()
+    return _default_cache
+
+
+def load_run(run, fullname, depends=()):
+    """ Restores run from the shared cache.  Returns True on a hit.
+        On a miss the key is kept on the run so that store_run can save
+        it once the load is complete.
+    """
+    run._cachekey = None
+    cache = get_cache()
+    if cache is None:
+        return False
+    try:
+        run._cachekey = cache.key(run, fullname, depends)
+    except:
+        return False
+    if not cache.load(run._cachekey, run):
+        return False
+    run._cached = True
+    # The nav info is just views of dataEU so rebuild it
+    run.mapNavInfo()
+    return True
+
+
+def store_run(run):
+    """ Saves a fully loaded run to the shared cache """
+    cache = get_cache()
+    if cache is not None and getattr(run, '_cachekey', None) is not None:
+        cache.store(run._cachekey, run)
+        run._cached = True
+
+
+def update_run(run):
+    """ Rewrites the entry of a run that came from or went into the
+        shared cache, e.g. once its special gauges are computed.  Runs
+        that were never cached (projected loads, or a load that is not
+        finished yet) are left alone.
+    """
+    cache = get_cache()
+    if cache is not None and getattr(run, '_cached', False):
+        cache.store(run._cachekey, run, replace=True)
@@ -0,0 +1,87 @@
+# runphase.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    runphase.py - Run phase segmentation from the mode channel
+
+    The mode channel (mode325 on OBC runs, script_mode on TDMS runs)
+    steps through zeros, standby, execute etc. during a run.  RunPhases
+    run-length encodes it once into segments of constant mode, so the
+    records of a phase can be taken as slices instead of scanning and
+    copying the whole frame for every average.
+
+    CLASSES:
+    RunPhases - The segments of a run
+"""
+
+import numpy as np
+
+
+class RunPhases:
+    """ Run-length encoded segments of a mode channel
+
+        Attributes:
+            starts, stops : record bounds of each segment
+            modes         : the mode value of each segment
+
+        Public Methods are:
+            segments : Returns the (start, stop) bounds of a mode
+            first    : Returns the first record of a mode
+            rows     : Returns the records of a mode for iloc
+            select   : Returns the rows of a frame for a mode
+    """
+
+    # Mode values on the AM (OBC/TDMS) runs
+    ZEROS = 0x0F13
+    STANDBY = 0x0F33
+    EXECUTE = 0x0F43
+
+    def __init__(self, mode):
+        mode = np.asarray(mode)
+        self.length = len(mode)
+        if self.length:
+            change = np.flatnonzero(mode[1:] != mode[:-1]) + 1
+            self.starts = np.concatenate([[0], change])
+            self.stops = np.concatenate([change, [self.length]])
+            self.modes = mode[self.starts]
+        else:
+            self.starts = np.zeros(0, dtype=int)
+            self.stops = np.zeros(0, dtype=int)
+            self.modes = mode
+
+    def __repr__(self):
+        return 'RunPhases(%d records, %d segments)' % (self.length, len(self.starts))
+
+    def segments(self, mode):
+        """ Returns a list of the (start, stop) bounds of the segments
+            in the given mode
+        """
+        which = np.flatnonzero(self.modes == mode)
+        return [(int(self.starts[i]), int(self.stops[i])) for i in which]
+
+    def first(self, mode):
+        """ Returns the first record in the given mode.  Raises a
+            ValueError if the mode never occurs.
+        """
+        which = np.flatnonzero(self.modes == mode)
+        if len(which) == 0:
+            raise ValueError('mode 0x%X not in the run' % int(mode))
+        return int(self.starts[which[0]])
+
+    def rows(self, mode):
+        """ Returns the records in the given mode as a slice (a single
+            segment, or none) or an array of record numbers
+        """
+        segs = self.segments(mode)
+        if len(segs) == 0:
+            return slice(0, 0)
+        elif len(segs) == 1:
+            return slice(*segs[0])
+        return np.concatenate([np.arange(start, stop) for start, stop in segs])
+
+    def select(self, frame, mode):
+        """ Returns the rows of frame (a DataFrame/Series) in the given mode """
+        return frame.iloc[self.rows(mode)]
@@ -0,0 +1,140 @@
+# tdms_scale.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    tdms_scale.py - Compiled NI_Scale calibrations for TDMS channels
+
+    TDMS channels carry their scaling as NI_Scale[n]_* properties.  This
+    module parses all of them in one pass over a channel's property dict
+    and compiles them into small scale objects that are applied to whole
+    arrays (or whole blocks of channels) with numpy.
+
+    It is used by both filetypes.TDMSFile and tdms_to_obc so the two agree
+    on how a channel is scaled.
+
+    CLASSES:
+    LinearScale - y = slope * x + intercept
+    TableScale  - linear interpolation in a table, NaN outside the table
+
+    FUNCTIONS:
+    parse_scales  - Collects the NI_Scale properties by scale index
+    compile_scale - Returns the scale object for a channel (None if unscaled)
+    apply_scales  - Applies a list of per channel scales to a block of data
+"""
+
+import re
+
+import numpy as np
+
+# NI_Scale[<scale>]_<name>[<index>], the [<index>] is only on table entries
+_SCALE_PROP = re.compile(r'^NI_Scale\[(\d+)\]_(.+?)(?:\[(\d+)\])?$')
+
+
+class LinearScale:
+    """ Linear scaling, y = slope * x + intercept """
+
+    def __init__(self, slope, intercept=0.0):
+        self.slope = float(slope)
+        self.intercept = float(intercept)
+
+    def __call__(self, x, out=None):
+        out = np.multiply(self.slope, x, out=out)
+        return np.add(out, self.intercept, out=out)
+
+    def __repr__(self):
+        return 'LinearScale(%r, %r)' % (self.slope, self.intercept)
+
+
+class TableScale:
+    """ Linear interpolation between the points of a table.  Values
+        outside the table are NaN.
+    """
+
+    def __init__(self, prescaled, scaled):
+        prescaled = np.asarray(prescaled, dtype=float)
+        scaled = np.asarray(scaled, dtype=float)
+        order = np.argsort(prescaled, kind='stable')
+        self.prescaled = prescaled[order]
+        self.scaled = scaled[order]
+
+    def __call__(self, x, out=None):
+        y = np.interp(x, self.prescaled, self.scaled, left=np.nan, right=np.nan)
+        if out is None:
+            return y
+        out[...] = y
+        return out
+
+    def __repr__(self):
+        return 'TableScale(%r, %r)' % (list(self.prescaled), list(self.scaled))
+
+
+def parse_scales(properties):
+    """ Collects the NI_Scale properties of a channel in one pass.
+        Returns {scale: {name: value}}, table entries are gathered into
+        {name: {index: value}}.
+    """
+    scales = {}
+    for prop, value in properties.items():
+        match = _SCALE_PROP.match(prop)
+        if match is None:
+            continue
+        scale, name, index = match.groups()
+        entry = scales.setdefault(int(scale), {})
+        if index is None:
+            entry[name] = value
+        else:
+            entry.setdefault(name, {})[int(index)] = value
+    return scales
+
+
+def compile_scale(properties, scale=0):
+    """ Returns a LinearScale or TableScale for the channel properties,
+        or None if the channel has no (supported) scaling or an empty table.
+    """
+    entry = parse_scales(properties).get(scale, {})
+    scaletype = str(entry.get('Scale_Type', ''))
+    try:
+        if scaletype == 'Linear':
+            return LinearScale(entry['Linear_Slope'], entry.get('Linear_Y_Intercept', 0.0))
+        elif scaletype == 'Table':
+            # Entries run from 0 up to the first missing index
+            scaled = entry.get('Table_Scaled_Values', {})
+            prescaled = entry.get('Table_Pre_Scaled_Values', {})
+            n = 0
+            while n in scaled and n in prescaled:
+                n += 1
+            if n == 0:
+                # An empty table can't be interpolated, leave it unscaled
+                return None
+            return TableScale([prescaled[i] for i in range(n)],
+                              [scaled[i] for i in range(n)])
+    except:
+        pass
+    return None
+
+
+def apply_scales(scales, block, out):
+    """ Applies scales[i] to column i of block, writing into out.
+        Runs of neighbouring LinearScale columns are done as one
+        broadcast multiply-add, TableScales with np.interp and any
+        other callable (e.g. an identity function) column by column.
+    """
+    ncols = len(scales)
+    i = 0
+    while i < ncols:
+        if isinstance(scales[i], LinearScale):
+            j = i
+            while j < ncols and isinstance(scales[j], LinearScale):
+                j += 1
+            slopes = np.array([s.slope for s in scales[i:j]])
+            intercepts = np.array([s.intercept for s in scales[i:j]])
+            np.multiply(slopes, block[:, i:j], out=out[:, i:j])
+            np.add(out[:, i:j], intercepts, out=out[:, i:j])
+            i = j
+        else:
+            out[:, i] = scales[i](block[:, i])
+            i += 1
+    return out
@@ -7,7 +7,7 @@ import math as m
 import os.path, time
 import numpy as np
 import configparser as ConfigParser
-from scipy.interpolate import interp1d
+from tdms_scale import LinearScale, TableScale, compile_scale
 import wx
 import os
 from shutil import copyfile
@@ -125,35 +125,15 @@ def tdmsToOBC(tdmsfile, obcDirectory):
         except:
             eng_units[obc_col] = 'NA'
         try:
-            scaletype = str(tdms_chan_obj.properties['NI_Scale[0]_Scale_Type'])
+            # The NI_Scale properties are compiled by tdms_scale (same as TDMSFile)
+            scalingFn = compile_scale(tdms_chan_obj.properties)
             #Linear calibration scaling,  set cal gain and zero and read raw obc data
-            if scaletype == 'Linear': 
-                cal_gain[obc_col] = scale * tdms_chan_obj.properties[u'NI_Scale[0]_Linear_Slope'] #get cal gains for cal file
-                cal_zero[obc_col] = offset - (tdms_chan_obj.properties[u'NI_Scale[0]_Linear_Y_Intercept']/tdms_chan_obj.properties[u'NI_Scale[0]_Linear_Slope'])  #get cal zeros for cal file
+            if isinstance(scalingFn, LinearScale):
+                cal_gain[obc_col] = scale * scalingFn.slope #get cal gains for cal file
+                cal_zero[obc_col] = offset - (scalingFn.intercept/scalingFn.slope)  #get cal zeros for cal file
                 obc_data[obc_col] = tdms_chan_obj.data  #get tdms raw data for obc file
-            #Linear interpolation scaling between point in Table, define a scipy interpolation function and scale the data, set cal gain = 1 and zero = 0 
-            elif scaletype == 'Table':
-                #import scaled values from the tdms file properties
-                scaled = []
-                i = 0
-                while True:
-                    try:
-                        scaled.append(tdms_chan_obj.properties['NI_Scale[0]_Table_Scaled_Values[' + str(i) + ']'])
-                    except:
-                        break
-                    else:
-                        i += 1
-                #import pre-scaled values from the tmds file properties
-                prescaled = []
-                i = 0
-                while True:
-                    try:
-                        prescaled.append(tdms_chan_obj.properties['NI_Scale[0]_Table_Pre_Scaled_Values[' + str(i) + ']'])
-                    except:
-                        break
-                    else:
-                        i += 1
-                scalingFn = interp1d(prescaled, scaled, bounds_error=False)
+            #Linear interpolation scaling between point in Table, scale the data with the table, set cal gain = 1 and zero = 0 
+            elif isinstance(scalingFn, TableScale):
                 cal_gain[obc_col] = scale #Set the gain to 1.0 for the cal file
                 cal_zero[obc_col] = offset  #Set the zero to 0.0 for the cal file
                 obc_data[obc_col] = scalingFn(tdms_chan_obj.data)  #get tdms raw data for obc file and scale it using the scaling function
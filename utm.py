@@ -1,7 +1,8 @@
 import math
+import numpy as np
 from utm_error import OutOfRangeError
 
-__all__ = ['to_latlon', 'from_latlon']
+__all__ = ['to_latlon', 'from_latlon', 'to_latlon_array', 'from_latlon_array']
 
 K0 = 0.9996
 
@@ -164,6 +165,151 @@ def from_latlon(latitude, longitude):
     return easting, northing, zone_number, zone_letter
 
 
+def to_latlon_array(easting, northing, zone_number, zone_letter=None, northern=None):
+    """ to_latlon for whole tracks.  easting and northing are arrays, the
+        zone number, letter or northern flag one value or one per fix.
+        Returns the (latitude, longitude) arrays.
+    """
+    if isinstance(zone_letter, str) and not zone_letter:
+        zone_letter = None
+
+    if zone_letter is None and northern is None:
+        raise ValueError('either zone_letter or northern needs to be set')
+
+    elif zone_letter is not None and northern is not None:
+        raise ValueError('set either zone_letter or northern, but not both')
+
+    easting = np.asarray(easting, dtype=float)
+    northing = np.asarray(northing, dtype=float)
+    zone_number = np.asarray(zone_number)
+
+    if not np.all((100000 <= easting) & (easting < 1000000)):
+        raise OutOfRangeError('easting out of range (must be between 100.000 m and 999.999 m)')
+    if not np.all((0 <= northing) & (northing <= 10000000)):
+        raise OutOfRangeError('northing out of range (must be between 0 m and 10.000.000 m)')
+    if not np.all((1 <= zone_number) & (zone_number <= 60)):
+        raise OutOfRangeError('zone number out of range (must be between 1 and 60)')
+
+    if zone_letter is not None:
+        zone_letter = np.char.upper(np.asarray(zone_letter, dtype=str))
+
+        if not np.all((zone_letter >= 'C') & (zone_letter <= 'X') &
+                      (zone_letter != 'I') & (zone_letter != 'O')):
+            raise OutOfRangeError('zone letter out of range (must be between C and X)')
+
+        northern = (zone_letter >= 'N')
+
+    x = easting - 500000
+    y = np.where(northern, northing, northing - 10000000)
+
+    m = y / K0
+    mu = m / (R * M1)
+
+    p_rad = (mu +
+             P2 * np.sin(2 * mu) +
+             P3 * np.sin(4 * mu) +
+             P4 * np.sin(6 * mu) +
+             P5 * np.sin(8 * mu))
+
+    p_sin = np.sin(p_rad)
+    p_sin2 = p_sin * p_sin
+
+    p_cos = np.cos(p_rad)
+
+    p_tan = p_sin / p_cos
+    p_tan2 = p_tan * p_tan
+    p_tan4 = p_tan2 * p_tan2
+
+    ep_sin = 1 - E * p_sin2
+    ep_sin_sqrt = np.sqrt(1 - E * p_sin2)
+
+    n = R / ep_sin_sqrt
+    r = (1 - E) / ep_sin
+
+    c = _E * p_cos**2
+    c2 = c * c
+
+    d = x / (n * K0)
+    d2 = d * d
+    d3 = d2 * d
+    d4 = d3 * d
+    d5 = d4 * d
+    d6 = d5 * d
+
+    latitude = (p_rad - (p_tan / r) *
+                (d2 / 2 -
+                 d4 / 24 * (5 + 3 * p_tan2 + 10 * c - 4 * c2 - 9 * E_P2)) +
+                 d6 / 720 * (61 + 90 * p_tan2 + 298 * c + 45 * p_tan4 - 252 * E_P2 - 3 * c2))
+
+    longitude = (d -
+                 d3 / 6 * (1 + 2 * p_tan2 + c) +
+                 d5 / 120 * (5 - 2 * c + 28 * p_tan2 - 3 * c2 + 8 * E_P2 + 24 * p_tan4)) / p_cos
+
+    return (np.degrees(latitude),
+            np.degrees(longitude) + zone_number_to_central_longitude(zone_number))
+
+
+def from_latlon_array(latitude, longitude, force_zone_number=None):
+    """ from_latlon for whole tracks.  Returns the (easting, northing,
+        zone_number, zone_letter) arrays, the zones are per fix unless
+        force_zone_number is given (e.g. the zone of the first fix, to
+        keep a track that crosses a zone boundary continuous).
+    """
+    latitude = np.asarray(latitude, dtype=float)
+    longitude = np.asarray(longitude, dtype=float)
+
+    if not np.all((-80.0 <= latitude) & (latitude <= 84.0)):
+        raise OutOfRangeError('latitude out of range (must be between 80 deg S and 84 deg N)')
+    if not np.all((-180.0 <= longitude) & (longitude <= 180.0)):
+        raise OutOfRangeError('northing out of range (must be between 180 deg W and 180 deg E)')
+
+    lat_rad = np.radians(latitude)
+    lat_sin = np.sin(lat_rad)
+    lat_cos = np.cos(lat_rad)
+
+    lat_tan = lat_sin / lat_cos
+    lat_tan2 = lat_tan * lat_tan
+    lat_tan4 = lat_tan2 * lat_tan2
+
+    lon_rad = np.radians(longitude)
+
+    if force_zone_number is None:
+        zone_number = latlon_to_zone_number_array(latitude, longitude)
+    else:
+        zone_number = np.full(latitude.shape, force_zone_number)
+    central_lon = zone_number_to_central_longitude(zone_number)
+    central_lon_rad = np.radians(central_lon)
+
+    zone_letter = latitude_to_zone_letter_array(latitude)
+
+    n = R / np.sqrt(1 - E * lat_sin**2)
+    c = E_P2 * lat_cos**2
+
+    a = lat_cos * (lon_rad - central_lon_rad)
+    a2 = a * a
+    a3 = a2 * a
+    a4 = a3 * a
+    a5 = a4 * a
+    a6 = a5 * a
+
+    m = R * (M1 * lat_rad -
+             M2 * np.sin(2 * lat_rad) +
+             M3 * np.sin(4 * lat_rad) -
+             M4 * np.sin(6 * lat_rad))
+
+    easting = K0 * n * (a +
+                        a3 / 6 * (1 - lat_tan2 + c) +
+                        a5 / 120 * (5 - 18 * lat_tan2 + lat_tan4 + 72 * c - 58 * E_P2)) + 500000
+
+    northing = K0 * (m + n * lat_tan * (a2 / 2 +
+                                        a4 / 24 * (5 - lat_tan2 + 9 * c + 4 * c**2) +
+                                        a6 / 720 * (61 - 58 * lat_tan2 + lat_tan4 + 600 * c - 330 * E_P2)))
+
+    northing = np.where(latitude < 0, northing + 10000000, northing)
+
+    return easting, northing, zone_number, zone_letter
+
+
 def latitude_to_zone_letter(latitude):
     for lat_min, zone_letter in ZONE_LETTERS:
         if latitude >= lat_min:
@@ -189,5 +335,32 @@ def latlon_to_zone_number(latitude, longitude):
     return int((longitude + 180) / 6) + 1
 
 
+# The band edges and letters of ZONE_LETTERS in ascending order
+_ZONE_EDGES = np.array([lat_min for lat_min, zone_letter in reversed(ZONE_LETTERS)])
+_ZONE_BANDS = np.array([zone_letter for lat_min, zone_letter in reversed(ZONE_LETTERS)],
+                       dtype=object)
+
+
+def latitude_to_zone_letter_array(latitude):
+    band = np.searchsorted(_ZONE_EDGES, latitude, side='right') - 1
+    # Below the last edge is out of the bands too
+    return _ZONE_BANDS[np.where(band < 0, len(_ZONE_EDGES) - 1, band)]
+
+
+def latlon_to_zone_number_array(latitude, longitude):
+    latitude = np.asarray(latitude)
+    longitude = np.asarray(longitude)
+    zone_number = np.trunc((longitude + 180) / 6).astype(int) + 1
+
+    norway = (56 <= latitude) & (latitude <= 64) & (3 <= longitude) & (longitude <= 12)
+    svalbard = (72 <= latitude) & (latitude <= 84) & (longitude >= 0)
+    return np.select([norway,
+                      svalbard & (longitude <= 9),
+                      svalbard & (longitude <= 21),
+                      svalbard & (longitude <= 33),
+                      svalbard & (longitude <= 42)],
+                     [32, 31, 33, 35, 37], zone_number)
+
+
 def zone_number_to_central_longitude(zone_number):
     return (zone_number - 1) * 6 - 180 + 3
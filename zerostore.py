@@ -0,0 +1,193 @@
+# zerostore.py
+#
+# Copyright (C) 2024 - Samuel J. Cubbage
+#
+# This program is part of the Autonomous Model Software Tools Package
+#
+"""
+    zerostore.py - Per directory store of the special gauge zeros
+
+    The gauge zeros (CFx_z ... CMz_z) come from a pass over the zeros
+    section of a run and only depend on the run file, its cal and the
+    gauge cal values.  They are kept in small JSON files next to the runs
+    (am_zeros/<run file>.json) so that reloads, merges and re-plots can
+    skip the zero pass.  There is one file per run so that processes
+    loading different runs of a directory at the same time (e.g. the
+    phaseavg workers) never write the same file.
+
+    Each run entry is keyed by the run file identity (size and mtime), the
+    contents of its side files (.cal, .run, tdms_to_obc.cal ...) and the
+    source of the processing modules, and each gauge by the signature of
+    its cal dictionary (dynos_array.cal_signature), so a changed cal is
+    simply a miss.  cal_patch also drops the entries of the runs it patches.
+    Zeros that are not finite (a NaN in the zeros section) are not stored.
+
+    Environment:
+        AM_ZEROS - set to 0/off/no to disable the store
+
+    CLASSES:
+    ZeroStore - The stored zeros of the runs in one directory
+
+    FUNCTIONS:
+    run_key    - Builds the key for a run file and its side files
+    get_store  - Returns the ZeroStore for a directory (None if disabled)
+    invalidate - Drops the stored zeros affected by a cal file
+"""
+
+import os
+import json
+import math
+import hashlib
+
+import runcache
+
+# Bump this when the layout of the store changes
+STORE_VERSION = 2
+
+# The directory of the store, one <run file>.json per run
+STORE_NAME = 'am_zeros'
+
+# The zeros of a gauge, in the order they are stored
+ZERO_ATTRS = ['CFx_z', 'CFy_z', 'CFz_z', 'CMx_z', 'CMy_z', 'CMz_z']
+
+
+def run_key(fullname, depends=()):
+    """ Returns the key for the run file fullname.  depends is a list of
+        side files that feed the zeros, missing files hash as missing.
+    """
+    sig = hashlib.sha1()
+    sig.update(('%d:%s\n' % (STORE_VERSION, runcache.code_signature())).encode())
+    stat = os.stat(fullname)
+    sig.update(('%s:%d:%d\n' % (os.path.basename(fullname), stat.st_size,
+                                stat.st_mtime_ns)).encode())
+    for name in depends:
+        sig.update(('%s\n' % os.path.basename(name)).encode())
+        try:
+            with open(name, 'rb') as f:
+                sig.update(hashlib.sha1(f.read()).digest())
+        except:
+            sig.update(b'missing')
+    return sig.hexdigest()
+
+
+class ZeroStore:
+    """ The stored zeros of the runs in one directory.  Each run file has
+        its own am_zeros/<run file>.json holding
+            {"version": 2,
+             "key": <run key>,
+             "gauges": {<gauge>: {"cal": <cal signature>,
+                                  "zeros": [CFx_z ... CMz_z]}}}
+
+        Public Methods are:
+            restore : Sets the stored zeros on a list of gauges
+            save    : Stores the zeros of a list of gauges
+            drop    : Removes the stored zeros of a run (or all runs)
+            runs    : Returns the run files with stored zeros
+    """
+
+    def __init__(self, dirname):
+        self.dirname = os.path.join(dirname, STORE_NAME)
+
+    def restore(self, run, key, gauges):
+        """ Sets the zeros of gauges, a list of (name, gauge), from the
+            entry of the run file run.  Returns True only if all of them
+            were stored under key and the current gauge cals.
+        """
+        entry = self._read(run)
+        if entry is None or entry.get('key') != key:
+            return False
+        found = []
+        for name, gauge in gauges:
+            stored = entry['gauges'].get(name)
+            if stored is None or stored.get('cal') != getattr(gauge, 'calsig', None):
+                return False
+            found.append(stored['zeros'])
+        for (name, gauge), zeros in zip(gauges, found):
+            for attr, value in zip(ZERO_ATTRS, zeros):
+                setattr(gauge, attr, value)
+        return True
+
+    def save(self, run, key, gauges):
+        """ Stores the zeros of gauges, a list of (name, gauge), for the
+            run file run under key.  Gauges with zeros that are not finite
+            are left out, they would come back on every load.  Failures
+            are ignored, the store is only an accelerator.
+        """
+        gauges = [(name, gauge) for name, gauge in gauges
+                  if all(math.isfinite(getattr(gauge, attr)) for attr in ZERO_ATTRS)]
+        if not gauges:
+            return
+        entry = self._read(run)
+        if entry is None or entry.get('key') != key:
+            entry = {'version': STORE_VERSION, 'key': key, 'gauges': {}}
+        for name, gauge in gauges:
+            entry['gauges'][name] = {'cal': getattr(gauge, 'calsig', None),
+                                     'zeros': [float(getattr(gauge, attr)) for attr in ZERO_ATTRS]}
+        self._write(run, entry)
+
+    def drop(self, run=None):
+        """ Removes the entries of the run with base name run (any
+            extension), or of all runs if run is None
+        """
+        for name in self.runs():
+            if run is None or os.path.splitext(name)[0] == run:
+                try:
+                    os.remove(self._filename(name))
+                except:
+                    pass
+
+    def runs(self):
+        """ Returns the run files that have an entry """
+        try:
+            names = os.listdir(self.dirname)
+        except:
+            return []
+        return [name[:-len('.json')] for name in names if name.endswith('.json')]
+
+    def _filename(self, run):
+        return os.path.join(self.dirname, run + '.json')
+
+    def _read(self, run):
+        """ Returns the entry of run, None if missing or stale """
+        try:
+            with open(self._filename(run), 'r') as f:
+                entry = json.load(f)
+            if entry.get('version') == STORE_VERSION:
+                return entry
+        except:
+            pass
+        return None
+
+    def _write(self, run, entry):
+        """ Replaces the entry file of run (e.g. read only data dirs just fail) """
+        filename = self._filename(run)
+        tmpname = '%s.tmp%d' % (filename, os.getpid())
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            with open(tmpname, 'w') as f:
+                json.dump(entry, f, indent=1)
+            os.replace(tmpname, filename)
+        except:
+            try:
+                os.remove(tmpname)
+            except:
+                pass
+
+
+def get_store(dirname):
+    """ Returns the ZeroStore for dirname, or None if it is disabled """
+    if os.environ.get('AM_ZEROS', '1').lower() in ['0', 'off', 'no', 'false']:
+        return None
+    return ZeroStore(dirname)
+
+
+def invalidate(calfile):
+    """ Drops the stored zeros that depend on calfile.  A run cal
+        (run-N.cal) affects run-N, a shared cal (tdms_to_obc.cal) every
+        run in the directory.
+    """
+    dirname, name = os.path.split(os.path.abspath(calfile))
+    name = os.path.splitext(name)[0]
+    store = ZeroStore(dirname)
+    runs = [os.path.splitext(run)[0] for run in store.runs()]
+    store.drop(name if name in runs or name.startswith('run') else None)